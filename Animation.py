@@ -0,0 +1,561 @@
+"""
+Keyframe animation of Component angles.
+
+A Clip stores keyframes per joint. To evaluate every joint at once, the clip is baked onto the union of all key times:
+both interpolations are linear in the segment parameter, so inserting the other joints' key times into a joint's
+track does not change its curve. An Animation plays a Clip on one or more instances of the same linkage, either by
+interpolating the Euler angles or by slerping the rotation of every joint, and a Timeline advances its animations
+with a fixed time step.
+"""
+
+import time
+
+import numpy as np
+
+from Quaternion import QuaternionArray
+
+EULER = "euler"  # interpolate the u, v, w angles, rotate extents apply
+SLERP = "slerp"  # interpolate rotations, drawn through Component.setQuaternion
+
+
+class Clip:
+    """
+    Keyframes of the u, v, w angles of jointCount joints, e.g. the componentList of a ModelLinkage
+    """
+    jointCount = None
+    loop = True
+    tracks = None  # list of {time: (3,) angles}, one per joint
+
+    times = None  # (K,) key times of all joints, sorted; set by bake
+    angles = None  # (K, J, 3) angles of every joint at those times
+    keyed = None  # (J,) bool, joints with at least one key
+    baked = False
+
+    def __init__(self, jointCount, loop=True):
+        """
+        :param jointCount: number of joints animated by this clip
+        :type jointCount: int
+        :param loop: wrap around after the last key instead of holding it
+        :type loop: bool
+        """
+        self.jointCount = jointCount
+        self.loop = loop
+        self.tracks = [{} for _ in range(jointCount)]
+
+    @classmethod
+    def fromPoses(cls, poses, interval=1.0, loop=True):
+        """
+        One key for every joint every interval seconds. A looping clip goes back to the first pose at the end
+
+        :param poses: (P, J, 3) angles in degrees, e.g. Sketch.poses
+        :type poses: list or numpy.ndarray
+        :param interval: seconds between two poses
+        :type interval: float
+        :rtype: Clip
+        """
+        poses = np.asarray(poses, dtype=np.float64)
+        clip = cls(poses.shape[1], loop)
+        if loop:
+            poses = np.concatenate([poses, poses[:1]])
+        for i, pose in enumerate(poses):
+            for joint, angles in enumerate(pose):
+                clip.setKey(joint, i * interval, angles)
+        return clip
+
+    def setKey(self, joint, keyTime, angles):
+        """
+        :param joint: joint index
+        :type joint: int
+        :param keyTime: seconds
+        :type keyTime: float
+        :param angles: u, v, w angles in degrees
+        :type angles: list or numpy.ndarray
+        """
+        angles = np.asarray(angles, dtype=np.float64)
+        if angles.shape != (3,):
+            raise TypeError(f"key angles should have shape (3,), not {angles.shape}")
+        self.tracks[joint][float(keyTime)] = angles.copy()
+        self.baked = False
+
+    def removeKey(self, joint, keyTime):
+        self.tracks[joint].pop(float(keyTime), None)
+        self.baked = False
+
+    def jointKeys(self, joint):
+        """
+        :return: ((Kj,) sorted key times, (Kj, 3) angles) of one joint
+        :rtype: tuple
+        """
+        track = self.tracks[joint]
+        keyTimes = np.array(sorted(track), dtype=np.float64)
+        return keyTimes, np.array([track[t] for t in keyTimes]).reshape(-1, 3)
+
+    def bake(self):
+        """
+        Resample every joint onto the key times of all joints. Joints without keys stay at 0
+        """
+        if self.baked:
+            return
+        keyTimes = sorted(set().union(*self.tracks))
+        if not keyTimes:
+            raise Exception("clip has no keys")
+        if len(keyTimes) == 1:
+            # a single segment of length 0, evaluated as a constant
+            keyTimes = keyTimes * 2
+        self.times = np.array(keyTimes)
+        self.angles = np.zeros((len(self.times), self.jointCount, 3))
+        self.keyed = np.zeros(self.jointCount, dtype=bool)
+        for joint in range(self.jointCount):
+            jointTimes, jointAngles = self.jointKeys(joint)
+            if len(jointTimes) == 0:
+                continue
+            self.keyed[joint] = True
+            for axis in range(3):
+                # holds the first and last key outside the joint's own keys
+                self.angles[:, joint, axis] = np.interp(self.times, jointTimes, jointAngles[:, axis])
+        self.baked = True
+
+    def duration(self):
+        self.bake()
+        return self.times[-1] - self.times[0]
+
+
+class Animation:
+    """
+    Plays a Clip on M instances of a linkage. All M * J joints are evaluated with one segment lookup per instance and
+    a handful of array operations, then written into the FlatScene the components are attached to (or into the
+    components one at a time when there is none)
+    """
+    clip = None
+    components = None  # list<Component>, M * J instance after instance, or J of a single instance
+    posing = True  # components hold every instance, apply writes into them
+    interpolation = EULER
+    offsets = None  # (M,) time offset of each instance
+    time = 0.0  # time of the last evaluation
+
+    times = None  # (K,) baked key times
+    segmentStarts = None  # (K - 1,) start of each segment, -inf for the first
+    segmentEnds = None  # (K - 1,) end of each segment, inf for the last
+    spans = None  # (K - 1,) segment lengths, 1 for empty segments
+    segments = None  # (M,) cached segment of each instance
+    segmentLookups = 0  # instances whose cached segment missed, searched again
+
+    keyAngles = None  # (K, J, 3) clamped to the rotate extents
+    keyDeltas = None  # (K - 1, J, 3) change of the angles over each segment
+    # rotations are blended in float32, numpy's float64 sin is several times slower
+    keyQuats = None  # (4, K, J) float32, component-major, consecutive keys on the same hemisphere
+    theta = None  # (K - 1, J) float32 angle between the quaternions at both ends of each segment, at least 1e-3
+    invSin = None  # (K - 1, J) float32 1 / sin(theta)
+    blend = None  # (3, 4, M, J) float32 scratch space
+
+    angles = None  # (M, J, 3) result of the last evaluation in EULER mode
+    quats = None  # QuaternionArray of M * J rows, result of the last evaluation in SLERP mode
+    quatBuffer = None  # (4, M, J) float64, self.quats.data is a transposed view of it
+    rows = None  # rows of components animated by the clip
+    scene = None  # FlatScene the components were last found in
+    sceneComponents = None  # scene.components when sceneRows was computed
+    sceneRows = None  # scene indices of components[rows]
+
+    def __init__(self, clip, components, interpolation=EULER, offsets=None):
+        """
+        :param clip: keyframes of one instance
+        :type clip: Clip
+        :param components: M instances of clip.jointCount components each; angle limits and rotation axes are taken
+                           from the first instance. With offsets, a single instance can stand for all M: the
+                           animation is then only evaluated, e.g. by a Crowd
+        :type components: list
+        :param interpolation: EULER or SLERP. In SLERP mode each animated component draws its rotation from a row of
+                              self.quats through Component.setQuaternion until detach is called
+        :type interpolation: string
+        :param offsets: (M,) seconds added to the time of each instance, zeros if None
+        :type offsets: numpy.ndarray
+        """
+        if interpolation not in (EULER, SLERP):
+            raise TypeError(f"interpolation should be {EULER} or {SLERP}, not {interpolation}")
+        clip.bake()
+        jointCount = clip.jointCount
+        if len(components) == 0 or len(components) % jointCount != 0:
+            raise TypeError(f"components should hold a multiple of {jointCount} components, not {len(components)}")
+        instances = len(components) // jointCount if offsets is None else len(offsets)
+        if len(components) not in (jointCount, instances * jointCount):
+            raise TypeError(f"components should hold {jointCount} or {instances * jointCount} components, "
+                            f"not {len(components)}")
+        self.clip = clip
+        self.components = list(components)
+        self.posing = len(components) == instances * jointCount
+        self.interpolation = interpolation
+        self.offsets = np.zeros(instances) if offsets is None else np.asarray(offsets, dtype=np.float64)
+        if self.offsets.shape != (instances,):
+            raise TypeError(f"offsets should have shape ({instances},), not {self.offsets.shape}")
+
+        self.times = clip.times
+        self.segmentStarts = self.times[:-1].copy()
+        self.segmentStarts[0] = -np.inf
+        self.segmentEnds = self.times[1:].copy()
+        self.segmentEnds[-1] = np.inf
+        spans = np.diff(self.times)
+        self.spans = np.where(spans > 0, spans, 1.0)
+        self.segments = np.zeros(instances, dtype=np.int64)
+        self.rows = np.flatnonzero(np.tile(clip.keyed, len(components) // jointCount))
+
+        ranges = np.array([c.angleRanges for c in self.components[:jointCount]])
+        self.keyAngles = np.clip(clip.angles, ranges[:, :, 0], ranges[:, :, 1])
+        self.keyDeltas = np.diff(self.keyAngles, axis=0)
+        self.angles = np.zeros((instances, jointCount, 3))
+        if interpolation == SLERP:
+            self.bakeRotations(ranges)
+            self.blend = np.empty((3, 4, instances, jointCount), dtype=np.float32)
+            self.quatBuffer = np.empty((4, instances, jointCount))
+            self.quats = QuaternionArray(self.quatBuffer.reshape(4, -1).T)
+            self.evaluate(0.0)
+            if self.posing:
+                for row in self.rows:
+                    self.components[row].setQuaternion(self.quats[int(row)])
+
+    def bakeRotations(self, ranges):
+        """
+        Key rotations of every joint on the baked times. Each joint is slerped between its own keys, so joints keyed
+        less often than others follow the same arcs as if they were evaluated alone
+        """
+        clip = self.clip
+        keyCount, jointCount = len(self.times), clip.jointCount
+        axes = np.array([[c.uAxis.getCoords(), c.vAxis.getCoords(), c.wAxis.getCoords()]
+                         for c in self.components[:jointCount]], dtype=np.float64)
+        keyQuats = np.zeros((keyCount, jointCount, 4))
+        keyQuats[:, :, 0] = 1
+        for joint in np.flatnonzero(clip.keyed):
+            jointTimes, jointAngles = clip.jointKeys(joint)
+            jointAngles = np.clip(jointAngles, ranges[joint, :, 0], ranges[joint, :, 1])
+            u, v, w = (QuaternionArray.fromAxisAngle(axes[joint, i], jointAngles[:, i]) for i in range(3))
+            # Component.updateLocal applies the transpose of a quaternion's matrix: conj(w u v) rotates like w u v
+            rotations = w.multiply(u).multiply(v).conjugate()
+            if len(jointTimes) == 1:
+                keyQuats[:, joint] = rotations.data
+                continue
+            t = np.clip(self.times, jointTimes[0], jointTimes[-1])
+            segment = np.clip(np.searchsorted(jointTimes, t, side="right") - 1, 0, len(jointTimes) - 2)
+            u = (t - jointTimes[segment]) / (jointTimes[segment + 1] - jointTimes[segment])
+            keyQuats[:, joint] = rotations[segment].slerp(rotations[segment + 1], u).data
+
+        for k in range(1, keyCount):
+            flip = (keyQuats[k] * keyQuats[k - 1]).sum(axis=1) < 0
+            keyQuats[k, flip] *= -1
+        dot = np.minimum((keyQuats[:-1] * keyQuats[1:]).sum(axis=2), 1.0)
+        # ends closer than 1e-3 rad are blended as if they were that far apart: the weights stay finite and within
+        # 2e-7 of nlerp, so no fallback is needed while evaluating
+        theta = np.maximum(np.arccos(dot), 1e-3)
+        self.keyQuats = np.ascontiguousarray(keyQuats.transpose(2, 0, 1), dtype=np.float32)
+        self.theta = theta.astype(np.float32)
+        self.invSin = (1 / np.sin(theta)).astype(np.float32)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def localTimes(self, t):
+        """
+        :return: (M,) clip time of every instance at time t, wrapped or clamped to the keys
+        :rtype: numpy.ndarray
+        """
+        start, end = self.times[0], self.times[-1]
+        t = t + self.offsets
+        if self.clip.loop and end > start:
+            return start + np.mod(t - start, end - start)
+        return np.clip(t, start, end)
+
+    def segmentIndices(self, t):
+        """
+        Segment of every instance at clip times t. Playback mostly stays in the cached segment; only instances that
+        left it, e.g. after scrubbing, are searched again
+
+        :param t: (M,) clip times
+        :type t: numpy.ndarray
+        :rtype: numpy.ndarray
+        """
+        segments = self.segments
+        missed = (t < self.segmentStarts[segments]) | (t >= self.segmentEnds[segments])
+        if missed.any():
+            found = np.searchsorted(self.times, t[missed], side="right") - 1
+            segments[missed] = np.clip(found, 0, len(self.times) - 2)
+            self.segmentLookups += int(np.count_nonzero(missed))
+        return segments
+
+    def evaluate(self, t):
+        """
+        Interpolate every joint of every instance at time t, into self.angles or self.quats
+
+        :param t: seconds
+        :type t: float
+        :return: None
+        """
+        self.time = t
+        localTimes = self.localTimes(t)
+        segments = self.segmentIndices(localTimes)
+        u = (localTimes - self.times[segments]) / self.spans[segments]
+        if self.interpolation == EULER:
+            np.multiply(self.keyDeltas[segments], u[:, None, None], out=self.angles)
+            self.angles += self.keyAngles[segments]
+            return
+
+        u = u.astype(np.float32)[:, None]
+        theta = self.theta[segments]
+        invSin = self.invSin[segments]
+        w0 = np.sin((1 - u) * theta)
+        w0 *= invSin
+        w1 = np.sin(u * theta)
+        w1 *= invSin
+
+        start, end, result = self.blend
+        np.take(self.keyQuats, segments, axis=1, out=start)
+        np.take(self.keyQuats, segments + 1, axis=1, out=end)
+        np.multiply(start, w0, out=result)
+        np.multiply(end, w1, out=end)
+        result += end
+        np.copyto(self.quatBuffer, result)
+
+    def findScene(self):
+        """
+        :return: the FlatScene holding every component, None if there is none
+        :rtype: FlatScene.FlatScene
+        """
+        scene = self.components[0].scene
+        if scene is None:
+            return None
+        if scene.structureDirty:
+            scene.build()
+        if scene is not self.scene or scene.components is not self.sceneComponents:
+            self.scene = None
+            if not all(c.scene is scene for c in self.components):
+                return None
+            self.scene = scene
+            self.sceneComponents = scene.components
+            self.sceneRows = np.array([self.components[row].sceneIndex for row in self.rows], dtype=np.int64)
+        return scene
+
+    def apply(self):
+        """
+        Write the last evaluation into the components. They are only flagged, the next update recomputes them
+        """
+        if not self.posing:
+            raise Exception("this animation has components for one of its instances only, it can only be evaluated")
+        scene = self.findScene()
+        if self.interpolation == EULER:
+            angles = self.angles.reshape(-1, 3)[self.rows]
+            if scene is not None:
+                scene.angles[self.sceneRows] = angles
+                scene.markDirty(self.sceneRows)
+            else:
+                for row, rowAngles in zip(self.rows, angles):
+                    c = self.components[row]
+                    c.angles[:] = rowAngles
+                    c.markLocalDirty()
+        elif scene is not None:
+            # the components already read self.quats, only the scene's copy of their rotation is refreshed
+            rotations = QuaternionArray(self.quats.data[self.rows]).toMatrix()[:, 0:3, 0:3]
+            scene.quatRotation[self.sceneRows] = rotations.transpose(0, 2, 1)
+            scene.markDirty(self.sceneRows)
+        else:
+            for row in self.rows:
+                self.components[row].markLocalDirty()
+
+    def seek(self, t):
+        self.evaluate(t)
+        self.apply()
+
+    def detach(self):
+        """
+        Give the components back their Euler angles in SLERP mode
+        """
+        if self.interpolation == SLERP and self.posing:
+            for row in self.rows:
+                self.components[row].clearQuaternion()
+
+
+class Timeline:
+    """
+    Fixed-timestep clock driving animations. Wall time is accumulated and consumed in whole steps, so playback does
+    not depend on the jitter of the timer calling tick. Animations are evaluated once per tick, at the last step
+    """
+    step = 1 / 60  # seconds per step
+    maxSteps = 8  # steps taken at most per tick, the rest is dropped after a stall
+    speed = 1.0
+    time = 0.0
+    accumulator = 0.0
+    playing = False
+    lastTick = None  # time.perf_counter() of the last tick
+    animations = None
+
+    def __init__(self, step=1 / 60):
+        """
+        :param step: seconds per step
+        :type step: float
+        """
+        self.step = step
+        self.animations = []
+
+    def add(self, animation):
+        """
+        The animation is posed from the next step or seek on
+        """
+        self.animations.append(animation)
+
+    def clear(self):
+        for animation in self.animations:
+            # anything else with a seek, e.g. a Crowd, leaves nothing behind on its components
+            if isinstance(animation, Animation):
+                animation.detach()
+        self.animations = []
+
+    def play(self):
+        self.playing = True
+        self.lastTick = None
+
+    def pause(self):
+        self.playing = False
+        self.accumulator = 0.0
+
+    def stop(self):
+        """
+        Pause and rewind to 0, leaving the components in their current pose
+        """
+        self.pause()
+        self.time = 0.0
+
+    def toggle(self):
+        if self.playing:
+            self.pause()
+        else:
+            self.play()
+
+    def seek(self, t):
+        """
+        Jump to time t and pose every animation there, playing or not
+        """
+        self.time = t
+        self.accumulator = 0.0
+        for animation in self.animations:
+            animation.seek(t)
+
+    def tick(self, now=None):
+        """
+        Advance by the wall time elapsed since the last tick, e.g. from the canvas timer
+
+        :param now: time.perf_counter() if None
+        :type now: float
+        :return: True if the animations were posed again
+        :rtype: bool
+        """
+        if now is None:
+            now = time.perf_counter()
+        elapsed = 0.0 if self.lastTick is None else now - self.lastTick
+        self.lastTick = now
+        return self.advance(elapsed)
+
+    def advance(self, elapsed):
+        """
+        :param elapsed: wall seconds
+        :type elapsed: float
+        :return: True if at least one step was taken
+        :rtype: bool
+        """
+        if not self.playing:
+            return False
+        self.accumulator += elapsed * self.speed
+        steps = int(self.accumulator / self.step)
+        if steps == 0:
+            return False
+        self.accumulator -= steps * self.step
+        if steps > self.maxSteps:
+            steps = self.maxSteps
+            self.accumulator = 0.0
+        self.time += steps * self.step
+        for animation in self.animations:
+            animation.seek(self.time)
+        return True
+
+
+if __name__ == "__main__":
+    from Component import Component
+    from FlatScene import FlatScene
+    from ModelLinkage import ModelLinkage
+    from Point import Point
+
+    def best(f, rounds=200):
+        times = []
+        for _ in range(rounds):
+            t1 = time.perf_counter()
+            f()
+            times.append(time.perf_counter() - t1)
+        return min(times) * 1e6
+
+    poses = np.random.default_rng(0).uniform(-60, 60, (5, 27, 3))
+    clip = Clip.fromPoses(poses, 1.0)
+
+    # a single crab: keys are hit exactly and both modes agree there
+    root = Component(Point((0, 0, 0)))
+    model = ModelLinkage(None, Point((0, 0, 0)), None)
+    root.addChild(model)
+    euler = Animation(clip, model.componentList)
+    for i, pose in enumerate(poses):
+        euler.seek(float(i))
+        model.applyPose(pose)
+        assert np.allclose(euler.angles[0], [c.angles for c in model.componentList])
+    root.update(np.identity(4))
+    reference = np.array([c.transformationMat for c in model.componentList])
+    slerp = Animation(clip, model.componentList, SLERP)
+    slerp.seek(4.0)
+    root.update(np.identity(4))
+    assert np.allclose([c.transformationMat for c in model.componentList], reference, atol=1e-6)
+    slerp.detach()
+
+    # 1000 crabs in a FlatScene, each with its own time offset
+    crabs = 1000
+    root = Component(Point((0, 0, 0)))
+    models = [ModelLinkage(None, Point((0, 0, 0)), None) for _ in range(crabs)]
+    for m in models:
+        root.addChild(m)
+    components = [c for m in models for c in m.componentList]
+    offsets = np.random.default_rng(1).uniform(0, clip.duration(), crabs)
+    scene = FlatScene(root)
+    scene.update(np.identity(4))
+    print(f"{crabs} crabs, {len(components)} joints, {len(clip.times)} keys (best of 200):")
+
+    for mode in (EULER, SLERP):
+        animation = Animation(clip, components, mode, offsets)
+        frame = [0]
+
+        def play():
+            frame[0] += 1
+            animation.evaluate(frame[0] / 60)
+
+        playTime = best(play)
+        lookups = animation.segmentLookups
+        scrubTimes = np.random.default_rng(2).uniform(-10, 10, 200)
+        scrub = iter(scrubTimes)
+        scrubTime = best(lambda: animation.evaluate(next(scrub)))
+
+        def frameWithUpdate():
+            play()
+            animation.apply()
+            scene.update(np.identity(4))
+
+        fullTime = best(frameWithUpdate)
+        print(f"  {mode}: evaluate {playTime:6.1f} us playing, {scrubTime:6.1f} us scrubbing;"
+              f" + apply + FlatScene.update {fullTime:8.1f} us")
+
+        # cached segments give the same result as searching every instance
+        animation.evaluate(3.7)
+        cached = (animation.angles if mode == EULER else animation.quats.data).copy()
+        animation.segments[:] = 0
+        animation.evaluate(3.7)
+        assert np.array_equal(cached, animation.angles if mode == EULER else animation.quats.data)
+        if mode == SLERP:
+            t = animation.localTimes(3.7)
+            segments = np.searchsorted(animation.times, t, side="right") - 1
+            u = np.repeat((t - animation.times[segments]) / animation.spans[segments], clip.jointCount)
+            keyQuats = animation.keyQuats.transpose(1, 2, 0)
+            start = QuaternionArray(keyQuats[segments].reshape(-1, 4))
+            end = QuaternionArray(keyQuats[segments + 1].reshape(-1, 4))
+            assert np.allclose(animation.quats.data, start.slerp(end, u).data, atol=1e-5)
+            assert np.allclose(animation.quats.norm(), 1, atol=1e-6)
+        print(f"  {mode}: {lookups} segment searches over 200 playback frames of {crabs} instances")
+        animation.detach()
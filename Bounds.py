@@ -0,0 +1,227 @@
+"""
+Bounding volumes and view-frustum tests.
+
+Boxes are axis-aligned, given as a (2, 3) array of the min and max corner. Meshes compute a box and a sphere around
+their vertices when loaded (see Displayable.aabb and Displayable.sphere). A Component combines the spheres of its
+subtree into one sphere around its origin that holds the subtree in any pose, so it is only rebuilt when the subtree's
+shape changes, not every time a joint turns (Component.subtreeReach). Leaves are tested again with the world box of
+their mesh (Component.meshBounds).
+"""
+
+import numpy as np
+
+
+def pointBounds(points):
+    """
+    :param points: (N, 3) positions
+    :type points: numpy.ndarray
+    :return: (box, (sphere center, sphere radius)), the sphere centered on the box
+    :rtype: tuple
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    box = np.array((points.min(axis=0), points.max(axis=0)))
+    center = (box[0] + box[1]) * 0.5
+    radius = float(np.sqrt(((points - center) ** 2).sum(axis=1).max()))
+    return box, (center, radius)
+
+
+def scaleBounds(box, sphere, scale):
+    """
+    Bounds of the points scaled by scale, e.g. a unit-size mesh given its size
+
+    :param scale: three scale factors
+    :rtype: tuple
+    """
+    scale = np.asarray(scale, dtype=np.float64)
+    corners = box * scale
+    center, radius = sphere
+    return np.sort(corners, axis=0), (center * scale, radius * float(np.abs(scale).max()))
+
+
+def transformBox(box, transformation):
+    """
+    :param transformation: 4x4 row-major affine transformation
+    :return: box around the transformed box
+    :rtype: numpy.ndarray
+    """
+    linear = transformation[0:3, 0:3]
+    center = linear @ ((box[0] + box[1]) * 0.5) + transformation[0:3, 3]
+    extent = np.abs(linear) @ ((box[1] - box[0]) * 0.5)
+    return np.array((center - extent, center + extent))
+
+
+def linearNorm(linear):
+    """
+    Bound of how much linear stretches a vector, exact for rotations with uniform scaling
+
+    :param linear: 3x3 matrix
+    :rtype: float
+    """
+    # the largest eigenvalue of L^T L is the squared norm, Gershgorin bounds it by the largest absolute row sum
+    return float(np.sqrt(np.abs(linear.T @ linear).sum(axis=1).max()))
+
+
+def unionBoxes(boxes):
+    """
+    :param boxes: non-empty list of boxes
+    :rtype: numpy.ndarray
+    """
+    if len(boxes) == 1:
+        return boxes[0]
+    stacked = np.array(boxes)
+    return np.array((stacked[:, 0].min(axis=0), stacked[:, 1].max(axis=0)))
+
+
+class Frustum:
+    """
+    The six planes bounding what a camera sees, normals pointing inwards
+    """
+    OUTSIDE = 0
+    INTERSECTING = 1
+    INSIDE = 2
+
+    normals = None  # (6, 3)
+    absNormals = None  # (6, 3)
+    offsets = None  # (6,)
+
+    # boxes and spheres tested since the last resetCounters
+    tests = 0
+
+    def __init__(self, projectionMat, viewMat):
+        """
+        :param projectionMat: projection matrix as given to the shader, i.e. column-major, see GLUtility.perspective
+        :param viewMat: viewing matrix as given to the shader, see GLUtility.view
+        """
+        clip = np.asarray(projectionMat).T @ np.asarray(viewMat).T
+        # a point is inside when -w <= x, y, z <= w in clip space
+        planes = np.array((clip[3] + clip[0], clip[3] - clip[0],
+                           clip[3] + clip[1], clip[3] - clip[1],
+                           clip[3] + clip[2], clip[3] - clip[2]))
+        planes /= np.linalg.norm(planes[:, 0:3], axis=1, keepdims=True)
+        self.normals = planes[:, 0:3]
+        self.absNormals = np.abs(self.normals)
+        self.offsets = planes[:, 3]
+
+    def classify(self, box):
+        """
+        :return: OUTSIDE, INTERSECTING or INSIDE
+        :rtype: int
+        """
+        Frustum.tests += 1
+        center = (box[0] + box[1]) * 0.5
+        extent = (box[1] - box[0]) * 0.5
+        distances = self.normals @ center + self.offsets
+        radii = self.absNormals @ extent
+        if (distances < -radii).any():
+            return Frustum.OUTSIDE
+        if (distances >= radii).all():
+            return Frustum.INSIDE
+        return Frustum.INTERSECTING
+
+    def classifySphere(self, center, radius):
+        """
+        :return: OUTSIDE, INTERSECTING or INSIDE
+        :rtype: int
+        """
+        Frustum.tests += 1
+        distances = self.normals @ center + self.offsets
+        if (distances < -radius).any():
+            return Frustum.OUTSIDE
+        if (distances >= radius).all():
+            return Frustum.INSIDE
+        return Frustum.INTERSECTING
+
+    @staticmethod
+    def resetCounters():
+        tests = Frustum.tests
+        Frustum.tests = 0
+        return tests
+
+
+if __name__ == "__main__":
+    import time
+
+    from Component import Component
+    from GLUtility import GLUtility
+    from ModelLinkage import ModelLinkage
+    from Point import Point
+
+    def best(f, rounds=5):
+        times = []
+        for _ in range(rounds):
+            t1 = time.perf_counter()
+            f()
+            times.append(time.perf_counter() - t1)
+        return min(times) * 1000
+
+    def subtree(root):
+        nodes = [root]
+        for c in nodes:
+            nodes.extend(c.children)
+        return nodes
+
+    # every subtree box and reach sphere holds the transformed vertices of its meshes, in any pose
+    rng = np.random.default_rng(0)
+    crab = ModelLinkage(None, Point((0, 0, 0)), None)
+    for pose in range(3):
+        for c in crab.componentList:
+            for axis in (c.AXIS_U, c.AXIS_V, c.AXIS_W):
+                c.setCurrentAngle(rng.uniform(-90, 90), axis)
+        crab.update(np.identity(4))
+        for node in subtree(crab):
+            reach, count = node.subtreeReach()
+            meshes = [c for c in subtree(node) if c.displayObj is not None]
+            assert count == len(meshes)
+            origin = node.transformationMat[0:3, 3]
+            radius = reach * linearNorm(node.transformationMat[0:3, 0:3])
+            if node.displayObj is not None:
+                box = node.meshBounds()
+                positions = node.displayObj.vertices[:, 0:3] @ node.displayObj.sizeMat[0:3, 0:3].T
+                positions = positions @ node.transformationMat[0:3, 0:3].T + node.transformationMat[0:3, 3]
+                assert (positions >= box[0] - 1e-6).all() and (positions <= box[1] + 1e-6).all()
+            for c in meshes:
+                positions = c.displayObj.vertices[:, 0:3] @ c.displayObj.sizeMat[0:3, 0:3].T
+                positions = positions @ c.transformationMat[0:3, 0:3].T + c.transformationMat[0:3, 3]
+                assert (np.linalg.norm(positions - origin, axis=1) <= radius + 1e-6).all()
+
+    # a crowd of crabs on a grid, seen from close to one corner
+    side = 20
+    glutility = GLUtility()
+    projectionMat = glutility.perspective(45, 500, 500, 0.01, 100)
+    viewMat = glutility.view([-side, 1.5, -side + 4], [-side + 4, 0, -side], [0, 1, 0])
+    frustum = Frustum(projectionMat, viewMat)
+    top = Component(Point((0, 0, 0)))
+    crabs = []
+    for i in range(side * side):
+        crab = ModelLinkage(None, Point((2.0 * (i % side) - side, 0, 2.0 * (i // side) - side)), None)
+        top.addChild(crab)
+        crabs.append(crab)
+    top.update(np.identity(4))
+    components = len(subtree(top))
+    print(f"{side * side} crabs, {components} components")
+
+    frame = [0]
+
+    def animate():
+        # every crab moves a leg, each of them has stale bounds
+        frame[0] += 1
+        for crab in crabs:
+            crab.componentList[1].setCurrentAngle(frame[0] % 20, Component.AXIS_U)
+        top.update(np.identity(4))
+
+    print(f"{'crabs':>9}{'records':>9}{'culled':>8}{'tests':>7}{'collect ms':>12}")
+    for name, moving in (("still", False), ("moving", True)):
+        for culling in (False, True):
+            def collect():
+                if moving:
+                    animate()
+                return top.collectTransforms(frustum=frustum if culling else None)
+
+            collect()
+            Component.resetCullCounters()
+            Frustum.resetCounters()
+            records = collect()
+            drawn, culled = Component.resetCullCounters()
+            tests = Frustum.resetCounters()
+            assert drawn == len(records)
+            print(f"{name:>9}{len(records):>9}{culled:>8}{tests:>7}{best(collect):>12.2f}")
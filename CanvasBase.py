@@ -7,6 +7,8 @@ and the main class should inherit this class. First version Created on 09/27/201
 :version: 2021.1.1
 '''
 from Component import Component
+from FrameScheduler import FrameScheduler
+from RenderThread import RenderThread
 
 try:
     import wx
@@ -81,7 +83,11 @@ class CanvasBase(glcanvas.GLCanvas):
     dragging_event = False
     new_dragging_event = False
 
-    fps = 120  # frame per second, -1 to disable auto refresh
+    fps = 60  # most frames per second, frames are only drawn when requested, see requestFrame
+    frameScheduler = None
+    # run the input handlers and draw on a RenderThread, leaving the wx thread to the events, see dispatch
+    useRenderThread = False
+    renderThread = None
 
     def __init__(self, parent):
         """
@@ -103,8 +109,14 @@ class CanvasBase(glcanvas.GLCanvas):
         self.topLevelComponent = Component(Point((0, 0, 0)))
         self.viewing_quaternion = Quaternion()
         self.timer = wx.Timer(self, 1)  # TIMER_ID set to 1
+        if self.useRenderThread:
+            self.renderThread = RenderThread(self.fps, self.OnPaint, self.needsFrame)
+            self.frameScheduler = self.renderThread.scheduler
+            self.renderThread.start()
+        else:
+            self.frameScheduler = FrameScheduler(self.fps, self.startFrameTimer, self.OnPaint)
         # Bind event to functions
-        # self.Bind(wx.EVT_PAINT, self.OnPaint)
+        self.Bind(wx.EVT_PAINT, self.OnExpose)
         self.Bind(wx.EVT_WINDOW_DESTROY, self.OnDestroy)
         self.Bind(wx.EVT_MOTION, self.OnMouseMotion)
         self.Bind(wx.EVT_LEFT_UP, self.OnMouseLeft)
@@ -112,11 +124,8 @@ class CanvasBase(glcanvas.GLCanvas):
         self.Bind(wx.EVT_CHAR, self.OnKeyDown)
         self.Bind(wx.EVT_SIZE, self.OnResize)
         self.Bind(wx.EVT_MOUSEWHEEL, self.OnScroll)
-        # refresh canvas with constant frame rate
-        self.Bind(wx.EVT_TIMER, self.OnPaint)
-
-        if self.fps > 0:
-            self.timer.Start(int(1000 / self.fps), oneShot=wx.TIMER_CONTINUOUS)
+        # draws the frames asked for with requestFrame
+        self.Bind(wx.EVT_TIMER, self.OnTimer)
 
     def OnScroll(self, event):
         """
@@ -125,11 +134,58 @@ class CanvasBase(glcanvas.GLCanvas):
         :param event: mouse event
         :return: None
         """
-        self.Interrupt_Scroll(event.GetWheelRotation())
-        self.Refresh(True)
+        wheelRotation = event.GetWheelRotation()
+        self.dispatch(lambda: self.Interrupt_Scroll(wheelRotation))
 
     def OnTimer(self, event):
-        self.OnPaint(event)
+        self.frameScheduler.fire()
+
+    def OnExpose(self, event):
+        """
+        The window needs repainting, e.g. it was uncovered
+        """
+        # wx expects a paint DC in every paint handler
+        wx.PaintDC(self)
+        self.requestFrame()
+
+    def startFrameTimer(self, delay):
+        self.timer.StartOnce(max(1, int(round(delay * 1000))))
+
+    def requestFrame(self):
+        """
+        Draw a frame soon, at most one per 1 / fps seconds however often this is called, see FrameScheduler
+        """
+        if self.renderThread is not None:
+            self.renderThread.request()
+        else:
+            self.frameScheduler.request()
+
+    def dispatch(self, command, redraw=True):
+        """
+        Handle an event: run command, which may change the scene or the camera, then draw a frame.
+        With a render thread, command runs there before the next frame, so that only that thread touches the scene
+        and the GL context. Read everything needed from the wx event before, the event does not outlive its handler
+
+        :param command: function without arguments
+        :param redraw: draw even if needsFrame says command changed nothing
+        :type redraw: bool
+        """
+        inputTime = self.frameScheduler.clock()
+        if self.renderThread is not None:
+            self.renderThread.push(command)
+            # the frame runs the command, and may then find nothing to draw
+            self.renderThread.request(inputTime, redraw)
+        else:
+            command()
+            if redraw or self.needsFrame():
+                self.frameScheduler.request(inputTime)
+
+    def needsFrame(self):
+        """
+        Whether the picture changed without input asking for a frame, e.g. the model moved. Checked after each
+        frame and after mouse moves
+        """
+        return self.stateChanged or self.topLevelComponent.needsUpdate()
 
     def OnResize(self, event):
         """
@@ -138,15 +194,21 @@ class CanvasBase(glcanvas.GLCanvas):
         :param event: Canvas resize event
         :return: None
         """
-        self.context = glcanvas.GLContext(self)
-        self.size = self.GetClientSize()
+        context = glcanvas.GLContext(self)
+        size = self.GetClientSize()
+        self.dispatch(lambda: self.resize(context, size))
+
+    def resize(self, context, size):
+        """
+        Draw into a new context of the given size from the next frame on, see OnResize
+        """
+        self.context = context
+        self.size = size
         self.size[1] = max(1, self.size[1])  # avoid divided by 0
         self.SetCurrent(self.context)
 
         # Update screen and display
         self.init = False
-        self.Refresh(eraseBackground=True)
-        self.Update()
 
     def OnIdle(self, event):
         pass
@@ -171,6 +233,8 @@ class CanvasBase(glcanvas.GLCanvas):
             self.stateChanged = False
         # the draw method
         self.OnDraw()
+        if self.needsFrame():
+            self.requestFrame()
 
     def OnDraw(self):
         """
@@ -253,6 +317,8 @@ class CanvasBase(glcanvas.GLCanvas):
         :param event: Window destroy event
         :return: None
         """
+        if self.renderThread is not None:
+            self.renderThread.stop()
         print("Destroy Window")
 
     def OnMouseMotion(self, event):
@@ -262,28 +328,37 @@ class CanvasBase(glcanvas.GLCanvas):
         :param event: mouse motion event
         :return: None
         """
-        if event.LeftIsDown():
+        x, y = event.GetX(), event.GetY()
+        left, right, middle = event.LeftIsDown(), event.RightIsDown(), event.MiddleIsDown()
+        # Normal Mouse Moving is only drawn if it moved something
+        self.dispatch(lambda: self.mouseMotion(x, y, left, right, middle), redraw=left or right or middle)
+
+    def mouseMotion(self, x, y, left, right, middle):
+        """
+        Handle a mouse motion, see OnMouseMotion
+
+        :param left: whether the left button is down
+        :param right: whether the right button is down
+        :param middle: whether the middle button is down
+        """
+        if left:
             # If this is a dragging event with left button down
             self.new_dragging_event = not self.dragging_event
             self.dragging_event = True
-            self.Interrupt_MouseLeftDragging(event.GetX(), self.size[1] - event.GetY())
-            self.Refresh(True)
-        elif event.RightIsDown():
+            self.Interrupt_MouseLeftDragging(x, self.size[1] - y)
+        elif right:
             # If this is a dragging event with right button down
             self.new_dragging_event = not self.dragging_event
             self.dragging_event = True
-            self.Interrupt_MouseMiddleDragging(event.GetX(), self.size[1] - event.GetY()) # use middle method
-            self.Refresh(True)
-        elif event.MiddleIsDown():
+            self.Interrupt_MouseMiddleDragging(x, self.size[1] - y) # use middle method
+        elif middle:
             self.new_dragging_event = not self.dragging_event
             self.dragging_event = True
-            self.Interrupt_MouseMiddleDragging(event.GetX(), self.size[1] - event.GetY())
-            self.Refresh(True)
+            self.Interrupt_MouseMiddleDragging(x, self.size[1] - y)
         else:
             # Normal Mouse Moving
             self.dragging_event = False
-            self.Interrupt_MouseMoving(event.GetX(), self.size[1] - event.GetY())
-            self.Refresh(True)
+            self.Interrupt_MouseMoving(x, self.size[1] - y)
 
     # Definition for interface
     def OnMouseLeft(self, event):
@@ -295,8 +370,7 @@ class CanvasBase(glcanvas.GLCanvas):
         """
         x = event.GetX()
         y = event.GetY()
-        self.Interrupt_MouseL(x, self.size[1] - y)
-        self.Refresh(True)
+        self.dispatch(lambda: self.Interrupt_MouseL(x, self.size[1] - y))
 
     def OnMouseRight(self, event):
         """
@@ -307,8 +381,7 @@ class CanvasBase(glcanvas.GLCanvas):
         """
         x = event.GetX()
         y = event.GetY()
-        self.Interrupt_MouseR(x, self.size[1] - y)
-        self.Refresh(True)
+        self.dispatch(lambda: self.Interrupt_MouseR(x, self.size[1] - y))
 
     def OnKeyDown(self, event):
         """
@@ -318,8 +391,7 @@ class CanvasBase(glcanvas.GLCanvas):
         :return: None
         """
         keycode = event.GetKeyCode()
-        self.Interrupt_Keyboard(keycode)
-        self.Refresh(True)
+        self.dispatch(lambda: self.Interrupt_Keyboard(keycode))
 
     def modelUpdate(self):
         """
@@ -328,7 +400,7 @@ class CanvasBase(glcanvas.GLCanvas):
         :return: None
         """
         self.stateChanged = True
-        self.Refresh(True)
+        self.requestFrame()
 
     def Interrupt_Scroll(self, wheelRotation):
         pass
@@ -0,0 +1,191 @@
+"""
+Fast import of triangle meshes from COLLADA (.dae) files.
+
+The <float_array> and <p> blocks are read with a streaming XML parser straight into preallocated numpy arrays,
+and the interleaved vertex layout used by DisplayableMesh is produced in one vectorized pass.
+pycollada is only needed as a fallback for files the streaming reader doesn't understand.
+
+Vertex layout (11 float32 per vertex):
+    position(3), normal(3, empty), color(3, empty), uv(2, empty)
+"""
+
+import time
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+
+try:
+    import collada
+except ImportError:
+    collada = None
+
+# bump this whenever the produced vertex or index layout changes
+LOADER_VERSION = 1
+
+VERTEX_STRIDE = 11
+
+# named view of one interleaved vertex, e.g. vertices.view(VERTEX_DTYPE)[:, 0]["position"] for an (N, 11) array
+VERTEX_DTYPE = np.dtype([("position", np.float32, 3), ("normal", np.float32, 3),
+                         ("color", np.float32, 3), ("uv", np.float32, 2)])
+
+
+def _localName(tag):
+    """
+    strip the xml namespace from an element tag
+    """
+    return tag.rpartition("}")[2]
+
+
+def _attribute(elem, name, filename):
+    """
+    Value of an attribute the fast path needs, a ValueError when missing so that load falls back to pycollada
+    """
+    value = elem.get(name)
+    if value is None:
+        raise ValueError(f"<{_localName(elem.tag)}> without {name} in {filename}")
+    return value
+
+
+def interleave(positions):
+    """
+    Build the interleaved vertex array from an (N, 3) position array
+
+    :param positions: vertex positions
+    :type positions: numpy.ndarray
+    :return: flat float32 array of length N * 11
+    :rtype: numpy.ndarray
+    """
+    vertices = np.zeros((len(positions), VERTEX_STRIDE), dtype=np.float32)
+    vertices[:, 0:3] = positions
+    return vertices.reshape(-1)
+
+
+def readTriangles(filename):
+    """
+    Read the first triangle list of the first geometry in a .dae file with a streaming parser
+
+    :param filename: .dae file to import
+    :type filename: string
+    :return: (vertices, indices), vertices is a flat float32 array in the 11-float layout, indices is int32
+    :rtype: tuple
+    """
+    sources = {}  # source id -> (text, count) of its float array, only the position array is ever parsed
+    vertexInputs = {}  # <vertices> id -> source id of its POSITION input
+    sourceId = None
+    verticesId = None
+    inTriangles = False
+    triangleCount = 0
+    inputs = []  # (semantic, source, offset) of the current <triangles>
+    indexData = None
+
+    for event, elem in ElementTree.iterparse(filename, events=("start", "end")):
+        tag = _localName(elem.tag)
+        if event == "start":
+            if tag == "source":
+                sourceId = elem.get("id")
+            elif tag == "vertices":
+                verticesId = elem.get("id")
+            elif tag == "triangles":
+                inTriangles = True
+                triangleCount = int(_attribute(elem, "count", filename))
+            elif tag in ("polylist", "polygons", "lines", "linestrips", "trifans", "tristrips"):
+                raise ValueError(f"Unsupported primitive <{tag}> in {filename}")
+            continue
+
+        if tag == "float_array" and sourceId is not None:
+            sources[sourceId] = (elem.text or "", int(_attribute(elem, "count", filename)))
+        elif tag == "source":
+            sourceId = None
+        elif tag == "input":
+            if verticesId is not None and elem.get("semantic") == "POSITION":
+                vertexInputs[verticesId] = _attribute(elem, "source", filename).lstrip("#")
+            elif inTriangles:
+                inputs.append((elem.get("semantic"), _attribute(elem, "source", filename).lstrip("#"),
+                               int(elem.get("offset", 0))))
+        elif tag == "vertices":
+            verticesId = None
+        elif tag == "p" and inTriangles:
+            stride = max(offset for _, _, offset in inputs) + 1
+            indexData = np.fromstring(elem.text or "", dtype=np.int32, count=triangleCount * 3 * stride, sep=" ")
+        elif tag == "triangles":
+            # only the first triangle list is used, the rest of the document can be skipped
+            break
+        elem.clear()
+
+    if indexData is None:
+        raise ValueError(f"No <triangles> found in {filename}")
+
+    vertexInput = [i for i in inputs if i[0] == "VERTEX"]
+    if len(vertexInput) != 1 or vertexInput[0][1] not in vertexInputs:
+        raise ValueError(f"Cannot resolve VERTEX input in {filename}")
+    _, verticesSource, vertexOffset = vertexInput[0]
+    text, count = sources[vertexInputs[verticesSource]]
+    positions = np.fromstring(text, dtype=np.float32, count=count, sep=" ").reshape(-1, 3)
+
+    stride = max(offset for _, _, offset in inputs) + 1
+    indices = np.ascontiguousarray(indexData.reshape(-1, stride)[:, vertexOffset])
+    return interleave(positions), indices
+
+
+def readTrianglesPycollada(filename):
+    """
+    Same as readTriangles, but goes through pycollada. Slower, but understands the whole format
+
+    :param filename: .dae file to import
+    :type filename: string
+    :return: (vertices, indices), vertices is a flat float32 array in the 11-float layout, indices is int32
+    :rtype: tuple
+    """
+    if collada is None:
+        raise ImportError("Required dependency pycollada not present")
+    colladaData = collada.Collada(filename)
+    tridata = colladaData.geometries[0].primitives[0]
+    if not isinstance(tridata, collada.triangleset.TriangleSet):
+        tridata = tridata.triangleset()
+    indices = np.asarray(tridata.vertex_index, dtype=np.int32).reshape(-1)
+    return interleave(tridata.vertex), indices
+
+
+def load(filename):
+    """
+    Import the mesh in a .dae file, falling back to pycollada if the fast path can't read it
+
+    :param filename: .dae file to import
+    :type filename: string
+    :return: (vertices, indices)
+    :rtype: tuple
+    """
+    try:
+        return readTriangles(filename)
+    except (ValueError, KeyError, ElementTree.ParseError):
+        return readTrianglesPycollada(filename)
+
+
+if __name__ == "__main__":
+    import glob
+
+    rounds = 20
+    print(f"{'mesh':<24}{'verts':>8}{'tris':>8}{'stream ms':>12}{'pycollada ms':>14}{'speedup':>10}")
+    for path in sorted(glob.glob("assets/*.dae")):
+        vertices, indices = readTriangles(path)
+
+        t1 = time.perf_counter()
+        for _ in range(rounds):
+            readTriangles(path)
+        t2 = time.perf_counter()
+        streamTime = (t2 - t1) / rounds * 1000
+
+        if collada is not None:
+            refVertices, refIndices = readTrianglesPycollada(path)
+            assert np.allclose(vertices, refVertices) and np.array_equal(indices, refIndices), path
+            t1 = time.perf_counter()
+            for _ in range(rounds):
+                readTrianglesPycollada(path)
+            t2 = time.perf_counter()
+            colladaTime = (t2 - t1) / rounds * 1000
+            speedup = f"{colladaTime / streamTime:.1f}x"
+        else:
+            colladaTime = float("nan")
+            speedup = "-"
+        print(f"{path:<24}{len(vertices) // VERTEX_STRIDE:>8}{len(indices) // 3:>8}"
+              f"{streamTime:>12.3f}{colladaTime:>14.3f}{speedup:>10}")
@@ -23,9 +23,10 @@ import GLBuffer
 from Point import Point
 from ColorType import ColorType
 from Displayable import Displayable
-from Quaternion import Quaternion
+from Quaternion import Quaternion, QuaternionArray
 from GLUtility import GLUtility
 from GLBuffer import Texture
+from Bounds import Frustum, linearNorm, transformBox
 
 try:
     import OpenGL
@@ -53,47 +54,97 @@ except ImportError:
     raise ImportError("Required dependency PyOpenGL not present")
 
 
-class Component:
-    children = None  # list
-
-    # the homogeneous transformation matrix for the current joint
-    transformationMat = None
-
-    # a instance of class which inherit from Displayable
-    # if this class is used as skeleton, then keep this empty
-    displayObj = None
-
-    default_color = None  # ColorType
-    current_color = None  # ColorType
-    defaultPos = None  # Point
-    currentPos = None  # Point
-
-    uAxis = None  # list<float>(3): local basis u
-    vAxis = None  # list<float>(3): local basis v
-    wAxis = None  # list<float>(3): local basis w
-    default_uAngle = 0.0
-    uAngle = 0.0
-    uRange = None  # list<float>(2)
-    default_vAngle = 0.0
-    vAngle = 0.0
-    vRange = None  # list<float>(2)
-    default_wAngle = 0.0
-    wAngle = 0.0
-    wRange = None  # list<float>(2)
-    axisBucket = None
-
-    defaultScaling = None
-    currentScaling = None
-
-    preRotationMat = None
-    postRotationMat = None
+# defaults shared by every component; they are never written into, setters replace them instead
+DEFAULT_AXES = (Point([1, 0, 0]), Point([0, 1, 0]), Point([0, 0, 1]))
+DEFAULT_RANGES = np.array([[-360.0, 360.0]] * 3)
+IDENTITY = np.identity(4)
+WHITE = np.ones(3)
+for shared in [axis.coords for axis in DEFAULT_AXES] + [DEFAULT_RANGES, IDENTITY, WHITE]:
+    shared.flags.writeable = False
 
-    texture = None
-    textureOn = False
 
-    glUtility = None
-
-    quat = None
+class Component:
+    """
+    A node of a transformation hierarchy.
+    Instances have no __dict__: every attribute is a slot, and defaults that are rarely changed (axes, pre- and
+    post-rotation, scaling, color) are shared until a setter replaces them. Subclasses created in large numbers
+    should declare __slots__ as well
+    """
+    # integer IDs of the rotation axes, accepted wherever uAxis, vAxis or wAxis are
+    AXIS_U = 0
+    AXIS_V = 1
+    AXIS_W = 2
+
+    __slots__ = (
+        "children",  # list
+        "parent",  # the Component this one was added to, None for the root
+
+        # the homogeneous transformation matrix for the current joint
+        "transformationMat",
+
+        # incremental update, see update and markLocalDirty
+        "localMat",  # this joint's own transformation, everything in transformationMat except the parent's
+        "parentMat",  # the parent transformation transformationMat was computed with
+        "localDirty",  # localMat is out of date
+        "worldDirty",  # transformationMat is out of date
+        "childDirty",  # some descendant is out of date
+
+        # world box around the mesh, None when unknown, see meshBounds
+        "bounds",
+        "boundsDirty",  # bounds is out of date
+        # radius around the origin holding the meshes of the subtree in any pose, None when unknown, see subtreeReach
+        "reach",
+        "meshCount",  # meshes in the subtree
+        "reachDirty",  # reach and meshCount are out of date
+
+        # FlatScene this component is a view into, if any, and its row in the scene's arrays
+        "scene",
+        "sceneIndex",
+
+        # StaticBake drawn in place of this component and its subtree, and the one this component is merged into
+        "bake",
+        "bakedIn",
+
+        # a instance of class which inherit from Displayable
+        # if this class is used as skeleton, then keep this empty
+        "displayObj",
+
+        "default_color",  # ColorType
+        "current_color",  # ColorType
+        "defaultPos",  # Point
+        "currentPos",  # Point
+
+        "uAxis",  # Point: local basis u
+        "vAxis",  # Point: local basis v
+        "wAxis",  # Point: local basis w
+        "angles",  # numpy.ndarray(3): current u, v, w angles, read through uAngle, vAngle, wAngle
+        "default_uAngle",
+        "default_vAngle",
+        "default_wAngle",
+        "angleRanges",  # numpy.ndarray(3, 2): [min, max] angle of each axis, in axis ID order, see uRange etc.
+
+        "defaultScaling",
+        "currentScaling",
+
+        "preRotationMat",
+        "postRotationMat",
+
+        "texture",  # GLBuffer.Texture, created by setTexture
+        "textureOn",
+
+        "quat",
+    )
+
+    # matrices rebuilt by all components since the last resetUpdateCounters
+    localUpdates = 0
+    worldUpdates = 0
+
+    # meshes drawn (or collected) and skipped outside the view frustum since the last resetCullCounters
+    drawnMeshes = 0
+    culledMeshes = 0
+
+    # only the static matrix helpers are used, so one instance serves every component
+    glUtility = GLUtility()
 
     def __init__(self, position, display_obj=None):
         """
@@ -105,39 +156,56 @@ class Component:
         :type display_obj: Displayable
         :rtype: None
         """
-        # list variable initialization should be done here. Otherwise list variable in different instances will share
-        # the same list
-        self.children = []
-        self.uAxis = Point([1, 0, 0])
-        self.vAxis = Point([0, 1, 0])
-        self.wAxis = Point([0, 0, 1])
-        self.uRange = [-360, 360]
-        self.vRange = [-360, 360]
-        self.wRange = [-360, 360]
-        self.axisBucket = [self.uAxis, self.vAxis, self.wAxis]
-        self.glUtility = GLUtility()
-
         # Type Checking
         if not isinstance(position, Point):
             raise TypeError("Incorrect Position, it should be Point type")
         if not (isinstance(display_obj, Displayable) or isinstance(display_obj, type(None))):
             raise TypeError("displayObj can only accept None or Displayable object")
 
+        # list variable initialization should be done here. Otherwise list variable in different instances will share
+        # the same list
+        self.children = []
+        self.parent = None
+        self.transformationMat = None
+        self.localMat = None
+        self.parentMat = None
+        self.localDirty = True
+        self.worldDirty = True
+        self.childDirty = False
+        self.bounds = None
+        self.boundsDirty = True
+        self.reach = None
+        self.meshCount = 0
+        self.reachDirty = True
+        self.scene = None
+        self.sceneIndex = None
+        self.bake = None
+        self.bakedIn = None
+
+        self.angles = np.zeros(3)
+        self.default_uAngle = 0.0
+        self.default_vAngle = 0.0
+        self.default_wAngle = 0.0
+        self.uAxis, self.vAxis, self.wAxis = DEFAULT_AXES
+        self.angleRanges = DEFAULT_RANGES
+
         # init some default values
         if not isinstance(display_obj, type(None)):
             self.default_color = display_obj.defaultColor
             self.current_color = display_obj.defaultColor
         else:
-            self.default_color = np.array([1.,1.,1.])
-            self.current_color = np.array([1.,1.,1.])
+            self.default_color = WHITE
+            self.current_color = WHITE
         self.defaultPos = position.copy()
-        self.currentPos = position.copy()
+        self.currentPos = self.defaultPos
         self.displayObj = display_obj
-        self.defaultScaling = [1, 1, 1]
-        self.currentScaling = [1, 1, 1]
-        self.preRotationMat = np.identity(4)
-        self.postRotationMat = np.identity(4)
-        self.texture = Texture()
+        self.defaultScaling = (1, 1, 1)
+        self.currentScaling = self.defaultScaling
+        self.preRotationMat = IDENTITY
+        self.postRotationMat = IDENTITY
+        self.texture = None
+        self.textureOn = False
+        self.quat = None
 
     def addChild(self, child):
         """
@@ -152,15 +220,30 @@ class Component:
             raise TypeError("Children of a Component can only be Component")
         # prevent the duplicate child to be added to the self.children
         if child not in self.children:
+            self.invalidateBake()
             self.children.append(child)
+            child.parent = self
+            child.worldDirty = True
+            self.markChildDirty()
+            self.markReachDirty()
+            if self.scene is not None:
+                self.scene.structureDirty = True
 
     def clear(self):
         """
         remove all children and destroy them
         """
-        for c in self.children:
+        self.invalidateBake()
+        # the subtree shrinks
+        self.markReachDirty()
+        children, self.children = self.children, []
+        for c in children:
             c.clear()
-            self.children.remove(c)
+            if isinstance(c.displayObj, Displayable):
+                c.displayObj.freeAllocations()
+            c.parent = None
+            if self.scene is not None:
+                self.scene.structureDirty = True
             del c
 
     def initialize(self):
@@ -179,8 +262,21 @@ class Component:
         # use init value to generate transformation matrix for all children
         self.update()
 
-    def draw(self, shaderProg):
-        shaderProg.setMat4("modelMat", self.transformationMat.transpose())
+    def draw(self, shaderProg, frustum=None):
+        """
+        Draw this component and all its children. Call update first
+
+        :param frustum: skip the subtrees outside of it, nothing is culled by default
+        :type frustum: Bounds.Frustum
+        """
+        if frustum is not None:
+            frustum = self.cull(frustum)
+            if frustum is False:
+                return
+        modelMat = self.transformationMat
+        if isinstance(self.displayObj, Displayable) and self.displayObj.scaleMat is not None:
+            modelMat = modelMat @ self.displayObj.scaleMat
+        shaderProg.setMat4("modelMat", modelMat.transpose())
         shaderProg.setVec3("currentColor", self.current_color)
         if isinstance(self.displayObj, Displayable):
             if self.textureOn:
@@ -188,37 +284,313 @@ class Component:
                 self.texture.bind(shaderProg.getUniformLocation("textureImage"))
             else:
                 shaderProg.use()
-                self.texture.unbind(shaderProg.getUniformLocation("textureImage"))
+                Texture.unbind(shaderProg.getUniformLocation("textureImage"))
             self.displayObj.draw()
+            Component.drawnMeshes += 1
+
+        for c in self.children:
+            if c.bake is not None:
+                if frustum is None or c.bake.isVisible(frustum, self.transformationMat):
+                    c.bake.draw(shaderProg, self.transformationMat)
+            else:
+                c.draw(shaderProg, frustum)
+
+    def collectDraws(self, arena, records=None, frustum=None):
+        """
+        Gather this component and all its children as draw records for arena.drawBatch.
+        Meshes are copied into the arena the first time they are collected. Call update first
+
+        :param arena: arena the records will be drawn from
+        :type arena: GLBuffer.MeshArena
+        :param frustum: skip the subtrees outside of it, nothing is culled by default
+        :type frustum: Bounds.Frustum
+        :return: list of (ArenaAllocation, model matrix, color)
+        :rtype: list
+        """
+        if records is None:
+            records = []
+        if frustum is not None:
+            frustum = self.cull(frustum)
+            if frustum is False:
+                return records
+        if isinstance(self.displayObj, Displayable):
+            allocation, meshMat = self.displayObj.allocate(arena)
+            records.append((allocation, self.transformationMat @ meshMat, self.current_color))
+            Component.drawnMeshes += 1
+        for c in self.children:
+            if c.bake is not None:
+                if frustum is None or c.bake.isVisible(frustum, self.transformationMat):
+                    c.bake.collectDraws(arena, self.transformationMat, records)
+            else:
+                c.collectDraws(arena, records, frustum)
+        return records
+
+    def collectTransforms(self, records=None, frustum=None):
+        """
+        Gather this component and all its children as draw records for GLBuffer.TransformBuffer.drawBatch.
+        Call update first
+
+        :param frustum: skip the subtrees outside of it, nothing is culled by default
+        :type frustum: Bounds.Frustum
+        :return: list of (Displayable, model matrix, color, Texture or None)
+        :rtype: list
+        """
+        if records is None:
+            records = []
+        if frustum is not None:
+            frustum = self.cull(frustum)
+            if frustum is False:
+                return records
+        displayObj = self.displayObj
+        if isinstance(displayObj, Displayable):
+            modelMat = self.transformationMat
+            if displayObj.scaleMat is not None:
+                modelMat = modelMat @ displayObj.scaleMat
+            records.append((displayObj, modelMat, self.current_color, self.texture if self.textureOn else None))
+            Component.drawnMeshes += 1
+        for c in self.children:
+            if c.bake is not None:
+                if frustum is None or c.bake.isVisible(frustum, self.transformationMat):
+                    c.bake.collectTransforms(self.transformationMat, records)
+            else:
+                c.collectTransforms(records, frustum)
+        return records
+
+    def cull(self, frustum):
+        """
+        Test the subtree against frustum with the sphere of subtreeReach, which stays valid while the joints turn.
+        A leaf whose sphere is partly inside is tested again with the tighter box of meshBounds
 
+        :return: False when the subtree is outside, None when it is inside (its children need no test), else frustum
+        """
+        reach, meshCount = self.subtreeReach()
+        if reach is None:
+            return frustum
+        mat = self.transformationMat
+        side = frustum.classifySphere(mat[0:3, 3], reach * linearNorm(mat[0:3, 0:3]))
+        if side == Frustum.INTERSECTING and not self.children:
+            bounds = self.meshBounds()
+            if bounds is None:
+                return frustum
+            side = frustum.classify(bounds)
+        if side == Frustum.OUTSIDE:
+            Component.culledMeshes += meshCount
+            return False
+        return None if side == Frustum.INSIDE else frustum
+
+    def subtreeReach(self):
+        """
+        Radius of a sphere around this component's origin, in the space of its transformation, holding the meshes
+        of this component and its descendants whatever their angles. Only positions, scalings, pre- and
+        post-rotations and children change it, see markReachDirty
+
+        :return: (radius or None when some mesh has unknown bounds, meshes in the subtree or None when unknown)
+        :rtype: tuple
+        """
+        if self.scene is not None:
+            # the scene updates the transformations in place, without telling the components
+            return None, None
+        if self.reachDirty:
+            self.updateReach()
+        return self.reach, self.meshCount
+
+    def updateReach(self):
+        reach = 0.0
+        meshCount = 0
+        displayObj = self.displayObj
+        if isinstance(displayObj, Displayable):
+            meshCount = 1
+            if displayObj.sphere is None:
+                reach = None
+            else:
+                center, radius = displayObj.sphere
+                reach = float(np.linalg.norm(center)) + radius
         for c in self.children:
-            c.draw(shaderProg)
+            if c.bake is not None:
+                childReach, count = c.bake.reach, len(c.bake.meshes)
+            else:
+                childReach, count = c.subtreeReach()
+                if childReach is not None and count:
+                    # a point p of the child lands within |offset| + stretch * |p| of this origin, whatever the
+                    # child's rotation, see updateLocal
+                    post = c.postRotationMat
+                    pre = c.preRotationMat
+                    scale = float(np.abs(c.currentScaling).max())
+                    stretch = linearNorm(post[0:3, 0:3]) * scale
+                    offset = np.linalg.norm(post[0:3, 0:3] @ c.currentPos.getCoords()[0:3] + post[0:3, 3]) + \
+                        stretch * np.linalg.norm(pre[0:3, 3])
+                    childReach = float(offset) + stretch * linearNorm(pre[0:3, 0:3]) * childReach
+            if count is None:
+                meshCount = None
+            elif count and meshCount is not None:
+                meshCount += count
+            if count and reach is not None:
+                reach = None if childReach is None else max(reach, childReach)
+        self.reach = reach if meshCount is not None else None
+        self.meshCount = meshCount
+        self.reachDirty = False
+
+    def meshBounds(self):
+        """
+        World box around this component's own mesh, kept until update moves the component. Call update first
+
+        :return: box, None without a mesh or when its bounds are unknown
+        :rtype: numpy.ndarray
+        """
+        if self.boundsDirty:
+            displayObj = self.displayObj
+            if isinstance(displayObj, Displayable) and displayObj.aabb is not None:
+                self.bounds = transformBox(displayObj.aabb, self.transformationMat)
+            else:
+                self.bounds = None
+            self.boundsDirty = False
+        return self.bounds
+
+    def markLocalDirty(self):
+        """
+        Flag this component's own transformation as changed. The next update rebuilds it and the world
+        transformation of this component and its descendants
+        """
+        self.invalidateBake()
+        if self.scene is not None:
+            self.scene.syncDirty[self.sceneIndex] = True
+            self.scene.localDirty[self.sceneIndex] = True
+            return
+        self.localDirty = True
+        if self.parent is not None:
+            self.parent.markChildDirty()
+
+    def invalidateBake(self):
+        """
+        Drop the StaticBake this component is merged into, if any
+        """
+        if self.bakedIn is not None:
+            self.bakedIn.invalidate()
+
+    def isStatic(self):
+        """
+        Whether this component's own transformation is locked: every rotation extent is pinned to the current angle
+        and no quaternion overrides them. Position, scaling etc. can still be changed explicitly
+        """
+        return self.quat is None and bool(np.all(self.angleRanges[:, 0] == self.angleRanges[:, 1])) and \
+            bool(np.all(self.angles == self.angleRanges[:, 0]))
+
+    def needsUpdate(self):
+        """
+        Whether update would change a transformation in this subtree, i.e. whether it moved since the last update
+        """
+        if self.scene is not None:
+            return self.scene.isDirty()
+        return self.localDirty or self.worldDirty or self.childDirty
+
+    def markChildDirty(self):
+        # flag the path up to the root, so update can skip every subtree with nothing to do
+        c = self
+        while c is not None and not c.childDirty:
+            c.childDirty = True
+            c = c.parent
+
+    def markReachDirty(self):
+        # flag the path up to the root, whose reach holds this subtree, see subtreeReach
+        c = self
+        while c is not None and not c.reachDirty:
+            c.reachDirty = True
+            c = c.parent
+
+    def markRigidDirty(self):
+        """
+        Flag this component's position, scaling, pre- or post-rotation as changed. Unlike a rotation, this moves
+        the subtree relative to the parent's origin, so the parent's reach is rebuilt as well
+        """
+        self.markLocalDirty()
+        if self.parent is not None:
+            self.parent.markReachDirty()
+
+    @staticmethod
+    def resetCullCounters():
+        """
+        :return: (drawn, culled) meshes since the last reset
+        :rtype: tuple
+        """
+        counters = (Component.drawnMeshes, Component.culledMeshes)
+        Component.drawnMeshes = 0
+        Component.culledMeshes = 0
+        return counters
+
+    @staticmethod
+    def resetUpdateCounters():
+        """
+        :return: (local, world) matrices rebuilt since the last reset
+        :rtype: tuple
+        """
+        counters = (Component.localUpdates, Component.worldUpdates)
+        Component.localUpdates = 0
+        Component.worldUpdates = 0
+        return counters
 
     def update(self, parentTransformationMat=None):
         """
         Apply translation, rotation and scaling to this component and all its children
         Must be called after any changes made to the instance
 
+        Only what changed is recomputed: the local matrix of components flagged by markLocalDirty, and the world
+        matrix of those components, their descendants and components whose parent transformation changed.
+        Subtrees with nothing flagged are not visited, nor are subtrees replaced by a StaticBake.
+        Components attached to a FlatScene update the whole scene instead.
+
         :return: None
         """
+        if self.bake is not None:
+            return
+        if self.scene is not None:
+            self.scene.update(parentTransformationMat if self.sceneIndex == 0 else None)
+            return
         if parentTransformationMat is None:
             parentTransformationMat = np.identity(4)
-
-        translationMat = self.glUtility.translate(*self.currentPos.getCoords(), False)
+        if parentTransformationMat is not self.parentMat and \
+                (self.parentMat is None or not np.array_equal(parentTransformationMat, self.parentMat)):
+            self.worldDirty = True
+
+        if self.localDirty:
+            self.updateLocal()
+            self.localDirty = False
+            self.worldDirty = True
+            Component.localUpdates += 1
+
+        if self.worldDirty:
+            self.transformationMat = parentTransformationMat @ self.localMat
+            self.parentMat = parentTransformationMat
+            self.worldDirty = False
+            self.boundsDirty = True
+            Component.worldUpdates += 1
+            for c in self.children:
+                c.update(self.transformationMat)
+        elif self.childDirty:
+            for c in self.children:
+                if c.localDirty or c.worldDirty or c.childDirty:
+                    c.update(self.transformationMat)
+        self.childDirty = False
+
+    def updateLocal(self):
+        """
+        Rebuild localMat from the current position, rotation and scaling
+        """
+        translationMat = self.glUtility.translate(*self.currentPos.getCoords(), False, cached=True)
 
         # if self.quat is set, use the quaternion as your rotation matrix.
         # otherwise, use Euler angles with rotation extents, etc.
         # this means that quaternions will always override the settings for Euler angles
 
-        if self.quat != None:
-            rotationMatU = self.quat.toMatrix().transpose()
+        if self.quat is not None:
+            # (4, 4) from a Quaternion, (1, 4, 4) from a QuaternionArray view
+            rotationMatU = self.quat.toMatrix().reshape(4, 4).transpose()
             rotationMatV = np.identity(4)
             rotationMatW = np.identity(4)
         else:
-            rotationMatU = self.glUtility.rotate(self.uAngle, self.uAxis, False)
-            rotationMatV = self.glUtility.rotate(self.vAngle, self.vAxis, False)
-            rotationMatW = self.glUtility.rotate(self.wAngle, self.wAxis, False)
-        scalingMat = self.glUtility.scale(*self.currentScaling, False)
+            rotationMatU = self.glUtility.rotate(self.uAngle, self.uAxis, False, cached=True)
+            rotationMatV = self.glUtility.rotate(self.vAngle, self.vAxis, False, cached=True)
+            rotationMatW = self.glUtility.rotate(self.wAngle, self.wAxis, False, cached=True)
+        scalingMat = self.glUtility.scale(*self.currentScaling, False, cached=True)
 
         ##### TODO 1: Write the correct transformation to be applied to each Component
         # Finish this function by writing one line of code that sets myTransformation to the correct value.
@@ -230,10 +602,7 @@ class Component:
         # Put in this order to minimzie any errors
         myTransformation = translationMat @ rotationMatW @ rotationMatU @ rotationMatV @ scalingMat
 
-        self.transformationMat = parentTransformationMat @ self.postRotationMat @ myTransformation @ self.preRotationMat 
-
-        for c in self.children:
-            c.update(self.transformationMat)
+        self.localMat = self.postRotationMat @ myTransformation @ self.preRotationMat
 
     def rotate(self, degree, axis):
         """
@@ -241,13 +610,14 @@ class Component:
 
         :param degree: rotate degree, in degs
         :typedegree: float
-        :param axis: rotation axis. Axis must be uAxis, vAxis, or wAxis
-        :type axis: enum(self.uAxis, self.vAxis, self.wAxis)
+        :param axis: rotation axis. Axis must be uAxis, vAxis, or wAxis, or their ID
+        :type axis: enum(self.uAxis, self.vAxis, self.wAxis) or int
         :return: None
         """
-        if axis not in self.axisBucket:
+        index = self.axisIndex(axis)
+        if index is None:
             raise TypeError("unknown axis for rotation")
-        index = self.axisBucket.index(axis)
+        self.markLocalDirty()
         if index == 0:
             self.uAngle = max(min(degree + self.uAngle, self.uRange[1]), self.uRange[0])
             # print(self.uAngle)
@@ -267,6 +637,10 @@ class Component:
         :param mode: the thing you want to reset
         :type mode: string
         """
+        if mode in ["position", "scale", "all"]:
+            self.markRigidDirty()
+        elif mode != "color":
+            self.markLocalDirty()
         if mode in ["angle", "all"]:
             self.uAngle = self.default_uAngle
             self.vAngle = self.default_vAngle
@@ -276,9 +650,7 @@ class Component:
         if mode in ["scale", "all"]:
             self.currentScaling = copy.deepcopy(self.defaultScaling)
         if mode in ["rotationAxis", "all"]:
-            self.setU([1, 0, 0])
-            self.setV([0, 1, 0])
-            self.setW([0, 0, 1])
+            self.uAxis, self.vAxis, self.wAxis = DEFAULT_AXES
         if mode in ["color", "all"]:
             self.setCurrentColor(self.default_color)
 
@@ -286,15 +658,17 @@ class Component:
         """
         set rotate extent range for axis rotation
 
-        :param axis: rotation axis. Axis must be uAxis, vAxis, or wAxis
+        :param axis: rotation axis. Axis must be uAxis, vAxis, or wAxis, or their ID
         :param minDeg: rotation's lower limit
         :param maxDeg: rotation's upper limit
         :return: None
         """
-        if axis not in self.axisBucket:
-            raise TypeError("unknown axis for rotation extent setting")
         # Find out which axis to set
-        index = self.axisBucket.index(axis)
+        index = self.axisIndex(axis)
+        if index is None:
+            raise TypeError("unknown axis for rotation extent setting")
+        if self.angleRanges is DEFAULT_RANGES:
+            self.angleRanges = DEFAULT_RANGES.copy()
         if index == 0:
             r = self.uRange
         elif index == 1:
@@ -319,6 +693,19 @@ class Component:
             aD = t
         r[0] = iD
         r[1] = aD
+        self.invalidateBake()
+
+    def axisIndex(self, axis):
+        """
+        :param axis: AXIS_U, AXIS_V, AXIS_W, or one of uAxis, vAxis, wAxis (compared by value)
+        :return: the axis ID, None if axis is not a rotation axis of this component
+        :rtype: int
+        """
+        if isinstance(axis, (int, np.integer)):
+            return int(axis) if 0 <= axis < 3 else None
+        if axis not in self.axisBucket:
+            return None
+        return self.axisBucket.index(axis)
 
     @staticmethod
     def clamp(v, low_bound, up_bound):
@@ -334,16 +721,20 @@ class Component:
         if not os.path.isfile(imgFilePath):
             raise TypeError("Image File doesn't exist")
 
+        self.invalidateBake()
         shaderProg.use()
         texture_image = Image.open(imgFilePath).convert("RGB")
         texture_image = np.array(texture_image, dtype=np.uint8)
+        if self.texture is None:
+            # texture units are only taken by components that have a texture
+            self.texture = Texture()
         self.texture.setTextureImage(texture_image)
         self.textureOn = textureOn
 
     def setCurrentAngle(self, angle, axis):
-        if axis not in self.axisBucket:
+        index = self.axisIndex(axis)
+        if index is None:
             raise TypeError("unknown axis for rotation")
-        index = self.axisBucket.index(axis)
 
         if index == 0:
             self.uAngle = self.clamp(angle, self.uRange[0], self.uRange[1])
@@ -351,18 +742,19 @@ class Component:
             self.vAngle = self.clamp(angle, self.vRange[0], self.vRange[1])
         else:
             self.wAngle = self.clamp(angle, self.wRange[0], self.wRange[1])
-        self.update()
+        self.markLocalDirty()
 
     def setDefaultAngle(self, angle, axis):
         """
         Set default angle for rotation along every axis
-        :param axis: rotation axis. Axis must be uAxis, vAxis, or wAxis
+        :param axis: rotation axis. Axis must be uAxis, vAxis, or wAxis, or their ID
         :param angle: the default deg
         :return: None
         """
-        if axis not in self.axisBucket:
+        index = self.axisIndex(axis)
+        if index is None:
             raise TypeError("unknown axis for rotation")
-        index = self.axisBucket.index(axis)
+        self.markLocalDirty()
         if index == 0:
             self.default_uAngle = angle
             self.uAngle = angle
@@ -384,6 +776,7 @@ class Component:
             raise TypeError("pos should have type Point")
         self.defaultPos = pos.copy()
         self.currentPos = copy.deepcopy(self.defaultPos)
+        self.markRigidDirty()
 
     def setDefaultScale(self, scale):
         """
@@ -401,7 +794,7 @@ class Component:
             raise ValueError("Component only accept uniform scaling")"""
         self.defaultScaling = copy.deepcopy(scale)
         self.currentScaling = copy.deepcopy(self.defaultScaling)
-        self.update()
+        self.markRigidDirty()
 
     def setDefaultColor(self, color):
         """
@@ -412,6 +805,7 @@ class Component:
         """
         if not isinstance(color, ColorType):
             raise TypeError("color should have type ColorType")
+        self.invalidateBake()
         self.default_color = np.array(color.copy().getRGB())
         self.current_color = copy.deepcopy(self.default_color)
 
@@ -425,7 +819,7 @@ class Component:
         if not isinstance(pos, Point):
             raise TypeError("pos should have type Point")
         self.currentPos = pos.copy()
-        self.update()
+        self.markRigidDirty()
 
     def setCurrentColor(self, color):
         """
@@ -434,6 +828,7 @@ class Component:
         :type color: ColorType
         :return: None
         """
+        self.invalidateBake()
         if isinstance(color, ColorType):
             self.current_color = np.array(color.copy().getRGB())
         elif (isinstance(color, tuple) or isinstance(color, list)) and len(color) == 3:
@@ -456,7 +851,7 @@ class Component:
         if min(scale) != max(scale):
             raise ValueError("Component only accept uniform scaling")
         self.currentScaling = copy.deepcopy(scale)
-        self.update()
+        self.markRigidDirty()
 
     def changeRotationAxis(self, u, v, w):
         """
@@ -488,6 +883,7 @@ class Component:
         self.uAngle = 0
         self.vAngle = 0
         self.wAngle = 0
+        self.markRigidDirty()
 
     def setPreRotation(self, rotation_matrix=None):
         """
@@ -500,6 +896,7 @@ class Component:
         """
         if isinstance(rotation_matrix, np.ndarray):
             self.preRotationMat = rotation_matrix
+            self.markRigidDirty()
 
     def setPostRotation(self, rotation_matrix=None):
         """
@@ -511,6 +908,53 @@ class Component:
         """
         if isinstance(rotation_matrix, np.ndarray):
             self.postRotationMat = rotation_matrix
+            self.markRigidDirty()
+
+    @property
+    def uAngle(self):
+        return self.angles[0]
+
+    @uAngle.setter
+    def uAngle(self, value):
+        self.angles[0] = value
+
+    @property
+    def vAngle(self):
+        return self.angles[1]
+
+    @vAngle.setter
+    def vAngle(self, value):
+        self.angles[1] = value
+
+    @property
+    def wAngle(self):
+        return self.angles[2]
+
+    @wAngle.setter
+    def wAngle(self, value):
+        self.angles[2] = value
+
+    @property
+    def uRange(self):
+        """
+        [min, max] u angle, a view of angleRanges
+        """
+        return self.angleRanges[self.AXIS_U]
+
+    @property
+    def vRange(self):
+        return self.angleRanges[self.AXIS_V]
+
+    @property
+    def wRange(self):
+        return self.angleRanges[self.AXIS_W]
+
+    @property
+    def axisBucket(self):
+        """
+        (uAxis, vAxis, wAxis), in axis ID order
+        """
+        return self.uAxis, self.vAxis, self.wAxis
 
     def u(self):
         return self.uAxis.copy()
@@ -524,34 +968,83 @@ class Component:
     def setU(self, u):
         if len(u) != len(self.uAxis):
             raise TypeError("axis should have the same size as the current one")
+        # copy on write, the default axes are shared
+        self.uAxis = self.uAxis.copy()
         for i in range(len(u)):
             self.uAxis[i] = u[i]
+        self.markLocalDirty()
 
     def setV(self, v):
         if len(v) != len(self.vAxis):
             raise TypeError("axis should have the same size as the current one")
+        self.vAxis = self.vAxis.copy()
         for i in range(len(v)):
             self.vAxis[i] = v[i]
+        self.markLocalDirty()
 
     def setW(self, w):
         if len(w) != len(self.wAxis):
             raise TypeError("axis should have the same size as the current one")
+        self.wAxis = self.wAxis.copy()
         for i in range(len(w)):
             self.wAxis[i] = w[i]
+        self.markLocalDirty()
     
     def setQuaternion(self, q):
         """ 
         sets a quaternion for rotation 
+        A one-row QuaternionArray view (e.g. quats[i]) keeps reading the array it was taken from;
+        call markLocalDirty after writing into that array
 
         :param q: a quaternion created with Quaternion.py
-        :type q: Quaternion
+        :type q: Quaternion or QuaternionArray
         """
-        if not isinstance(q, Quaternion):
+        if isinstance(q, QuaternionArray):
+            if len(q) != 1:
+                raise TypeError("q must be a single quaternion of a QuaternionArray")
+        elif not isinstance(q, Quaternion):
             raise TypeError("q must be of type Quaternion")
         self.quat = q
+        self.markLocalDirty()
 
     def clearQuaternion(self):
         """ 
         clears the existing quaternion
         """
         self.quat = None
+        self.markLocalDirty()
+
+
+if __name__ == "__main__":
+    import gc
+    import time
+    import tracemalloc
+
+    from Shapes import Cube
+
+    def build(n, make, branching=4):
+        nodes = [make()]
+        for i in range(1, n):
+            c = make()
+            nodes[(i - 1) // branching].addChild(c)
+            nodes.append(c)
+        return nodes
+
+    # load the cube geometry up front, it is shared by every Cube
+    Cube(Point((0, 0, 0)), None, [1, 1, 1])
+    n = 100000
+    print(f"{'node':>10}{'nodes':>9}{'B/node built':>14}{'B/node updated':>16}{'us/node built':>15}{'has __dict__':>14}")
+    for name, make in (("Component", lambda: Component(Point((0, 0, 0)))),
+                       ("Cube", lambda: Cube(Point((0, 0, 0)), None, [0.1, 0.1, 0.1]))):
+        gc.collect()
+        tracemalloc.start()
+        t1 = time.perf_counter()
+        nodes = build(n, make)
+        buildTime = time.perf_counter() - t1
+        built = tracemalloc.get_traced_memory()[0]
+        nodes[0].update(np.identity(4))
+        updated = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{name:>10}{n:>9}{built / n:>14.0f}{updated / n:>16.0f}{buildTime / n * 1e6:>15.1f}"
+              f"{str(hasattr(nodes[0], '__dict__')):>14}")
+        del nodes
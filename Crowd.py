@@ -0,0 +1,451 @@
+"""
+Many copies of one linkage, drawn with instancing.
+
+A Crowd keeps a single Component tree, the prototype, flattened into a FlatScene that supplies the constant part of
+every joint: rotation axes, position, scaling, pre- and post-rotation. A copy only adds a root transformation, a time
+offset into an Animation and its row of the (count, joints) world matrices, which are computed one tree level at a
+time for all copies at once. Each joint with a mesh is then drawn once for the whole crowd by
+MeshArena.drawInstanced, with the world matrices and colors of all copies streamed from one instance buffer.
+"""
+
+import os
+
+if __name__ == "__main__":
+    # the benchmark below renders without a window through EGL, PyOpenGL picks its platform when first imported
+    os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+    os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+
+import weakref
+
+import numpy as np
+
+from Animation import Animation, EULER
+from Component import Component
+from Displayable import Displayable
+from FlatScene import FlatScene
+from GeometryRegistry import registry
+from GLBuffer import MeshArena
+from Shapes import Shape
+
+
+def multiplyQuaternions(p, q):
+    """
+    Hamilton product of quaternions given as (s, v0, v1, v2) tuples of arrays, as in Quaternion.multiply
+    """
+    s1, a1, b1, c1 = p
+    s2, a2, b2, c2 = q
+    return (s1 * s2 - a1 * a2 - b1 * b2 - c1 * c2,
+            s1 * a2 + s2 * a1 + b1 * c2 - c1 * b2,
+            s1 * b2 + s2 * b1 + c1 * a2 - a1 * c2,
+            s1 * c2 + s2 * c1 + a1 * b2 - b1 * a2)
+
+
+def quaternionRotations(q, out):
+    """
+    Rotation matrices of unit quaternions, as in Quaternion.toMatrix
+
+    :param q: (s, v0, v1, v2) tuple of arrays
+    :type q: tuple
+    :param out: (3, 3, ...) component-major, out[i, j] receives entry (i, j) of every matrix
+    :type out: numpy.ndarray
+    """
+    s, a, b, c = q
+    a2, b2, c2 = a + a, b + b, c + c
+    aa, bb, cc = a * a2, b * b2, c * c2
+    ab, ac, bc = a * b2, a * c2, b * c2
+    sa, sb, sc = s * a2, s * b2, s * c2
+    np.subtract(1, bb, out=out[0, 0])
+    out[0, 0] -= cc
+    np.add(ab, sc, out=out[1, 0])
+    np.subtract(ac, sb, out=out[2, 0])
+    np.subtract(ab, sc, out=out[0, 1])
+    np.subtract(1, aa, out=out[1, 1])
+    out[1, 1] -= cc
+    np.add(bc, sa, out=out[2, 1])
+    np.add(ac, sb, out=out[0, 2])
+    np.subtract(bc, sa, out=out[1, 2])
+    np.subtract(1, aa, out=out[2, 2])
+    out[2, 2] -= bb
+
+
+def eulerRotations(angles, axes, out):
+    """
+    Batched rotationW @ rotationU @ rotationV of Component.updateLocal, composed as quaternions in float32:
+    numpy's float32 sin and cos are vectorized, the float64 ones are several times slower
+
+    :param angles: (3, ...) u, v, w angles in degrees
+    :type angles: numpy.ndarray
+    :param axes: (3, 3, ...) component j of the u, v, w axis i at [i, j], broadcast against the angles
+    :type axes: numpy.ndarray
+    :param out: (3, 3, ...) component-major rotation matrices
+    :type out: numpy.ndarray
+    """
+    half = np.radians(angles, dtype=np.float32)
+    half *= np.float32(0.5)
+    cos, sin = np.cos(half), np.sin(half)
+    u, v, w = ((cos[i], sin[i] * axes[i, 0], sin[i] * axes[i, 1], sin[i] * axes[i, 2]) for i in range(3))
+    quaternionRotations(multiplyQuaternions(multiplyQuaternions(w, u), v), out)
+
+
+def affineMultiply(a, b, out):
+    """
+    out = a @ b for affine transformations stored component-major: a[i, j] is entry (i, j) of every matrix, only
+    rows 0 to 2 are stored since the last one is always 0 0 0 1. Leading shapes broadcast; out must not overlap a or b
+
+    :param a: (3, 4, ...)
+    :param b: (3, 4, ...)
+    :param out: (3, 4, ...)
+    """
+    scratch = np.empty(out.shape[2:], dtype=out.dtype)
+    for i in range(3):
+        for j in range(4):
+            entry = out[i, j]
+            np.multiply(a[i, 0], b[0, j], out=entry)
+            for k in (1, 2):
+                np.multiply(a[i, k], b[k, j], out=scratch)
+                entry += scratch
+            if j == 3:
+                entry += a[i, 3]
+
+
+def componentMajor(matrices):
+    """
+    :param matrices: (..., 4, 4) row-major affine matrices
+    :return: (3, 4, ...) float32 copy, see affineMultiply
+    :rtype: numpy.ndarray
+    """
+    matrices = np.asarray(matrices, dtype=np.float32)
+    return np.ascontiguousarray(np.moveaxis(matrices[..., 0:3, :], (-2, -1), (0, 1)))
+
+
+class Crowd:
+    """
+    count copies of a linkage, see module docstring.
+    Per-copy state is component-major and joint-major, e.g. angles[i, s] holds angle i of joint s of every copy, so
+    each step is a few dozen float32 operations over all copies at once
+    """
+    prototype = None  # root Component of one copy, owned by the crowd
+    scene = None  # FlatScene of the prototype
+    count = 0
+    rootMats = None  # (3, 4, count) float32 transformation of each copy
+    animation = None  # Animation of the prototype's joints with one offset per copy, None for a still crowd
+    animatedNodes = None  # scene index of each joint of the animation
+    lowPoly = False  # draw shapes with their low-poly asset when they have one
+    dirty = True  # world matrices are out of date
+
+    axes = None  # (3, 3, S, 1) float32 rotation axes of every joint
+    postMats = None  # (3, 4, S, 1) float32 postRotation @ translation of every joint
+    preMats = None  # (3, 4, S, 1) float32 scaling @ preRotation of every joint
+    hasQuat = None  # (S,) bool, joints rotated by a quaternion of the prototype
+    quatRotation = None  # (3, 3, S, 1) float32
+
+    angles = None  # (3, S, count) float32
+    rotations = None  # (3, 4, S, count) float32, rotation with no translation
+    rotatedMats = None  # (3, 4, S, count) float32, rotation @ preMats
+    localMats = None  # (3, 4, S, count) float32
+    worldMats = None  # (3, 4, S, count) float32
+
+    meshNodes = None  # (D,) scene index of every joint with a mesh
+    instances = None  # (D, count, MeshArena.INSTANCE_FLOATS) float32, the copies of a joint are consecutive
+    arenaRecords = None  # MeshArena -> (drawInstanced records, (3, 4, D, 1) float32 mesh matrices)
+
+    def __init__(self, prototype, rootMats, clip=None, interpolation=EULER, offsets=None, joints=None,
+                 lowPoly=False):
+        """
+        :param prototype: one copy of the linkage, flattened into a FlatScene and not drawn itself
+        :type prototype: Component
+        :param rootMats: (count, 4, 4) row-major transformation of each copy
+        :type rootMats: numpy.ndarray
+        :param clip: animation played by every copy, the copies keep the pose of the prototype if None
+        :type clip: Animation.Clip
+        :param interpolation: Animation.EULER or Animation.SLERP
+        :type interpolation: string
+        :param offsets: (count,) seconds added to the animation time of each copy, zeros if None
+        :type offsets: numpy.ndarray
+        :param joints: components animated by clip, prototype.componentList if None
+        :type joints: list
+        :param lowPoly: draw shapes with their low-poly asset when they have one
+        :type lowPoly: bool
+        """
+        if not isinstance(prototype, Component):
+            raise TypeError("prototype should have type Component")
+        rootMats = np.asarray(rootMats)
+        if rootMats.ndim != 3 or rootMats.shape[1:] != (4, 4):
+            raise TypeError(f"rootMats should have shape (count, 4, 4), not {rootMats.shape}")
+        self.prototype = prototype
+        self.count = len(rootMats)
+        self.rootMats = componentMajor(rootMats)
+        self.lowPoly = lowPoly
+
+        self.scene = FlatScene(prototype)
+        scene = self.scene
+        scene.update(np.identity(4))
+        size = len(scene)
+        self.axes = np.ascontiguousarray(scene.axes.transpose(1, 2, 0), dtype=np.float32)[..., None]
+        translations = np.tile(np.identity(4), (size, 1, 1))
+        translations[:, 0:3, 3] = scene.positions
+        scalings = np.tile(np.identity(4), (size, 1, 1))
+        scalings[:, [0, 1, 2], [0, 1, 2]] = scene.scales
+        self.postMats = componentMajor(scene.postMat @ translations)[..., None]
+        self.preMats = componentMajor(scalings @ scene.preMat)[..., None]
+        self.hasQuat = scene.hasQuat.copy()
+        self.quatRotation = np.ascontiguousarray(scene.quatRotation.transpose(1, 2, 0), dtype=np.float32)[..., None]
+
+        shape = (size, self.count)
+        self.angles = np.empty((3,) + shape, dtype=np.float32)
+        self.angles[:] = scene.angles.T[..., None]
+        self.rotations = np.zeros((3, 4) + shape, dtype=np.float32)
+        self.rotatedMats = np.empty((3, 4) + shape, dtype=np.float32)
+        self.localMats = np.empty((3, 4) + shape, dtype=np.float32)
+        self.worldMats = np.empty((3, 4) + shape, dtype=np.float32)
+
+        if clip is not None:
+            if joints is None:
+                joints = prototype.componentList
+            self.animation = Animation(clip, joints, interpolation, np.zeros(self.count) if offsets is None else offsets)
+            self.animatedNodes = np.array([c.sceneIndex for c in joints], dtype=np.int64)
+
+        self.meshNodes = np.array([i for i, c in enumerate(scene.components) if isinstance(c.displayObj, Displayable)],
+                                  dtype=np.int64)
+        self.instances = np.zeros((len(self.meshNodes), self.count, MeshArena.INSTANCE_FLOATS), dtype=np.float32)
+        # the last row of every model matrix
+        self.instances[:, :, 15] = 1
+        self.arenaRecords = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def gridPlacement(count, spacing=1.5, origin=(0, 0, 0)):
+        """
+        :return: (count, 4, 4) translations laying count copies out on a square grid in the xz plane
+        :rtype: numpy.ndarray
+        """
+        side = int(np.ceil(np.sqrt(count)))
+        cells = np.indices((side, side)).reshape(2, -1).T[:count]
+        rootMats = np.tile(np.identity(4), (count, 1, 1))
+        rootMats[:, 0, 3] = origin[0] + (cells[:, 0] - (side - 1) / 2) * spacing
+        rootMats[:, 1, 3] = origin[1]
+        rootMats[:, 2, 3] = origin[2] + (cells[:, 1] - (side - 1) / 2) * spacing
+        return rootMats
+
+    def __len__(self):
+        return self.count
+
+    def setRootMats(self, rootMats):
+        """
+        :param rootMats: (count, 4, 4) row-major transformation of each copy
+        :type rootMats: numpy.ndarray
+        """
+        self.rootMats[:] = componentMajor(rootMats)
+        self.dirty = True
+
+    def worldMatrices(self):
+        """
+        :return: (count, S, 4, 4) row-major world matrix of every joint of every copy, joints in scene order
+        :rtype: numpy.ndarray
+        """
+        self.update()
+        result = np.zeros((self.count, len(self.scene), 4, 4), dtype=np.float32)
+        result[..., 0:3, :] = self.worldMats.transpose(3, 2, 0, 1)
+        result[..., 3, 3] = 1
+        return result
+
+    def seek(self, t):
+        """
+        Evaluate the animation of every copy at time t, so a Timeline can drive the crowd
+        """
+        if self.animation is not None:
+            self.animation.evaluate(t)
+            self.dirty = True
+
+    def update(self):
+        """
+        Recompute the world matrices of every joint of every copy if anything changed
+        """
+        if not self.dirty:
+            return
+        animation = self.animation
+        if animation is not None and animation.interpolation == EULER:
+            self.angles[:, self.animatedNodes] = animation.angles.transpose(2, 1, 0)
+        rotations = self.rotations[:, 0:3]
+        eulerRotations(self.angles, self.axes, rotations)
+        if self.hasQuat.any():
+            rotations[:, :, self.hasQuat] = self.quatRotation[:, :, self.hasQuat]
+        if animation is not None and animation.interpolation != EULER:
+            # Component.updateLocal applies the transpose of a quaternion's matrix, the matrix of its conjugate
+            s, a, b, c = animation.quats.data.T.reshape(4, self.count, -1).transpose(0, 2, 1)
+            animated = np.empty((3, 3) + s.shape, dtype=np.float32)
+            quaternionRotations((s, -a, -b, -c), animated)
+            rotations[:, :, self.animatedNodes] = animated
+
+        # postRotation @ translation @ rotation @ scaling @ preRotation
+        affineMultiply(self.rotations, self.preMats, self.rotatedMats)
+        affineMultiply(self.postMats, self.rotatedMats, self.localMats)
+
+        local, world = self.localMats, self.worldMats
+        parent = self.scene.parent
+        affineMultiply(self.rootMats, local[:, :, 0], world[:, :, 0])
+        for start, end in self.scene.levels[1:]:
+            affineMultiply(world[:, :, parent[start:end]], local[:, :, start:end], world[:, :, start:end])
+        self.dirty = False
+
+    def allocate(self, arena):
+        """
+        Copy the mesh of every joint into arena, once per arena
+
+        :return: (records for arena.drawInstanced, (3, 4, D, 1) mesh matrices)
+        :rtype: tuple
+        """
+        entry = self.arenaRecords.get(arena)
+        if entry is not None:
+            return entry
+        records = []
+        meshMats = []
+        for d, node in enumerate(self.meshNodes):
+            c = self.scene.components[node]
+            if self.lowPoly and isinstance(c, Shape) and c.assetLP is not None:
+                allocation = registry.get(c.assetLP, lod=1).allocate(arena)
+                meshMat = c.mesh.sizeMat
+            else:
+                allocation, meshMat = c.displayObj.allocate(arena)
+            records.append((allocation, d * self.count, self.count))
+            meshMats.append(meshMat)
+        entry = (records, componentMajor(meshMats)[..., None])
+        self.arenaRecords[arena] = entry
+        return entry
+
+    def writeInstances(self, arena):
+        """
+        Fill the instance buffer with the model matrix, color and dequantization of every mesh of every copy
+
+        :return: records for arena.drawInstanced
+        :rtype: list
+        """
+        self.update()
+        records, meshMats = self.allocate(arena)
+        meshCount = len(self.meshNodes)
+        # entry (i, j) of the column-major matrix of mesh d, copy n is instances[d, n, 4 * j + i]
+        matrices = self.instances[:, :, 0:16].reshape(meshCount, self.count, 4, 4).transpose(3, 2, 0, 1)
+        affineMultiply(self.worldMats[:, :, self.meshNodes], meshMats, matrices[0:3])
+        colors = [self.scene.components[node].current_color for node in self.meshNodes]
+        self.instances[:, :, 16:19] = np.array(colors, dtype=np.float32)[:, None, :]
+        dequants = np.array([allocation.dequant for allocation, _, _ in records])
+        self.instances[:, :, 20:23] = dequants[:, None, 0]
+        self.instances[:, :, 24:27] = dequants[:, None, 1]
+        return records
+
+    def draw(self, arena):
+        """
+        :param arena: arena of a program compiled with GLProgram(instanced=True)
+        :type arena: GLBuffer.MeshArena
+        """
+        records = self.writeInstances(arena)
+        arena.drawInstanced(records, self.instances.reshape(-1, MeshArena.INSTANCE_FLOATS))
+
+
+if __name__ == "__main__":
+    import time
+
+    import OpenGL.GL as gl
+
+    from Animation import Clip, SLERP
+    from GLProgram import GLProgram
+    from ModelLinkage import ModelLinkage
+    from Offscreen import OffscreenContext
+    from Point import Point
+    import GLUtility
+
+    def best(f, rounds=3):
+        times = []
+        for _ in range(rounds):
+            t1 = time.perf_counter()
+            f()
+            times.append(time.perf_counter() - t1)
+        return min(times) * 1000
+
+    def breadthFirst(root):
+        nodes = [root]
+        for c in nodes:
+            nodes.extend(c.children)
+        return nodes
+
+    rng = np.random.default_rng(0)
+    clip = Clip.fromPoses(rng.uniform(-45, 45, (5, 27, 3)), 1.0)
+
+    # a crowd matches the same copies built as Component trees
+    copies = 50
+    rootMats = Crowd.gridPlacement(copies)
+    offsets = rng.uniform(0, clip.duration(), copies)
+    for interpolation in (EULER, SLERP):
+        crowd = Crowd(ModelLinkage(None, Point((0, 0, 0)), None), rootMats, clip, interpolation, offsets)
+        crowd.seek(2.3)
+        crowd.update()
+        models = [ModelLinkage(None, Point((0, 0, 0)), None) for _ in range(copies)]
+        trees = Animation(clip, [c for m in models for c in m.componentList], interpolation, offsets)
+        trees.seek(2.3)
+        for m, rootMat in zip(models, rootMats):
+            m.update(rootMat)
+        expected = np.array([[c.transformationMat for c in breadthFirst(m)] for m in models])
+        assert np.allclose(crowd.worldMatrices(), expected, atol=1e-4)
+        trees.detach()
+
+    # headless 3.3 core context rendering into a framebuffer object
+    width = height = 500
+    context = OffscreenContext(width, height)
+    gl.glEnable(gl.GL_DEPTH_TEST)
+    gl.glEnable(gl.GL_CULL_FACE)
+    print(gl.glGetString(gl.GL_RENDERER).decode(), f"{width}x{height}")
+
+    glutility = GLUtility.GLUtility()
+    programs = [GLProgram(), GLProgram(instanced=True)]
+    for program in programs:
+        program.compile()
+        program.setMat4("projectionMat", glutility.perspective(45, width, height, 0.01, 1000))
+    arena = MeshArena(programs[1])
+
+    def frame(draw, program, side):
+        program.setMat4("viewMat", glutility.view([0, side, 1.2 * side], [0, 0, 0], [0, 1, 0]))
+        gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+        draw()
+        gl.glFinish()
+
+    print(f"{'copies':>7}{'mode':>24}{'update ms':>11}{'draw ms':>10}{'draw calls':>12}{'fps':>7}")
+    frameCount = [0]
+    for copies in (100, 1000, 10000):
+        side = 1.5 * np.sqrt(copies)
+        rootMats = Crowd.gridPlacement(copies)
+        offsets = rng.uniform(0, clip.duration(), copies)
+
+        if copies <= 1000:
+            # one Component tree per copy, drawn node by node with a modelMat uniform
+            root = Component(Point((0, 0, 0)))
+            models = [ModelLinkage(None, Point((0, 0, 0)), programs[0]) for _ in range(copies)]
+            for m, rootMat in zip(models, rootMats):
+                m.setDefaultPosition(Point(rootMat[0:3, 3]))
+                root.addChild(m)
+            root.initialize()
+            trees = Animation(clip, [c for m in models for c in m.componentList], EULER, offsets)
+
+            def animateTrees():
+                frameCount[0] += 1
+                trees.seek(frameCount[0] / 60)
+                root.update(np.identity(4))
+
+            updateTime = best(animateTrees)
+            drawTime = best(lambda: frame(lambda: root.draw(programs[0]), programs[0], side))
+            print(f"{copies:>7}{'Component trees':>24}{updateTime:>11.1f}{drawTime:>10.1f}"
+                  f"{copies * 27:>12}{1000 / (updateTime + drawTime):>7.1f}")
+            del root, models, trees
+
+        for lowPoly in (False, True):
+            crowd = Crowd(ModelLinkage(None, Point((0, 0, 0)), None), rootMats, clip, EULER, offsets, lowPoly=lowPoly)
+
+            def animateCrowd():
+                frameCount[0] += 1
+                crowd.seek(frameCount[0] / 60)
+                crowd.update()
+
+            updateTime = best(animateCrowd)
+            crowd.draw(arena)
+            drawTime = best(lambda: frame(lambda: crowd.draw(arena), programs[1], side), 1 if copies > 1000 else 3)
+            mode = "instanced, low-poly" if lowPoly else "instanced"
+            print(f"{copies:>7}{mode:>24}{updateTime:>11.1f}{drawTime:>10.1f}"
+                  f"{arena.drawCalls:>12}{1000 / (updateTime + drawTime):>7.1f}")
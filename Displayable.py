@@ -11,6 +11,19 @@ class Displayable:
     """
     Interface for displayable object
     """
+    # optional 4x4 matrix applied between the owning Component's transformation and the vertices,
+    # e.g. the size of a mesh that is shared with other components
+    scaleMat = None
+    # optional 4x4 matrix taking the CPU-side vertices to the owning Component's space, None for the identity
+    sizeMat = None
+    # (2, 3) per-axis scale and offset restoring the uploaded positions, set when uploaded, see GLBuffer.VertexFormat.
+    # Applied by the vertex shader to the positions alone, never part of scaleMat or the model matrix
+    dequant = None
+    # bounds of the vertices in the owning Component's space, set when the geometry is loaded, see Bounds.
+    # None when unknown, the owning Component is then never culled
+    aabb = None  # (2, 3) min and max corner
+    sphere = None  # (center, radius)
+
     def __init__(self):
         pass
 
@@ -19,3 +32,19 @@ class Displayable:
 
     def initialize(self):
         raise NotImplementedError
+
+    def allocate(self, arena):
+        """
+        Place this object's geometry in a GLBuffer.MeshArena, once per arena
+
+        :return: (ArenaAllocation, matrix applied between the owning Component's transformation and the vertices)
+        :rtype: tuple
+        """
+        raise NotImplementedError
+
+    def freeAllocations(self):
+        """
+        Give the space allocate took back to every MeshArena, once this object is dropped.
+        Geometry shared with other objects stays where it is
+        """
+        pass
@@ -8,10 +8,13 @@ Modified by Daniel Scrivener 07/22
 """
 
 from Displayable import Displayable
-from GLBuffer import VAO, VBO, EBO
+from GLBuffer import VAO, VBO, EBO, VertexFormat
+from GeometryRegistry import SharedGeometry
+from Bounds import pointBounds, scaleBounds
+from ColladaLoader import VERTEX_STRIDE, VERTEX_DTYPE
 import numpy as np
+import weakref
 import ColorType
-from collada import *
 
 try:
     import OpenGL
@@ -38,14 +41,20 @@ try:
 except ImportError:
     raise ImportError("Required dependency PyOpenGL not present")
 
+# mesh matrix of an arena allocation whose vertices need no scaling, see DisplayableMesh.allocate
+IDENTITY = np.identity(4)
+IDENTITY.flags.writeable = False
+
 
 class DisplayableMesh(Displayable):
     vao = None
     vbo = None
     ebo = None
     shaderProg = None
+    arenaAllocations = None  # MeshArena -> ArenaAllocation
 
-    vertices = None  # array to store vertex information
+    vertices = None  # (N, 11) float32 array to store vertex information
+    vertexFields = None  # structured view of vertices, fields position, normal, color, uv
     indices = None  # stores triangle indices to vertices
 
     defaultColor = None
@@ -56,8 +65,10 @@ class DisplayableMesh(Displayable):
         :type shaderProg: GLProgram
         :param scale: set of three scale factors to be applied to each vertex
         :type scale: list or tuple
-        :param filename: .dae file to import
-        :type filename: string
+        :param vertexData: vertices with 11 floats each, flat or (N, 11). float32 input is baked in place
+        :type vertexData: numpy.ndarray
+        :param indexData: triangle indices
+        :type indexData: numpy.ndarray
         :param color: vertex color to be applied uniformly
         :type color: ColorType
         """
@@ -67,47 +78,152 @@ class DisplayableMesh(Displayable):
         self.defaultColor = np.array(color.getRGB())
 
         self.shaderProg = shaderProg
-        self.shaderProg.use()
-
-        self.vao = VAO()
-        self.vbo = VBO()  # vbo can only be initiate with glProgram activated
-        self.ebo = EBO()
 
         self.indices = indexData
-        self.vertices = vertexData
+        self.vertices = np.ascontiguousarray(vertexData, dtype=np.float32).reshape(-1, VERTEX_STRIDE)
+        if not self.vertices.flags.writeable:
+            # e.g. memory-mapped cache arrays
+            self.vertices = self.vertices.copy()
+        self.vertexFields = self.vertices.view(VERTEX_DTYPE)[:, 0]
 
-        for i in range(len(self.vertices) // 11):
-            i = i * 11
-            self.vertices[i] = self.vertices[i] * scale[0]
-            self.vertices[i + 1] = self.vertices[i + 1] * scale[1]
-            self.vertices[i + 2] = self.vertices[i + 2] * scale[2]
-            self.vertices[i + 5] = self.defaultColor[0]
-            self.vertices[i + 6] = self.defaultColor[1]
-            self.vertices[i + 7] = self.defaultColor[2]
+        self.vertexFields["position"] *= np.asarray(scale, dtype=np.float32)
+        self.vertexFields["color"] = self.defaultColor
+        self.arenaAllocations = weakref.WeakKeyDictionary()
+        self.aabb, self.sphere = pointBounds(self.vertexFields["position"])
 
     def draw(self):
+        self.shaderProg.setVec3("dequantScale", self.dequant[0])
+        self.shaderProg.setVec3("dequantOffset", self.dequant[1])
+        # the VAO stays bound, so that drawing the same mesh again does not rebind it
         self.vao.bind()
         self.ebo.draw()
-        self.vao.unbind()
 
     def initialize(self):
         """
         Remember to bind VAO before this initialization. If VAO is not bind, program might throw an error
         in systems that don't enable a default VAO after GLProgram compilation
         """
+        self.shaderProg.use()
+        if self.vao is None:
+            self.vao = VAO()
+            self.vbo = VBO()  # vbo can only be initiate with glProgram activated
+            self.ebo = EBO()
+
+        # only the attributes the shader reads are uploaded, see GLBuffer.VertexFormat
+        vertexFormat = VertexFormat.forProgram(self.shaderProg)
+        packed, self.dequant = vertexFormat.pack(self.vertices)
+
         self.vao.bind()
-        self.vbo.setBuffer(self.vertices, 11)
+        self.vbo.setPackedBuffer(packed, vertexFormat)
         self.ebo.setBuffer(self.indices)
-        
-        self.vbo.setAttribPointer(self.shaderProg.getAttribLocation("vertexPos"),
-                                  stride=11, offset=0, attribSize=3)
-        self.vbo.setAttribPointer(self.shaderProg.getAttribLocation("vertexNormal"),
-                                  stride=11, offset=3, attribSize=3) # unused
-        self.vbo.setAttribPointer(self.shaderProg.getAttribLocation("vertexColor"),
-                                  stride=11, offset=6, attribSize=3)
-        self.vbo.setAttribPointer(self.shaderProg.getAttribLocation("vertexTexture"),
-                                  stride=11, offset=9, attribSize=2) # unused
-
+        self.vbo.setFormat(vertexFormat, self.shaderProg)
 
         self.vao.unbind()
 
+    def allocate(self, arena):
+        allocation = self.arenaAllocations.get(arena)
+        if allocation is None:
+            allocation = arena.allocate(self.vertices, self.indices)
+            self.arenaAllocations[arena] = allocation
+        # the scale is baked into the vertices
+        return allocation, IDENTITY
+
+    def freeAllocations(self):
+        for arena, allocation in list(self.arenaAllocations.items()):
+            arena.free(allocation)
+        self.arenaAllocations = weakref.WeakKeyDictionary()
+
+
+class SharedMesh(Displayable):
+    """
+    Draws a SharedGeometry owned by the GeometryRegistry.
+    Nothing is baked into the vertices: the size is applied through scaleMat and the color comes from the
+    owning Component's currentColor uniform, so any number of SharedMesh can draw the same VBO/EBO.
+    """
+    shaderProg = None
+    geometry = None
+    sizeMat = None
+
+    vertices = None  # shared, do not modify
+    indices = None  # shared, do not modify
+
+    defaultColor = None
+
+    def __init__(self, shaderProg, scale, geometry, color=ColorType.BLUE):
+        """
+        :param shaderProg: compiled shader program
+        :type shaderProg: GLProgram
+        :param scale: set of three scale factors, applied through the model matrix
+        :type scale: list or tuple
+        :param geometry: unit-size geometry to draw
+        :type geometry: SharedGeometry
+        :param color: default color of the owning Component
+        :type color: ColorType
+        """
+        super(SharedMesh, self).__init__()
+        assert(len(scale) == 3)
+        if not isinstance(geometry, SharedGeometry):
+            raise TypeError("geometry should have type SharedGeometry")
+
+        self.defaultColor = np.array(color.getRGB())
+        self.shaderProg = shaderProg
+        self.geometry = geometry
+        self.vertices = geometry.vertices
+        self.indices = geometry.indices
+        self.sizeMat = np.diag([float(scale[0]), float(scale[1]), float(scale[2]), 1.0])
+        self.scaleMat = self.sizeMat
+        self.aabb, self.sphere = scaleBounds(geometry.aabb, geometry.sphere, scale)
+
+    def draw(self):
+        self.shaderProg.setVec3("dequantScale", self.dequant[0])
+        self.shaderProg.setVec3("dequantOffset", self.dequant[1])
+        self.geometry.draw(self.shaderProg)
+
+    def initialize(self):
+        self.geometry.initialize(self.shaderProg)
+        self.dequant = self.geometry.dequant(self.shaderProg)
+
+    def allocate(self, arena):
+        allocation = self.geometry.allocate(arena)
+        return allocation, self.sizeMat
+
+
+if __name__ == "__main__":
+    import time
+
+    def bakeLoop(vertices, scale, color):
+        # per-vertex baking this class used to do, kept for comparison
+        for i in range(len(vertices) // 11):
+            i = i * 11
+            vertices[i] = vertices[i] * scale[0]
+            vertices[i + 1] = vertices[i + 1] * scale[1]
+            vertices[i + 2] = vertices[i + 2] * scale[2]
+            vertices[i + 6] = color[0]
+            vertices[i + 7] = color[1]
+            vertices[i + 8] = color[2]
+
+    scale = [0.3, 0.1, 0.3]
+    print(f"{'vertices':>10}{'loop ms':>12}{'vectorized ms':>16}{'speedup':>10}")
+    for n in (100, 1000, 10000, 100000, 1000000):
+        source = np.random.default_rng(0).random(n * 11, dtype=np.float32)
+        rounds = max(1, 100000 // n)
+
+        data = source.copy()
+        t1 = time.perf_counter()
+        for _ in range(min(rounds, 3)):
+            bakeLoop(data, scale, ColorType.RED.getRGB())
+        t2 = time.perf_counter()
+        loopTime = (t2 - t1) / min(rounds, 3) * 1000
+
+        copies = [source.copy() for _ in range(rounds)]
+        t1 = time.perf_counter()
+        for data in copies:
+            DisplayableMesh(None, scale, data, None, ColorType.RED)
+        t2 = time.perf_counter()
+        vectorTime = (t2 - t1) / rounds * 1000
+
+        expected = source.copy()
+        bakeLoop(expected, scale, ColorType.RED.getRGB())
+        mesh = DisplayableMesh(None, scale, source.copy(), None, ColorType.RED)
+        assert np.allclose(mesh.vertices.reshape(-1), expected)
+        print(f"{n:>10}{loopTime:>12.3f}{vectorTime:>16.3f}{loopTime / vectorTime:>9.0f}x")
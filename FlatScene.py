@@ -0,0 +1,303 @@
+"""
+Array-backed representation of a Component tree.
+
+Components are numbered in breadth-first order, so every level of the tree is a contiguous range and parents come
+before their children. Angles, positions, scaling and the local and world matrices of all components live in
+(N, ...) arrays; world matrices are computed one level at a time with a single batched np.matmul.
+
+Once attached, Components are views into the scene: their angles, localMat and transformationMat are rows of these
+arrays, and Component.update on any of them updates the whole scene.
+"""
+
+import numpy as np
+
+from Component import Component
+
+
+def rotationMatrices(angles, axes):
+    """
+    Batched GLUtility.rotate, row-major
+
+    :param angles: (N,) angles in degrees
+    :type angles: numpy.ndarray
+    :param axes: (N, 3) rotation axes
+    :type axes: numpy.ndarray
+    :return: (N, 3, 3) rotation matrices
+    :rtype: numpy.ndarray
+    """
+    half = np.radians(angles) * 0.5
+    q = np.empty((len(angles), 4))
+    q[:, 0] = np.cos(half)
+    q[:, 1:4] = np.sin(half)[:, None] * axes
+    norm = np.sqrt((q * q).sum(axis=1))
+    degenerate = norm < 1e-6
+    q /= np.where(degenerate, 1.0, norm)[:, None]
+    s, a, b, c = q.T
+
+    result = np.empty((len(angles), 3, 3))
+    result[:, 0, 0] = 1 - 2 * b * b - 2 * c * c
+    result[:, 1, 0] = 2 * a * b + 2 * s * c
+    result[:, 2, 0] = 2 * a * c - 2 * s * b
+    result[:, 0, 1] = 2 * a * b - 2 * s * c
+    result[:, 1, 1] = 1 - 2 * a * a - 2 * c * c
+    result[:, 2, 1] = 2 * b * c + 2 * s * a
+    result[:, 0, 2] = 2 * a * c + 2 * s * b
+    result[:, 1, 2] = 2 * b * c - 2 * s * a
+    result[:, 2, 2] = 1 - 2 * a * a - 2 * b * b
+    result[degenerate] = np.identity(3)
+    return result
+
+
+class FlatScene:
+    """
+    Flattened Component tree, see module docstring
+    """
+    root = None
+    components = None  # list<Component>, breadth-first
+    parent = None  # (N,) index of each component's parent, -1 for the root
+    levels = None  # list of (start, end) index ranges, one per depth
+
+    angles = None  # (N, 3) u, v, w angles in degrees
+    axes = None  # (N, 3, 3) u, v, w rotation axes
+    positions = None  # (N, 3)
+    scales = None  # (N, 3)
+    preMat = None  # (N, 4, 4)
+    postMat = None  # (N, 4, 4)
+    quatRotation = None  # (N, 3, 3) rotation of components using a quaternion
+    hasQuat = None  # (N,) bool
+    localMat = None  # (N, 4, 4)
+    worldMat = None  # (N, 4, 4)
+    rootParentMat = None  # 4x4 transformation the root was last updated with
+
+    syncDirty = None  # (N,) bool: read position, scaling, axes etc. from the Component again
+    localDirty = None  # (N,) bool: rebuild localMat
+    worldDirty = None  # (N,) bool: rebuild worldMat
+    structureDirty = False  # components were added or removed, rebuild the arrays
+
+    def __init__(self, root):
+        """
+        Flatten the tree under root and attach every component in it to this scene
+
+        :type root: Component
+        """
+        if not isinstance(root, Component):
+            raise TypeError("root should have type Component")
+        self.root = root
+        self.build()
+
+    def build(self):
+        components = [self.root]
+        parent = [-1]
+        levels = []
+        start = 0
+        while start < len(components):
+            end = len(components)
+            levels.append((start, end))
+            for i in range(start, end):
+                for c in components[i].children:
+                    components.append(c)
+                    parent.append(i)
+            start = end
+        n = len(components)
+
+        self.components = components
+        self.parent = np.array(parent, dtype=np.int64)
+        self.levels = levels
+        self.angles = np.array([c.angles for c in components], dtype=np.float64).reshape(n, 3)
+        self.axes = np.zeros((n, 3, 3))
+        self.positions = np.zeros((n, 3))
+        self.scales = np.ones((n, 3))
+        self.preMat = np.tile(np.identity(4), (n, 1, 1))
+        self.postMat = np.tile(np.identity(4), (n, 1, 1))
+        self.quatRotation = np.tile(np.identity(3), (n, 1, 1))
+        self.hasQuat = np.zeros(n, dtype=bool)
+        self.localMat = np.tile(np.identity(4), (n, 1, 1))
+        self.worldMat = np.tile(np.identity(4), (n, 1, 1))
+        self.rootParentMat = np.identity(4)
+        self.syncDirty = np.ones(n, dtype=bool)
+        self.localDirty = np.ones(n, dtype=bool)
+        self.worldDirty = np.ones(n, dtype=bool)
+        self.structureDirty = False
+
+        for i, c in enumerate(components):
+            c.scene = self
+            c.sceneIndex = i
+            c.angles = self.angles[i]
+            c.localMat = self.localMat[i]
+            c.transformationMat = self.worldMat[i]
+
+    def detach(self):
+        """
+        Give every component its own copy of its state again, they go back to the recursive Component.update
+        """
+        for c in self.components:
+            c.scene = None
+            c.sceneIndex = None
+            c.angles = c.angles.copy()
+            c.localMat = c.localMat.copy()
+            c.transformationMat = c.transformationMat.copy()
+            c.parentMat = None
+            c.markLocalDirty()
+        self.components = []
+
+    def __len__(self):
+        return len(self.components)
+
+    def markDirty(self, indices=None):
+        """
+        Flag components whose angles were written directly into self.angles
+
+        :param indices: component indices, all components if None
+        :type indices: numpy.ndarray
+        """
+        if indices is None:
+            self.localDirty[:] = True
+        else:
+            self.localDirty[indices] = True
+
+    def isDirty(self):
+        """
+        Whether update has anything to recompute
+        """
+        return self.structureDirty or bool(self.syncDirty.any() or self.localDirty.any() or self.worldDirty.any())
+
+    def sync(self, i):
+        """
+        Read everything but the angles (already shared with the arrays) from component i
+        """
+        c = self.components[i]
+        self.axes[i] = [c.uAxis.getCoords(), c.vAxis.getCoords(), c.wAxis.getCoords()]
+        self.positions[i] = c.currentPos.getCoords()
+        self.scales[i] = c.currentScaling
+        self.preMat[i] = c.preRotationMat
+        self.postMat[i] = c.postRotationMat
+        self.hasQuat[i] = c.quat is not None
+        if c.quat is not None:
+            self.quatRotation[i] = c.quat.toMatrix().reshape(4, 4).transpose()[0:3, 0:3]
+
+    def updateLocal(self, indices):
+        """
+        Batched Component.updateLocal: postRotation @ translation @ rotationW @ rotationU @ rotationV @ scaling @ preRotation
+        """
+        angles = self.angles[indices]
+        axes = self.axes[indices]
+        rotation = rotationMatrices(angles[:, 2], axes[:, 2]) @ rotationMatrices(angles[:, 0], axes[:, 0]) \
+            @ rotationMatrices(angles[:, 1], axes[:, 1])
+        quat = self.hasQuat[indices]
+        if quat.any():
+            rotation[quat] = self.quatRotation[indices[quat]]
+
+        myTransformation = np.zeros((len(indices), 4, 4))
+        myTransformation[:, 0:3, 0:3] = rotation * self.scales[indices][:, None, :]
+        myTransformation[:, 0:3, 3] = self.positions[indices]
+        myTransformation[:, 3, 3] = 1
+        self.localMat[indices] = self.postMat[indices] @ myTransformation @ self.preMat[indices]
+
+    def update(self, rootParentMat=None):
+        """
+        Rebuild the local matrices of flagged components and the world matrices of those components and their
+        descendants, one tree level at a time
+
+        :param rootParentMat: transformation applied above the root, unchanged if None
+        :type rootParentMat: numpy.ndarray
+        """
+        if self.structureDirty:
+            self.build()
+        if rootParentMat is not None and not np.array_equal(rootParentMat, self.rootParentMat):
+            self.rootParentMat = np.array(rootParentMat, dtype=np.float64)
+            self.worldDirty[0] = True
+
+        if self.syncDirty.any():
+            for i in np.flatnonzero(self.syncDirty):
+                self.sync(i)
+            self.syncDirty[:] = False
+
+        localCount = 0
+        if self.localDirty.any():
+            indices = np.flatnonzero(self.localDirty)
+            self.updateLocal(indices)
+            self.localDirty[:] = False
+            self.worldDirty[indices] = True
+            localCount = len(indices)
+
+        worldCount = 0
+        if self.worldDirty.any():
+            if self.worldDirty[0]:
+                self.worldMat[0] = self.rootParentMat @ self.localMat[0]
+            for start, end in self.levels[1:]:
+                parent = self.parent[start:end]
+                dirty = self.worldDirty[start:end]
+                dirty |= self.worldDirty[parent]
+                if dirty.all():
+                    np.matmul(self.worldMat[parent], self.localMat[start:end], out=self.worldMat[start:end])
+                elif dirty.any():
+                    indices = start + np.flatnonzero(dirty)
+                    self.worldMat[indices] = self.worldMat[self.parent[indices]] @ self.localMat[indices]
+            worldCount = int(np.count_nonzero(self.worldDirty))
+            self.worldDirty[:] = False
+
+        Component.localUpdates += localCount
+        Component.worldUpdates += worldCount
+
+
+if __name__ == "__main__":
+    import time
+
+    from Point import Point
+    from ModelLinkage import ModelLinkage
+
+    def randomTree(n, branching=4):
+        rng = np.random.default_rng(n)
+        nodes = [Component(Point((0, 0, 0)))]
+        for i in range(1, n):
+            c = Component(Point(tuple(rng.uniform(-1, 1, 3))))
+            for axis, angle in zip(c.axisBucket, rng.uniform(-90, 90, 3)):
+                c.setDefaultAngle(angle, axis)
+            nodes[(i - 1) // branching].addChild(c)
+            nodes.append(c)
+        return nodes[0]
+
+    def allNodes(root):
+        nodes = []
+        stack = [root]
+        while stack:
+            c = stack.pop()
+            nodes.append(c)
+            stack.extend(c.children)
+        return nodes
+
+    def best(f, rounds, setup=None):
+        times = []
+        for _ in range(rounds):
+            if setup is not None:
+                setup()
+            t1 = time.perf_counter()
+            f()
+            times.append(time.perf_counter() - t1)
+        return min(times) * 1000
+
+    print(f"{'nodes':>8}{'recursive ms':>15}{'flat ms':>10}{'speedup':>9}{'flat steady ms':>16}{'max diff':>10}")
+    for n in (27, 1000, 10000, 100000):
+        if n == 27:
+            root = Component(Point((0, 0, 0)))
+            root.addChild(ModelLinkage(None, Point((0, 0, 0)), None))
+        else:
+            root = randomTree(n)
+        nodes = allNodes(root)
+        rounds = max(3, 3000 // len(nodes))
+
+        def markAll():
+            for c in nodes:
+                c.markLocalDirty()
+
+        recursiveTime = best(lambda: root.update(np.identity(4)), rounds, markAll)
+        reference = np.array([c.transformationMat for c in nodes])
+
+        scene = FlatScene(root)
+        scene.update(np.identity(4))
+        flatTime = best(lambda: scene.update(np.identity(4)), rounds, scene.markDirty)
+        steadyTime = best(lambda: scene.update(np.identity(4)), rounds)
+        error = np.abs(np.array([c.transformationMat for c in nodes]) - reference).max()
+        print(f"{len(nodes):>8}{recursiveTime:>15.2f}{flatTime:>10.2f}{recursiveTime / flatTime:>8.0f}x"
+              f"{steadyTime:>16.3f}{error:>10.1e}")
+        scene.detach()
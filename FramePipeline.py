@@ -0,0 +1,335 @@
+"""
+Evaluate the transforms of the next frame on a worker thread while the current frame is drawn.
+
+Sketch.OnDraw otherwise poses the model, updates its world matrices, gathers and sorts the draw records and only then
+submits them to GL, so a frame costs the sum of both. A FramePipeline keeps two FrameStates: while the GL thread
+draws the front one, frame N, a worker fills the back one with frame N+1 (animation, Component.update,
+Component.collectTransforms, RenderQueue.sort) and packs its model matrices and colors into the state's own rows, in
+the layout of GLBuffer.TransformBuffer. The two are swapped at the frame boundary.
+
+The draw reads nothing but its FrameState, so the next update may rewrite matrices in place (FlatScene) meanwhile.
+The other way round, nothing else touches the components while the worker runs: its stage starts with the frame and
+is joined before the frame ends, so the input handlers, which run between frames, never meet an update in progress.
+The price is one frame of latency, an input is evaluated by the next stage and drawn in the frame after it.
+
+The stages only overlap while the interpreter lock is free. numpy and GL release it for their C code, and the GL
+thread mostly waits for the driver and SwapBuffers, but the Python parts of update and of the draw loop run one at a
+time. The frame time approaches max(update, draw) when the draw is GPU or driver bound, see the benchmark below.
+
+prepare runs on the worker and must make no GL call. The first frame, and the first one after reset, is prepared on
+the calling thread instead, where lazily created GL objects (e.g. the meshes of a StaticBake) get their buffers.
+"""
+
+import os
+
+if __name__ == "__main__":
+    # the benchmark below renders without a window through EGL, PyOpenGL picks its platform when first imported
+    os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+    os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+
+import threading
+
+import numpy as np
+
+from GLBuffer import TransformBuffer
+
+
+class FrameState:
+    """
+    Everything the draw of one frame reads
+    """
+    records = None  # (Displayable, model matrix, color, Texture or None) per draw, the matrices and colors unread
+    rows = None  # (len(records), ROW_FLOATS) float32 packed matrices and colors, see TransformBuffer.pack
+    buffer = None  # rows reserved, rows is its beginning
+    order = None  # indices of records in drawing order, None for all of them in order
+    viewMat = None  # viewing matrix the records were culled and sorted with
+    counters = None  # dict of whatever else prepare measured, e.g. Sketch.updateCounters
+
+    def __init__(self):
+        self.records = []
+        self.buffer = np.zeros((0, TransformBuffer.ROW_FLOATS), dtype=np.float32)
+        self.rows = self.buffer
+        self.counters = {}
+
+    def pack(self):
+        """
+        Pack the records into rows, reusing the buffer of the frame before last
+        """
+        count = len(self.records)
+        if count > len(self.buffer):
+            self.buffer = np.zeros((max(2 * len(self.buffer), count), TransformBuffer.ROW_FLOATS), dtype=np.float32)
+        self.rows = TransformBuffer.pack(self.records, self.buffer[:count])
+
+    def sameAs(self, other):
+        """
+        Whether drawing other would give the same picture
+        """
+        if len(self.records) != len(other.records) or not np.array_equal(self.viewMat, other.viewMat):
+            return False
+        if not np.array_equal(self.rows, other.rows):
+            return False
+        if (self.order is None) != (other.order is None) or (
+                self.order is not None and not np.array_equal(self.order, other.order)):
+            return False
+        return all(a[0] is b[0] and a[3] is b[3] for a, b in zip(self.records, other.records))
+
+
+class FramePipeline:
+    """
+    See module docstring
+    """
+    front = None  # FrameState drawn in the current frame
+    back = None  # FrameState prepared meanwhile
+    primed = False  # front holds a prepared frame
+    changed = False  # the state prepared during the last frame differs from the one drawn, see needsFrame
+    worker = None
+    busy = False  # the worker is preparing the back state
+    running = True
+
+    def __init__(self, prepare):
+        """
+        :param prepare: prepare(state) fills state.records, state.order, state.viewMat and state.counters from the
+                        current scene, without GL calls
+        :type prepare: function
+        """
+        self.prepare = prepare
+        self.front = FrameState()
+        self.back = FrameState()
+        self.start = threading.Event()
+        self.done = threading.Event()
+        self.error = None
+
+    def reset(self):
+        """
+        Prepare the next frame on the calling thread again, e.g. after a new context or model
+        """
+        self.join()
+        self.primed = False
+        self.changed = False
+
+    def begin(self):
+        """
+        Start preparing the next frame on the worker
+
+        :return: the state to draw now
+        :rtype: FrameState
+        """
+        if not self.primed:
+            self.fill(self.front)
+            self.primed = True
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.run, name="FramePipeline", daemon=True)
+            self.worker.start()
+        self.busy = True
+        self.start.set()
+        return self.front
+
+    def end(self):
+        """
+        Wait for the next frame to be prepared and make it the front state, call once the current one is drawn
+        """
+        self.join()
+        if self.error is not None:
+            error, self.error = self.error, None
+            # the back state is incomplete, the next frame is prepared anew
+            self.primed = False
+            raise error
+        self.front, self.back = self.back, self.front
+        self.changed = not self.front.sameAs(self.back)
+
+    def join(self):
+        if self.busy:
+            self.done.wait()
+            self.done.clear()
+            self.busy = False
+
+    def needsFrame(self):
+        """
+        Whether the frame prepared last shows something the screen does not, i.e. input or animation that arrived
+        during the previous frame
+        """
+        return self.changed
+
+    def stop(self):
+        """
+        Finish the frame being prepared and end the worker
+        """
+        self.join()
+        self.running = False
+        self.start.set()
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+
+    def fill(self, state):
+        state.counters = {}
+        self.prepare(state)
+        state.pack()
+
+    def run(self):
+        while True:
+            self.start.wait()
+            self.start.clear()
+            if not self.running:
+                return
+            try:
+                self.fill(self.back)
+            except Exception as error:
+                self.error = error
+            self.done.set()
+
+
+if __name__ == "__main__":
+    import time
+
+    import OpenGL.GL as gl
+
+    from Animation import Animation, Clip
+    from Component import Component
+    from GLProgram import GLProgram
+    from GLUtility import GLUtility
+    from ModelLinkage import ModelLinkage
+    from Offscreen import OffscreenContext
+    from Point import Point
+    from RenderQueue import RenderQueue
+
+    def timeOf(f):
+        t1 = time.perf_counter()
+        f()
+        return (time.perf_counter() - t1) * 1000
+
+    def spin(seconds):
+        # work holding the interpreter lock
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            pass
+
+    def measure(pipelined, frames, update, drawCpu, drawWait):
+        # a frame: update, then the draw made of Python issuing GL calls and waiting for the driver and GPU
+        def prepare(state):
+            spin(update)
+            state.viewMat = np.identity(4)
+
+        def draw():
+            spin(drawCpu)
+            time.sleep(drawWait)
+
+        pipeline = FramePipeline(prepare)
+        t1 = time.perf_counter()
+        for _ in range(frames):
+            if pipelined:
+                pipeline.begin()
+                draw()
+                pipeline.end()
+            else:
+                state = FrameState()
+                prepare(state)
+                draw()
+        elapsed = (time.perf_counter() - t1) / frames
+        pipeline.stop()
+        return elapsed * 1000
+
+    # the states swap, and the pipeline reports a frame still to show until the prepared one matches the drawn one
+    poses = [0.0]
+
+    def preparePose(state):
+        matrix = np.identity(4)
+        matrix[0, 3] = poses[0]
+        state.records = [(None, matrix, (1.0, 0.0, 0.0), None)]
+        state.viewMat = np.identity(4)
+
+    pipeline = FramePipeline(preparePose)
+    first = pipeline.begin()
+    pipeline.end()
+    assert pipeline.front is not first and not pipeline.needsFrame()
+    poses[0] = 1.0
+    assert pipeline.begin().rows[0, 12] == 0.0
+    pipeline.end()
+    assert pipeline.needsFrame() and pipeline.front.rows[0, 12] == 1.0
+    assert pipeline.begin().rows[0, 12] == 1.0
+    pipeline.end()
+    assert not pipeline.needsFrame()
+    pipeline.stop()
+
+    print("update ms, draw ms holding the interpreter + waiting for GL, frame ms")
+    print(f"{'update':>8}{'draw':>10}{'sum':>7}{'max':>7}{'serial':>8}{'pipelined':>11}")
+    for update, drawCpu, drawWait in ((0.004, 0.001, 0.005), (0.008, 0.002, 0.008), (0.008, 0.006, 0.002),
+                                      (0.004, 0.001, 0.012)):
+        serial = measure(False, 60, update, drawCpu, drawWait)
+        pipelined = measure(True, 60, update, drawCpu, drawWait)
+        print(f"{update * 1000:>8.0f}{f'{drawCpu * 1000:.0f}+{drawWait * 1000:.0f}':>10}"
+              f"{(update + drawCpu + drawWait) * 1000:>7.0f}{max(update, drawCpu + drawWait) * 1000:>7.0f}"
+              f"{serial:>8.1f}{pipelined:>11.1f}")
+
+    # headless 3.3 core context rendering into a framebuffer object
+    width = height = 400
+    context = OffscreenContext(width, height)
+    gl.glEnable(gl.GL_DEPTH_TEST)
+    print(gl.glGetString(gl.GL_RENDERER).decode(), f"{width}x{height}, {os.cpu_count()} cores")
+
+    # a few animated crabs drawn through a TransformBuffer, as Sketch does
+    glutility = GLUtility()
+    program = GLProgram(transformBuffer=True)
+    program.compile()
+    program.setMat4("projectionMat", glutility.perspective(45, width, height, 0.01, 100))
+    buffer = TransformBuffer(program)
+    queue = RenderQueue(0.01, 100)
+    rng = np.random.default_rng(0)
+    clip = Clip.fromPoses(rng.uniform(-45, 45, (5, 27, 3)), 1.0)
+    viewMat = glutility.view([0, 6, 8], [0, 0, 0], [0, 1, 0])
+    program.setMat4("viewMat", viewMat)
+
+    print(f"{'crabs':>6}{'update ms':>11}{'draw ms':>9}{'serial':>8}{'pipelined':>11}")
+    for copies in (4, 16):
+        root = Component(Point((0, 0, 0)))
+        models = [ModelLinkage(None, Point((2.0 * (i % 4) - 3, 0, 2.0 * (i // 4) - 3)), program)
+                  for i in range(copies)]
+        for m in models:
+            root.addChild(m)
+        root.initialize()
+        animation = Animation(clip, [c for m in models for c in m.componentList], offsets=rng.uniform(0, 5, copies))
+        frameCount = [0]
+
+        def prepareCrabs(state):
+            frameCount[0] += 1
+            animation.seek(frameCount[0] / 60)
+            root.update(np.identity(4))
+            state.viewMat = viewMat
+            state.records = root.collectTransforms()
+            state.order = queue.sort(state.records, viewMat)
+
+        def drawCrabs(state):
+            gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+            buffer.drawBatch(state.records, state.order, state.rows)
+            gl.glFinish()
+
+        def run(pipelined, frames, images=None):
+            frameCount[0] = 0
+            pipeline = FramePipeline(prepareCrabs)
+            t1 = time.perf_counter()
+            for _ in range(frames):
+                if pipelined:
+                    drawCrabs(pipeline.begin())
+                    pipeline.end()
+                else:
+                    pipeline.fill(pipeline.front)
+                    drawCrabs(pipeline.front)
+                if images is not None:
+                    images.append(gl.glReadPixels(0, 0, width, height, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE))
+            elapsed = (time.perf_counter() - t1) / frames
+            pipeline.stop()
+            return elapsed * 1000
+
+        # the pipeline draws the same frames in the same order
+        serialImages, pipelinedImages = [], []
+        run(False, 5, serialImages)
+        run(True, 5, pipelinedImages)
+        assert serialImages == pipelinedImages
+
+        state = FrameState()
+        updateTime = min(timeOf(lambda: (prepareCrabs(state), state.pack())) for _ in range(10))
+        drawTime = min(timeOf(lambda: drawCrabs(state)) for _ in range(10))
+        serial = min(run(False, 30) for _ in range(3))
+        pipelined = min(run(True, 30) for _ in range(3))
+        print(f"{copies:>6}{updateTime:>11.1f}{drawTime:>9.1f}{serial:>8.1f}{pipelined:>11.1f}")
+        animation.detach()
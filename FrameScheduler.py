@@ -0,0 +1,203 @@
+"""
+Render frames on demand instead of from a fixed-rate timer.
+
+Anything that may change the picture (input, a resize, a playing animation) calls FrameScheduler.request. The first
+request schedules one frame, no earlier than one frame interval after the previous frame; requests arriving before it
+is drawn are merged into it. Nothing is scheduled while nobody asks, so an idle window does no work at all.
+
+The scheduler does not know about wx: the canvas gives it a function starting a one-shot timer and the function
+drawing a frame, see CanvasBase. It takes no lock, call it from one thread only; RenderThread hands the requests
+of the wx thread over to its own.
+
+Requests made for an input event carry the time it arrived. The frame drawn after it is the first to show its effect,
+the time from the event to the end of that frame is its input-to-photon latency, see latency.
+"""
+
+import collections
+import time
+
+
+class FrameScheduler:
+    """
+    See module docstring
+    """
+    interval = 1 / 60  # shortest time between two frames, one vsync interval
+    window = 1.0  # seconds over which the rates are measured
+    LATENCY_SAMPLES = 240  # latencies kept, see latency
+
+    pending = False  # a frame is scheduled
+    lastFrame = None  # clock() at the start of the last frame
+
+    # since the last resetCounters
+    requests = 0
+    frames = 0
+
+    def __init__(self, fps, startTimer, drawFrame, clock=time.perf_counter):
+        """
+        :param fps: most frames per second, e.g. the display refresh rate
+        :type fps: float
+        :param startTimer: startTimer(delay) calls fire once after delay seconds
+        :type startTimer: function
+        :param drawFrame: draws one frame
+        :type drawFrame: function
+        :param clock: current time in seconds
+        :type clock: function
+        """
+        self.interval = 1.0 / fps
+        self.startTimer = startTimer
+        self.drawFrame = drawFrame
+        self.clock = clock
+        self.requestTimes = collections.deque()
+        self.frameTimes = collections.deque()
+        self.inputTimes = collections.deque()  # arrival of the inputs no frame has shown yet
+        self.latencies = collections.deque(maxlen=self.LATENCY_SAMPLES)
+
+    def request(self, inputTime=None):
+        """
+        Ask for a frame. Requests are cheap, call this from every event that may change the picture
+
+        :param inputTime: clock() when the input this frame answers arrived, None when it answers none
+        :type inputTime: float
+        """
+        now = self.clock()
+        if inputTime is not None:
+            self.inputTimes.append(inputTime)
+        self.requests += 1
+        self.requestTimes.append(now)
+        self.prune(self.requestTimes, now)
+        if self.pending:
+            return
+        self.pending = True
+        delay = 0.0 if self.lastFrame is None else max(0.0, self.lastFrame + self.interval - now)
+        self.startTimer(delay)
+
+    def fire(self):
+        """
+        Draw the scheduled frame, called back by the timer. drawFrame may return False when it found nothing to draw,
+        the frame is then not counted
+        """
+        if not self.pending:
+            return
+        self.pending = False
+        now = self.clock()
+        self.lastFrame = now
+        # inputs arriving from now on may miss this frame
+        shown = len(self.inputTimes)
+        if self.drawFrame() is False:
+            return
+        self.frames += 1
+        self.frameTimes.append(now)
+        self.prune(self.frameTimes, now)
+        end = self.clock()
+        for _ in range(shown):
+            self.latencies.append(end - self.inputTimes.popleft())
+
+    def prune(self, times, now):
+        # forget the times older than the window
+        while times and times[0] < now - self.window:
+            times.popleft()
+
+    def rates(self):
+        """
+        :return: (requested, achieved) per second over the last window: the rate at which frames were asked for and
+                 the rate at which they were drawn
+        :rtype: tuple
+        """
+        now = self.clock()
+        self.prune(self.requestTimes, now)
+        self.prune(self.frameTimes, now)
+        return len(self.requestTimes) / self.window, len(self.frameTimes) / self.window
+
+    def latency(self):
+        """
+        :return: (mean, 95th percentile, max) seconds from an input to the end of the first frame drawn after it, over
+                 the last LATENCY_SAMPLES inputs, None without inputs
+        :rtype: tuple
+        """
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return sum(latencies) / len(latencies), latencies[int(0.95 * (len(latencies) - 1))], latencies[-1]
+
+    def resetCounters(self):
+        """
+        :return: (requests, frames) since the last reset
+        :rtype: tuple
+        """
+        counters = (self.requests, self.frames)
+        self.requests = 0
+        self.frames = 0
+        return counters
+
+
+if __name__ == "__main__":
+    import heapq
+
+    class Simulation:
+        """
+        Event loop on a virtual clock, timers and input events ordered by time
+        """
+
+        def __init__(self):
+            self.now = 0.0
+            self.events = []
+            self.sequence = 0
+            self.frameCost = 0.004  # seconds spent drawing a frame
+
+        def at(self, t, callback):
+            heapq.heappush(self.events, (t, self.sequence, callback))
+            self.sequence += 1
+
+        def run(self, until):
+            while self.events and self.events[0][0] <= until:
+                t, _, callback = heapq.heappop(self.events)
+                self.now = max(self.now, t)
+                callback()
+            self.now = until
+
+    def fixedTimer(seconds, inputRate, fps=120):
+        # the former loop: a 120 fps timer plus a Refresh for every input event
+        frames = [0]
+        simulation = Simulation()
+
+        def draw():
+            frames[0] += 1
+            simulation.now += simulation.frameCost
+
+        def tick(t):
+            draw()
+            simulation.at(t + 1 / fps, lambda: tick(t + 1 / fps))
+
+        simulation.at(0, lambda: tick(0))
+        for i in range(int(seconds * inputRate)):
+            simulation.at(i / inputRate, draw)
+        simulation.run(seconds)
+        return frames[0]
+
+    def onDemand(seconds, inputRate, playing):
+        simulation = Simulation()
+        scheduler = None
+
+        def draw():
+            simulation.now += simulation.frameCost
+            if playing:
+                # a playing animation asks for the next frame
+                scheduler.request()
+
+        scheduler = FrameScheduler(60, lambda delay: simulation.at(simulation.now + delay, scheduler.fire), draw,
+                                   clock=lambda: simulation.now)
+        for i in range(int(seconds * inputRate)):
+            simulation.at(i / inputRate, scheduler.request)
+        if playing:
+            simulation.at(0, scheduler.request)
+        simulation.run(seconds)
+        return scheduler.frames, scheduler.rates()
+
+    seconds = 10
+    print(f"{'scene':>22}{'120 fps timer':>15}{'on demand':>11}{'requested/s':>13}{'achieved/s':>12}")
+    for name, inputRate, playing in (("idle", 0, False), ("mouse at 500 Hz", 500, False),
+                                     ("animation", 0, True), ("animation + mouse", 500, True)):
+        fixedFrames = fixedTimer(seconds, inputRate)
+        frames, (requested, achieved) = onDemand(seconds, inputRate, playing)
+        assert frames <= seconds * 60 + 1
+        print(f"{name:>22}{fixedFrames / seconds:>15.0f}{frames / seconds:>11.0f}{requested:>13.0f}{achieved:>12.0f}")
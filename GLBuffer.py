@@ -32,6 +32,9 @@ except ImportError:
 
 import numpy as np
 import ctypes
+import bisect
+
+from GLState import glState
 
 
 class VBO:
@@ -41,6 +44,7 @@ class VBO:
     vbo = None
     vertexAttribSize = 0
     vertexNum = 0
+    byteLength = 0
 
     def __init__(self):
         self.vbo = gl.glGenBuffers(1)
@@ -66,10 +70,40 @@ class VBO:
 
         bufferSize = bufferDataArray.size
         self.vertexNum = bufferSize // vertexAttribSize  # for safety reason, take floor division to get int result
-        byteLength = 4 * bufferSize  # 4 is the size of float32
+        self.byteLength = 4 * bufferSize  # 4 is the size of float32
+
+        self.bind()
+        gl.glBufferData(gl.GL_ARRAY_BUFFER, self.byteLength, bufferData, gl.GL_STATIC_DRAW)
+
+    def setPackedBuffer(self, packedArray: np.ndarray, vertexFormat):
+        """
+        Upload vertices already packed by vertexFormat.pack
+
+        :param packedArray: structured array with vertexFormat.dtype
+        :type packedArray: numpy.ndarray
+        :type vertexFormat: VertexFormat
+        """
+        if packedArray.dtype != vertexFormat.dtype:
+            raise TypeError("packed vertices don't match the vertex format")
+        self.vertexAttribSize = 0
+        self.vertexNum = len(packedArray)
+        self.byteLength = packedArray.nbytes
+
+        self.bind()
+        gl.glBufferData(gl.GL_ARRAY_BUFFER, self.byteLength, packedArray.view(np.uint8), gl.GL_STATIC_DRAW)
 
+    def setFormat(self, vertexFormat, shaderProg):
+        """
+        Point the shader's attributes at this buffer following vertexFormat. Bind the target VAO first
+        """
         self.bind()
-        gl.glBufferData(gl.GL_ARRAY_BUFFER, byteLength, bufferData, gl.GL_STATIC_DRAW)
+        for attribute in vertexFormat.attributes:
+            attribLoc = shaderProg.getAttribLocation(attribute.name)
+            if attribLoc < 0:
+                continue
+            gl.glVertexAttribPointer(attribLoc, attribute.components, attribute.glType, attribute.normalized,
+                                     vertexFormat.stride, ctypes.c_void_p(attribute.offset))
+            gl.glEnableVertexAttribArray(attribLoc)
 
     def setAttribPointer(self, attribLoc, stride=0, offset=0, attribSize=0):
         attribSize = self.vertexAttribSize if attribSize == 0 else attribSize
@@ -99,6 +133,8 @@ class EBO:
     ebo = None
     indexNum = 0
     triangleNum = 0
+    indexType = gl.GL_UNSIGNED_INT
+    byteLength = 0
 
     def __init__(self):
         self.ebo = gl.glGenBuffers(1)
@@ -109,20 +145,196 @@ class EBO:
     def bind(self):
         gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, self.ebo)
 
-    def setBuffer(self, bufferDataArray: np.ndarray):
-        if bufferDataArray.dtype != np.dtype("int32"):
-            bufferDataArray = bufferDataArray.astype(np.dtype("int32"))
-        bufferData = bufferDataArray.flatten("C")  # row-major order flatten
+    def setBuffer(self, bufferDataArray: np.ndarray, compact=True):
+        """
+        :param bufferDataArray: triangle indices
+        :type bufferDataArray: numpy.ndarray
+        :param compact: upload uint16 indices when every index fits, uint32 otherwise
+        :type compact: bool
+        """
+        dtype, self.indexType = indexFormat(bufferDataArray, compact)
+        bufferData = np.ascontiguousarray(bufferDataArray, dtype=dtype).reshape(-1)  # row-major order flatten
 
         self.indexNum = bufferData.size
         self.triangleNum = self.indexNum // 3  # floor division to get triangle number
-        byteLength = 4 * self.indexNum
+        self.byteLength = bufferData.nbytes
 
         self.bind()
-        gl.glBufferData(gl.GL_ELEMENT_ARRAY_BUFFER, byteLength, bufferData, gl.GL_STATIC_DRAW)
+        gl.glBufferData(gl.GL_ELEMENT_ARRAY_BUFFER, self.byteLength, bufferData, gl.GL_STATIC_DRAW)
 
     def draw(self):
-        gl.glDrawElements(gl.GL_TRIANGLES, self.indexNum, gl.GL_UNSIGNED_INT, None)
+        gl.glDrawElements(gl.GL_TRIANGLES, self.indexNum, self.indexType, None)
+
+
+def indexFormat(indices, compact=True):
+    """
+    :return: (numpy dtype, GL type) used to upload indices, uint16 when compact and every index fits
+    :rtype: tuple
+    """
+    if compact and (indices.size == 0 or int(indices.max()) <= 0xFFFF):
+        return np.dtype("uint16"), gl.GL_UNSIGNED_SHORT
+    return np.dtype("uint32"), gl.GL_UNSIGNED_INT
+
+
+def octEncode(normals):
+    """
+    Octahedral encoding of (N, 3) normals into (N, 2) values in [-1, 1]. Zero normals encode to (0, 0)
+    """
+    n = normals / np.maximum(np.abs(normals).sum(axis=1, keepdims=True), 1e-12)
+    encoded = n[:, 0:2].copy()
+    lower = n[:, 2] < 0
+    sign = np.where(encoded[lower] >= 0, 1.0, -1.0)
+    encoded[lower] = (1 - np.abs(encoded[lower][:, ::-1])) * sign
+    return encoded
+
+
+class VertexAttribute:
+    """
+    One attribute of a VertexFormat: which part of the 11-float vertex it carries and how it is encoded
+    """
+    # encoding -> (numpy dtype, GL type, normalized)
+    ENCODINGS = {
+        "float32": (np.float32, gl.GL_FLOAT, gl.GL_FALSE),
+        "float16": (np.float16, gl.GL_HALF_FLOAT, gl.GL_FALSE),
+        "int16": (np.int16, gl.GL_SHORT, gl.GL_FALSE),  # integer values, dequantized in the vertex shader
+        "snorm16": (np.int16, gl.GL_SHORT, gl.GL_TRUE),
+        "unorm8": (np.uint8, gl.GL_UNSIGNED_BYTE, gl.GL_TRUE),
+    }
+    # attribute name -> columns of the 11-float vertex layout
+    SOURCE_COLUMNS = {
+        "vertexPos": (0, 3),
+        "vertexNormal": (3, 6),
+        "vertexColor": (6, 9),
+        "vertexTexture": (9, 11),
+    }
+
+    name = None  # attribute name as used by GLProgram.getAttribLocation
+    components = 0
+    encoding = None
+    octahedral = False
+    offset = 0  # in bytes, set by VertexFormat
+
+    def __init__(self, name, components, encoding, octahedral=False):
+        if name not in self.SOURCE_COLUMNS:
+            raise TypeError(f"unknown vertex attribute {name}")
+        if encoding not in self.ENCODINGS:
+            raise TypeError(f"unknown vertex attribute encoding {encoding}")
+        self.name = name
+        self.components = components
+        self.encoding = encoding
+        self.octahedral = octahedral
+        self.dtype, self.glType, self.normalized = self.ENCODINGS[encoding]
+
+    def byteSize(self):
+        return self.components * np.dtype(self.dtype).itemsize
+
+    @classmethod
+    def forShaderInput(cls, name, glslType, quantized=True):
+        """
+        Pick the encoding of an attribute from the type the shader declares for it.
+        A vec2 normal is read as octahedral-encoded.
+        """
+        if name == "vertexNormal" and glslType == gl.GL_FLOAT_VEC2:
+            return cls(name, 2, "snorm16" if quantized else "float32", octahedral=True)
+        first, last = cls.SOURCE_COLUMNS[name]
+        components = last - first
+        if not quantized:
+            return cls(name, components, "float32")
+        return cls(name, components, {"vertexPos": "int16", "vertexNormal": "snorm16",
+                                      "vertexColor": "unorm8", "vertexTexture": "float16"}[name])
+
+
+# scale and offset of positions that are not quantized, the vertex shader reads position * scale + offset
+NO_DEQUANT = np.array([[1, 1, 1], [0, 0, 0]], dtype=np.float32)
+NO_DEQUANT.flags.writeable = False
+
+
+class VertexFormat:
+    """
+    Describes the interleaved layout a mesh is uploaded with. Only attributes listed here are packed into the VBO.
+    Offsets are aligned to 4 bytes.
+
+    int16 positions are stored relative to the mesh's bounding box; pack returns the per-axis scale and offset that
+    map them back, which the vertex shader applies to the position alone. They are kept out of the model matrix, whose
+    inverse transpose would otherwise skew the normals of any mesh whose bounding box is not a cube.
+    """
+    attributes = None
+    stride = 0
+    dtype = None
+    key = None
+
+    def __init__(self, attributes):
+        """
+        :param attributes: attributes in upload order
+        :type attributes: list<VertexAttribute>
+        """
+        self.attributes = list(attributes)
+        offset = 0
+        for attribute in self.attributes:
+            attribute.offset = offset
+            offset += (attribute.byteSize() + 3) // 4 * 4
+        self.stride = max(offset, 4)
+        self.dtype = np.dtype({
+            "names": [a.name for a in self.attributes],
+            "formats": [(a.dtype, (a.components,)) for a in self.attributes],
+            "offsets": [a.offset for a in self.attributes],
+            "itemsize": self.stride,
+        })
+        self.key = tuple((a.name, a.components, a.encoding, a.octahedral) for a in self.attributes)
+
+    @classmethod
+    def float32(cls):
+        """
+        The unpacked layout: every attribute as float32, 44 bytes per vertex
+        """
+        return cls([VertexAttribute("vertexPos", 3, "float32"), VertexAttribute("vertexNormal", 3, "float32"),
+                    VertexAttribute("vertexColor", 3, "float32"), VertexAttribute("vertexTexture", 2, "float32")])
+
+    @classmethod
+    def forProgram(cls, shaderProg, quantized=None):
+        """
+        Layout holding exactly the attributes shaderProg reads, in the encodings matching their declared types
+
+        :type shaderProg: GLProgram
+        :param quantized: use packed encodings, defaults to shaderProg.quantizeVertices
+        :type quantized: bool
+        """
+        if quantized is None:
+            quantized = shaderProg.quantizeVertices
+        active = shaderProg.getActiveAttribs()
+        return cls([VertexAttribute.forShaderInput(name, active[name], quantized)
+                    for name in VertexAttribute.SOURCE_COLUMNS if name in active])
+
+    def pack(self, vertices):
+        """
+        :param vertices: (N, 11) or flat vertex array
+        :type vertices: numpy.ndarray
+        :return: (structured array with self.dtype, (2, 3) float32 per-axis scale and offset restoring the
+                 positions, see NO_DEQUANT)
+        :rtype: tuple
+        """
+        vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, 11)
+        packed = np.zeros(len(vertices), dtype=self.dtype)
+        dequant = NO_DEQUANT.copy()
+        for attribute in self.attributes:
+            first, last = VertexAttribute.SOURCE_COLUMNS[attribute.name]
+            values = vertices[:, first:last]
+            if attribute.octahedral:
+                values = octEncode(values)
+            if attribute.encoding == "int16":
+                low = values.min(axis=0) if len(values) else np.zeros(3)
+                high = values.max(axis=0) if len(values) else np.zeros(3)
+                center = (low + high) / 2
+                step = np.maximum((high - low) / 2, 1e-12) / 32767
+                values = np.rint((values - center) / step)
+                dequant[0] = step
+                dequant[1] = center
+            elif attribute.encoding == "snorm16":
+                values = np.rint(np.clip(values, -1, 1) * 32767)
+            elif attribute.encoding == "unorm8":
+                values = np.rint(np.clip(values, 0, 1) * 255)
+            packed[attribute.name] = values[:, 0:attribute.components]
+        return packed, dequant
 
 
 class VAO:
@@ -138,14 +350,386 @@ class VAO:
     #     gl.glDeleteVertexArrays(1, self.vao)
 
     def bind(self):
-        gl.glBindVertexArray(self.vao)
+        glState.bindVertexArray(self.vao)
 
     def unbind(self):
-        gl.glBindVertexArray(0)
+        glState.bindVertexArray(0)
+
+
+class RangeAllocator:
+    """
+    First-fit allocator of [offset, offset + size) ranges among capacity elements.
+    Freed ranges are merged with adjacent free ranges, so they can be reused by larger requests.
+    """
+    capacity = 0
+    freeList = None  # list of [offset, size], sorted by offset
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.freeList = [[0, capacity]] if capacity > 0 else []
+
+    def allocate(self, size):
+        """
+        :return: offset of the reserved range, None if no free range is large enough
+        :rtype: int
+        """
+        if size == 0:
+            return 0
+        for i, (offset, free) in enumerate(self.freeList):
+            if free >= size:
+                if free == size:
+                    del self.freeList[i]
+                else:
+                    self.freeList[i] = [offset + size, free - size]
+                return offset
+        return None
+
+    def free(self, offset, size):
+        if size == 0:
+            return
+        i = bisect.bisect(self.freeList, [offset, size])
+        self.freeList.insert(i, [offset, size])
+        if i + 1 < len(self.freeList) and offset + size == self.freeList[i + 1][0]:
+            self.freeList[i][1] += self.freeList.pop(i + 1)[1]
+        if i > 0 and self.freeList[i - 1][0] + self.freeList[i - 1][1] == offset:
+            self.freeList[i - 1][1] += self.freeList.pop(i)[1]
+
+    def grow(self, capacity):
+        if capacity > self.capacity:
+            self.free(self.capacity, capacity - self.capacity)
+            self.capacity = capacity
+
+    def reset(self, used):
+        """
+        Mark [0, used) as allocated and everything after it as free, e.g. after compaction
+        """
+        self.freeList = [[used, self.capacity - used]] if used < self.capacity else []
+
+    def freeSize(self):
+        return sum(size for _, size in self.freeList)
+
+    def largestFree(self):
+        return max((size for _, size in self.freeList), default=0)
+
+
+class ArenaAllocation:
+    """
+    Place of one mesh inside a MeshArena. Compaction moves meshes, so read the offsets at draw time
+    """
+    baseVertex = 0
+    vertexCount = 0
+    firstIndex = 0
+    indexCount = 0
+    dequant = None  # scale and offset restoring the arena's packed positions, see VertexFormat.pack
+    live = True
+
+
+class MeshArena:
+    """
+    A large VBO/EBO pair that many meshes are sub-allocated into. Indices are stored relative to their mesh and
+    drawn with a base-vertex offset, so every mesh in the arena is drawn from a single VAO.
+
+    drawBatch takes (allocation, model matrix, color) records. With GL 4.3 (or ARB_multi_draw_indirect) the whole
+    batch is one glMultiDrawElementsIndirect call: the model matrix, color and dequantization of each draw are
+    instanced attributes picked by the command's baseInstance. Otherwise the VAO is bound once and each record is one
+    glDrawElementsBaseVertex call, with those set as constant vertex attributes.
+    drawInstanced draws each mesh many times from a prepared instance buffer, one glDrawElementsInstanced call per
+    mesh (or, again, a single indirect call).
+    Either way the program has to be compiled with GLProgram(instanced=True).
+
+    The CPU copy of both buffers is kept, so the arena can grow and compact without reading back from the GPU.
+    """
+    # column-major model matrix, then rgb color, dequantization scale and offset, each followed by a padding float
+    INSTANCE_FLOATS = 28
+
+    shaderProg = None
+    vertexFormat = None
+    vertexData = None  # CPU copy of the VBO, structured array with vertexFormat.dtype
+    indexData = None  # CPU copy of the EBO, uint32
+    vertexRanges = None
+    indexRanges = None
+    allocations = None  # live ArenaAllocation
+
+    vao = None
+    vbo = None
+    ebo = None
+    instanceVbo = None
+    commandBuffer = None
+    useIndirect = False
+
+    drawCalls = 0  # GL draw calls issued by the last drawBatch
+    compactions = 0
+
+    def __init__(self, shaderProg, vertexCapacity=1 << 16, indexCapacity=1 << 18, indirect=None):
+        """
+        :param shaderProg: compiled instanced program, see GLProgram(instanced=True)
+        :type shaderProg: GLProgram
+        :param vertexCapacity: vertices reserved up front, the arena grows when it is full
+        :type vertexCapacity: int
+        :param indexCapacity: indices reserved up front
+        :type indexCapacity: int
+        :param indirect: use indirect multi-draw, defaults to whether the context supports it
+        :type indirect: bool
+        """
+        if "instanceModelMat" not in shaderProg.getActiveAttribs():
+            raise TypeError("MeshArena needs a program compiled with GLProgram(instanced=True)")
+        self.shaderProg = shaderProg
+        self.vertexFormat = VertexFormat.forProgram(shaderProg)
+        self.vertexData = np.zeros(vertexCapacity, dtype=self.vertexFormat.dtype)
+        self.indexData = np.zeros(indexCapacity, dtype=np.uint32)
+        self.vertexRanges = RangeAllocator(vertexCapacity)
+        self.indexRanges = RangeAllocator(indexCapacity)
+        self.allocations = []
+        self.useIndirect = self.supportsIndirect() if indirect is None else indirect
+
+        shaderProg.use()
+        self.vao = VAO()
+        self.vbo = VBO()
+        self.ebo = EBO()
+        self.instanceVbo = VBO()
+        if self.useIndirect:
+            self.commandBuffer = gl.glGenBuffers(1)
+        self.upload()
+        self.vao.bind()
+        self.vbo.setFormat(self.vertexFormat, shaderProg)
+        if self.useIndirect:
+            self.setInstanceFormat()
+        self.vao.unbind()
+
+    @staticmethod
+    def supportsIndirect():
+        """
+        Whether the current context has glMultiDrawElementsIndirect with baseInstance
+        """
+        version = (gl.glGetIntegerv(gl.GL_MAJOR_VERSION), gl.glGetIntegerv(gl.GL_MINOR_VERSION))
+        if version >= (4, 3):
+            return True
+        extensions = {gl.glGetStringi(gl.GL_EXTENSIONS, i) for i in range(gl.glGetIntegerv(gl.GL_NUM_EXTENSIONS))}
+        return b"GL_ARB_multi_draw_indirect" in extensions and b"GL_ARB_base_instance" in extensions
+
+    def setInstanceFormat(self, firstInstance=0):
+        """
+        Point the per-draw attributes at the instance buffer, one record per instance. Bind the VAO first
+
+        :param firstInstance: record read by instance 0, for draws without baseInstance
+        :type firstInstance: int
+        """
+        stride = 4 * self.INSTANCE_FLOATS
+        offset = stride * firstInstance
+        self.instanceVbo.bind()
+        modelLoc = self.shaderProg.getAttribLocation("instanceModelMat")
+        for column in range(4):
+            gl.glVertexAttribPointer(modelLoc + column, 4, gl.GL_FLOAT, gl.GL_FALSE, stride,
+                                     ctypes.c_void_p(offset + 16 * column))
+            gl.glVertexAttribDivisor(modelLoc + column, 1)
+            gl.glEnableVertexAttribArray(modelLoc + column)
+        for name, floats in (("instanceColor", 16), ("instanceDequantScale", 20), ("instanceDequantOffset", 24)):
+            loc = self.shaderProg.getAttribLocation(name)
+            if loc >= 0:
+                gl.glVertexAttribPointer(loc, 3, gl.GL_FLOAT, gl.GL_FALSE, stride, ctypes.c_void_p(offset + 4 * floats))
+                gl.glVertexAttribDivisor(loc, 1)
+                gl.glEnableVertexAttribArray(loc)
+
+    def clearInstanceFormat(self):
+        """
+        Go back to constant per-draw attributes, as drawBatch uses without indirect draws. Bind the VAO first
+        """
+        modelLoc = self.shaderProg.getAttribLocation("instanceModelMat")
+        for column in range(4):
+            gl.glDisableVertexAttribArray(modelLoc + column)
+        for name in ("instanceColor", "instanceDequantScale", "instanceDequantOffset"):
+            loc = self.shaderProg.getAttribLocation(name)
+            if loc >= 0:
+                gl.glDisableVertexAttribArray(loc)
+
+    def upload(self):
+        """
+        Upload both CPU copies whole, after creation, growth or compaction
+        """
+        self.vao.bind()
+        self.vbo.setPackedBuffer(self.vertexData, self.vertexFormat)
+        self.ebo.setBuffer(self.indexData, compact=False)
+        self.vao.unbind()
+
+    def allocate(self, vertices, indices):
+        """
+        Copy a mesh into the arena, reusing freed space first
+
+        :param vertices: (N, 11) or flat vertex array
+        :type vertices: numpy.ndarray
+        :param indices: triangle indices into vertices
+        :type indices: numpy.ndarray
+        :rtype: ArenaAllocation
+        """
+        packed, dequant = self.vertexFormat.pack(vertices)
+        indices = np.asarray(indices).reshape(-1)
+        vertexCount = len(packed)
+        indexCount = indices.size
+
+        if self.vertexRanges.largestFree() < vertexCount or self.indexRanges.largestFree() < indexCount:
+            if self.vertexRanges.freeSize() >= vertexCount and self.indexRanges.freeSize() >= indexCount:
+                self.compact()
+            if self.vertexRanges.largestFree() < vertexCount or self.indexRanges.largestFree() < indexCount:
+                self.grow(max(2 * self.vertexRanges.capacity, self.vertexRanges.capacity + vertexCount),
+                          max(2 * self.indexRanges.capacity, self.indexRanges.capacity + indexCount))
+
+        allocation = ArenaAllocation()
+        allocation.baseVertex = self.vertexRanges.allocate(vertexCount)
+        allocation.vertexCount = vertexCount
+        allocation.firstIndex = self.indexRanges.allocate(indexCount)
+        allocation.indexCount = indexCount
+        allocation.dequant = dequant
+        self.allocations.append(allocation)
+
+        vertexSlice = self.vertexData[allocation.baseVertex:allocation.baseVertex + vertexCount]
+        indexSlice = self.indexData[allocation.firstIndex:allocation.firstIndex + indexCount]
+        vertexSlice[...] = packed
+        indexSlice[...] = indices
+
+        self.vao.bind()
+        self.vbo.bind()
+        gl.glBufferSubData(gl.GL_ARRAY_BUFFER, allocation.baseVertex * self.vertexFormat.stride, vertexSlice.nbytes,
+                           vertexSlice.view(np.uint8))
+        self.ebo.bind()
+        gl.glBufferSubData(gl.GL_ELEMENT_ARRAY_BUFFER, allocation.firstIndex * 4, indexSlice.nbytes, indexSlice)
+        self.vao.unbind()
+        return allocation
+
+    def free(self, allocation):
+        """
+        Return the space of allocation to the free lists. Nothing is uploaded
+        """
+        if not allocation.live:
+            return
+        allocation.live = False
+        self.allocations.remove(allocation)
+        self.vertexRanges.free(allocation.baseVertex, allocation.vertexCount)
+        self.indexRanges.free(allocation.firstIndex, allocation.indexCount)
+
+    def compact(self):
+        """
+        Move every live mesh to the front of the buffers, leaving a single free range at the end of each
+        """
+        vertexData = np.zeros_like(self.vertexData)
+        indexData = np.zeros_like(self.indexData)
+        vertexEnd = 0
+        indexEnd = 0
+        for allocation in sorted(self.allocations, key=lambda a: a.baseVertex):
+            vertexData[vertexEnd:vertexEnd + allocation.vertexCount] = \
+                self.vertexData[allocation.baseVertex:allocation.baseVertex + allocation.vertexCount]
+            indexData[indexEnd:indexEnd + allocation.indexCount] = \
+                self.indexData[allocation.firstIndex:allocation.firstIndex + allocation.indexCount]
+            allocation.baseVertex = vertexEnd
+            allocation.firstIndex = indexEnd
+            vertexEnd += allocation.vertexCount
+            indexEnd += allocation.indexCount
+        self.vertexData = vertexData
+        self.indexData = indexData
+        self.vertexRanges.reset(vertexEnd)
+        self.indexRanges.reset(indexEnd)
+        self.compactions += 1
+        self.upload()
+
+    def grow(self, vertexCapacity, indexCapacity):
+        if vertexCapacity > len(self.vertexData):
+            vertexData = np.zeros(vertexCapacity, dtype=self.vertexData.dtype)
+            vertexData[:len(self.vertexData)] = self.vertexData
+            self.vertexData = vertexData
+            self.vertexRanges.grow(vertexCapacity)
+        if indexCapacity > len(self.indexData):
+            indexData = np.zeros(indexCapacity, dtype=self.indexData.dtype)
+            indexData[:len(self.indexData)] = self.indexData
+            self.indexData = indexData
+            self.indexRanges.grow(indexCapacity)
+        self.upload()
+
+    def drawBatch(self, records):
+        """
+        :param records: (ArenaAllocation, 4x4 row-major model matrix, rgb color) per draw
+        :type records: list
+        """
+        self.drawCalls = 0
+        if not records:
+            return
+        self.shaderProg.use()
+        self.vao.bind()
+        if self.useIndirect:
+            count = len(records)
+            instances = np.zeros((count, self.INSTANCE_FLOATS), dtype=np.float32)
+            instances[:, 0:16] = np.array([r[1] for r in records]).transpose(0, 2, 1).reshape(count, 16)
+            instances[:, 16:19] = [r[2] for r in records]
+            dequants = np.array([r[0].dequant for r in records])
+            instances[:, 20:23] = dequants[:, 0]
+            instances[:, 24:27] = dequants[:, 1]
+            commands = np.array([(a.indexCount, 1, a.firstIndex, a.baseVertex, i)
+                                 for i, (a, _, _) in enumerate(records)], dtype=np.uint32)
+
+            self.instanceVbo.bind()
+            gl.glBufferData(gl.GL_ARRAY_BUFFER, instances.nbytes, instances, gl.GL_STREAM_DRAW)
+            gl.glBindBuffer(gl.GL_DRAW_INDIRECT_BUFFER, self.commandBuffer)
+            gl.glBufferData(gl.GL_DRAW_INDIRECT_BUFFER, commands.nbytes, commands, gl.GL_STREAM_DRAW)
+            gl.glMultiDrawElementsIndirect(gl.GL_TRIANGLES, gl.GL_UNSIGNED_INT, None, count, 0)
+            gl.glBindBuffer(gl.GL_DRAW_INDIRECT_BUFFER, 0)
+            self.drawCalls = 1
+        else:
+            modelLoc = self.shaderProg.getAttribLocation("instanceModelMat")
+            colorLoc = self.shaderProg.getAttribLocation("instanceColor")
+            scaleLoc = self.shaderProg.getAttribLocation("instanceDequantScale")
+            offsetLoc = self.shaderProg.getAttribLocation("instanceDequantOffset")
+            for allocation, modelMat, color in records:
+                for column in range(4):
+                    gl.glVertexAttrib4f(modelLoc + column, *modelMat[:, column])
+                if colorLoc >= 0:
+                    gl.glVertexAttrib3f(colorLoc, *color)
+                if scaleLoc >= 0:
+                    gl.glVertexAttrib3f(scaleLoc, *allocation.dequant[0])
+                    gl.glVertexAttrib3f(offsetLoc, *allocation.dequant[1])
+                gl.glDrawElementsBaseVertex(gl.GL_TRIANGLES, allocation.indexCount, gl.GL_UNSIGNED_INT,
+                                            ctypes.c_void_p(4 * allocation.firstIndex), allocation.baseVertex)
+            self.drawCalls = len(records)
+        self.vao.unbind()
+
+    def drawInstanced(self, records, instances):
+        """
+        :param records: (ArenaAllocation, first instance, instance count) per mesh, instances of one mesh are
+                        consecutive in the instance buffer
+        :type records: list
+        :param instances: (I, INSTANCE_FLOATS) float32, see INSTANCE_FLOATS
+        :type instances: numpy.ndarray
+        """
+        self.drawCalls = 0
+        if not records:
+            return
+        self.shaderProg.use()
+        self.vao.bind()
+        self.instanceVbo.bind()
+        gl.glBufferData(gl.GL_ARRAY_BUFFER, instances.nbytes, instances, gl.GL_STREAM_DRAW)
+        if self.useIndirect:
+            commands = np.array([(a.indexCount, count, a.firstIndex, a.baseVertex, first)
+                                 for a, first, count in records], dtype=np.uint32)
+            gl.glBindBuffer(gl.GL_DRAW_INDIRECT_BUFFER, self.commandBuffer)
+            gl.glBufferData(gl.GL_DRAW_INDIRECT_BUFFER, commands.nbytes, commands, gl.GL_STREAM_DRAW)
+            gl.glMultiDrawElementsIndirect(gl.GL_TRIANGLES, gl.GL_UNSIGNED_INT, None, len(records), 0)
+            gl.glBindBuffer(gl.GL_DRAW_INDIRECT_BUFFER, 0)
+            self.drawCalls = 1
+        else:
+            for allocation, first, count in records:
+                # without baseInstance the attributes themselves start at the first record of this mesh
+                self.setInstanceFormat(first)
+                gl.glDrawElementsInstancedBaseVertex(gl.GL_TRIANGLES, allocation.indexCount, gl.GL_UNSIGNED_INT,
+                                                     ctypes.c_void_p(4 * allocation.firstIndex), count,
+                                                     allocation.baseVertex)
+            self.clearInstanceFormat()
+            self.drawCalls = len(records)
+        self.vao.unbind()
 
 
 # A global variable in this scope to store next texture id, there should be no duplicate textureUnitID
+# Textures cycle through units 1 to TEXTURE_UNITS, unit 0 is what Texture.unbind points samplers at
 NextTextureID = 1
+TEXTURE_UNITS = 16
+# unit of every TransformBuffer, out of that cycle: a samplerBuffer sharing a unit with a sampler2D fails the draw
+TRANSFORM_BUFFER_UNIT = TEXTURE_UNITS + 1
 
 class Texture:
     """
@@ -159,7 +743,7 @@ class Texture:
 
         # assign a texture image unit for this sampler
         self.textureUnitID = NextTextureID
-        NextTextureID = NextTextureID % 16 + 1
+        NextTextureID = NextTextureID % TEXTURE_UNITS + 1
 
     def setTextureImage(self, image):
         self.textureName = gl.glGenTextures(1)
@@ -172,7 +756,7 @@ class Texture:
         height, width, channel = image.shape
         imageData = image.flatten("C")
 
-        gl.glBindTexture(gl.GL_TEXTURE_2D, self.textureName)
+        glState.bindTexture(self.textureUnitID, self.textureName)
         gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGB, width, height, 0, gl.GL_RGB, gl.GL_UNSIGNED_BYTE, imageData)
         gl.glGenerateMipmap(gl.GL_TEXTURE_2D)
         self.setTextureParameters()
@@ -185,12 +769,196 @@ class Texture:
         gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
 
     def bind(self, glslVariableLoc):
-        gl.glActiveTexture(gl.GL_TEXTURE0 + self.textureUnitID)
-        gl.glBindTexture(gl.GL_TEXTURE_2D, self.textureName)
-        gl.glUniform1i(glslVariableLoc, self.textureUnitID)
+        glState.bindTexture(self.textureUnitID, self.textureName)
+        glState.setUniform(glslVariableLoc, self.textureUnitID, lambda loc: gl.glUniform1i(loc, self.textureUnitID))
+
+    @staticmethod
+    def unbind(glslVariableLoc):
+        glState.bindTexture(0, 0)
+        glState.setUniform(glslVariableLoc, 0, lambda loc: gl.glUniform1i(loc, 0))
+
+
+class TransformBuffer:
+    """
+    Model matrices and colors of all draws of a frame in one float32 texture buffer, which programs compiled with
+    GLProgram(transformBuffer=True) read with texelFetch. A draw then only sets the integer uniform drawIndex that
+    picks its row, instead of uploading its own matrix and color.
+
+    Rows hold the column-major model matrix, then the rgb color and a padding float, i.e. 5 RGBA32F texels. The
+    dequantization of the positions belongs to the mesh, which sets it as uniforms when drawn.
+    The CPU copy of the rows is kept and compared with each new frame, only the ranges of changed rows are uploaded.
+    Changed rows closer than MERGE_GAP are sent as one range, unchanged rows included.
+    """
+    ROW_FLOATS = 20
+    MERGE_GAP = 64  # rows, about 5 KB, cheaper to resend than an extra upload call
 
-    def unbind(self, glslVariableLoc):
-        gl.glActiveTexture(gl.GL_TEXTURE0)
-        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
-        gl.glUniform1i(glslVariableLoc, 0)
+    shaderProg = None
+    rows = None  # CPU copy of the buffer, (capacity, ROW_FLOATS) float32
+    buffer = None
+    texture = None
+    textureUnitID = TRANSFORM_BUFFER_UNIT
 
+    uploadedRows = 0  # rows sent by the last write
+    uploads = 0  # glBufferSubData calls of the last write
+    drawCalls = 0  # GL draw calls issued by the last drawBatch
+
+    def __init__(self, shaderProg, capacity=256):
+        """
+        :param shaderProg: compiled program, see GLProgram(transformBuffer=True)
+        :type shaderProg: GLProgram
+        :param capacity: rows reserved up front, the buffer grows when a frame has more draws
+        :type capacity: int
+        """
+        if not shaderProg.transformBuffer:
+            raise TypeError("TransformBuffer needs a program compiled with GLProgram(transformBuffer=True)")
+        self.shaderProg = shaderProg
+        # drawBatch binds the buffer of this one to the unit
+        self.textureUnitID = TRANSFORM_BUFFER_UNIT
+        self.buffer = gl.glGenBuffers(1)
+        self.texture = gl.glGenTextures(1)
+        self.rows = np.zeros((0, self.ROW_FLOATS), dtype=np.float32)
+        self.grow(capacity)
+
+    def grow(self, capacity):
+        """
+        Reallocate the buffer with room for capacity rows and upload the CPU copy whole
+        """
+        rows = np.zeros((capacity, self.ROW_FLOATS), dtype=np.float32)
+        rows[:len(self.rows)] = self.rows
+        self.rows = rows
+        gl.glBindBuffer(gl.GL_TEXTURE_BUFFER, self.buffer)
+        gl.glBufferData(gl.GL_TEXTURE_BUFFER, rows.nbytes, rows, gl.GL_DYNAMIC_DRAW)
+        gl.glBindBuffer(gl.GL_TEXTURE_BUFFER, 0)
+        glState.bindTexture(self.textureUnitID, self.texture, gl.GL_TEXTURE_BUFFER)
+        gl.glTexBuffer(gl.GL_TEXTURE_BUFFER, gl.GL_RGBA32F, self.buffer)
+
+    @classmethod
+    def pack(cls, records, out=None):
+        """
+        Rows of records in the layout of the buffer. Makes no GL call, e.g. for a FramePipeline worker
+
+        :param records: (Displayable, 4x4 row-major model matrix, rgb color, Texture or None) per draw
+        :type records: list
+        :param out: (len(records), ROW_FLOATS) float32 array to fill, its padding left as is. A new one by default
+        :type out: numpy.ndarray
+        :rtype: numpy.ndarray
+        """
+        count = len(records)
+        if out is None:
+            out = np.zeros((count, cls.ROW_FLOATS), dtype=np.float32)
+        if count > 0:
+            out[:, 0:16] = np.array([r[1] for r in records]).transpose(0, 2, 1).reshape(count, 16)
+            out[:, 16:19] = [r[2] for r in records]
+        return out
+
+    def write(self, records, rows=None):
+        """
+        Pack the model matrix and color of each record into rows 0, 1, ... and upload the changed ranges
+
+        :param records: (Displayable, 4x4 row-major model matrix, rgb color, Texture or None) per draw
+        :type records: list
+        :param rows: records already packed, see pack. The matrices and colors of records are then not read
+        :type rows: numpy.ndarray
+        """
+        self.uploadedRows = 0
+        self.uploads = 0
+        count = len(records)
+        if count == 0:
+            return
+        if count > len(self.rows):
+            self.grow(max(2 * len(self.rows), count))
+        frame = rows if rows is not None else self.pack(records)
+        changed = np.flatnonzero((frame != self.rows[:count]).any(axis=1))
+        if changed.size == 0:
+            return
+        breaks = np.flatnonzero(np.diff(changed) > self.MERGE_GAP)
+        firsts = changed[np.concatenate(([0], breaks + 1))]
+        lasts = changed[np.concatenate((breaks, [changed.size - 1]))] + 1
+        rowBytes = self.rows.itemsize * self.ROW_FLOATS
+        gl.glBindBuffer(gl.GL_TEXTURE_BUFFER, self.buffer)
+        for first, last in zip(firsts, lasts):
+            self.rows[first:last] = frame[first:last]
+            gl.glBufferSubData(gl.GL_TEXTURE_BUFFER, int(first) * rowBytes, self.rows[first:last].nbytes,
+                               self.rows[first:last])
+            self.uploadedRows += int(last - first)
+        gl.glBindBuffer(gl.GL_TEXTURE_BUFFER, 0)
+        self.uploads = len(firsts)
+
+    def drawBatch(self, records, order=None, rows=None):
+        """
+        Write the records and draw their meshes, each one with its own row. The rows stay in the order of records
+        whatever the drawing order, so that they only change when the records do
+
+        :param records: (Displayable, 4x4 row-major model matrix, rgb color, Texture or None) per draw, see
+                        Component.collectTransforms
+        :type records: list
+        :param order: indices of records to draw, all of them in order by default, see RenderQueue
+        :param rows: records already packed, see write
+        """
+        self.write(records, rows)
+        shaderProg = self.shaderProg
+        shaderProg.use()
+        glState.bindTexture(self.textureUnitID, self.texture, gl.GL_TEXTURE_BUFFER)
+        shaderProg.setInt("transformBuffer", self.textureUnitID)
+        indexLoc = shaderProg.getUniformLocation("drawIndex")
+        textureLoc = shaderProg.getUniformLocation("textureImage")
+        for i in range(len(records)) if order is None else order:
+            displayObj, _, _, texture = records[i]
+            glState.setUniform(indexLoc, i, lambda loc: gl.glUniform1i(loc, i))
+            if texture is not None:
+                texture.bind(textureLoc)
+            else:
+                Texture.unbind(textureLoc)
+            displayObj.draw()
+        self.drawCalls = len(records) if order is None else len(order)
+
+
+
+if __name__ == "__main__":
+    import glob
+
+    import MeshCache
+
+    unpacked = VertexFormat.float32()
+    # what the default shader reads (positions only) and a shader reading every attribute with an oct normal
+    positionsOnly = VertexFormat([VertexAttribute.forShaderInput("vertexPos", gl.GL_FLOAT_VEC3)])
+    everything = VertexFormat([VertexAttribute.forShaderInput("vertexPos", gl.GL_FLOAT_VEC3),
+                               VertexAttribute.forShaderInput("vertexNormal", gl.GL_FLOAT_VEC2),
+                               VertexAttribute.forShaderInput("vertexColor", gl.GL_FLOAT_VEC3),
+                               VertexAttribute.forShaderInput("vertexTexture", gl.GL_FLOAT_VEC2)])
+    print(f"bytes per vertex: float32 {unpacked.stride}, packed positions {positionsOnly.stride}, "
+          f"packed all attributes {everything.stride}")
+
+    print(f"{'mesh':<24}{'float32 B':>11}{'positions B':>13}{'ratio':>7}{'all B':>9}{'ratio':>7}{'max pos err':>13}")
+    for path in sorted(glob.glob("assets/*.dae")):
+        vertices, indices = MeshCache.load(path)
+        vertices = np.asarray(vertices).reshape(-1, 11)
+        full = unpacked.stride * len(vertices) + 4 * indices.size
+        indexBytes = indexFormat(indices)[0].itemsize * indices.size
+        small = positionsOnly.stride * len(vertices) + indexBytes
+        packedAll = everything.stride * len(vertices) + indexBytes
+
+        packed, dequant = positionsOnly.pack(vertices)
+        restored = packed["vertexPos"] * dequant[0] + dequant[1]
+        error = np.abs(restored - vertices[:, 0:3]).max()
+        print(f"{path:<24}{full:>11}{small:>13}{full / small:>6.1f}x{packedAll:>9}{full / packedAll:>6.1f}x{error:>13.2e}")
+
+    # octahedral round trip, decoded the same way as the vertex shader does
+    normals = np.random.default_rng(0).normal(size=(10000, 3))
+    normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+    e = np.rint(octEncode(normals) * 32767) / 32767
+    n = np.column_stack((e, 1 - np.abs(e).sum(axis=1)))
+    t = np.maximum(-n[:, 2], 0)
+    n[:, 0:2] -= np.where(n[:, 0:2] >= 0, 1, -1) * t[:, None]
+    n /= np.linalg.norm(n, axis=1, keepdims=True)
+    print(f"octahedral snorm16 normals, max angular error: {np.degrees(np.arccos(np.clip((n * normals).sum(1), -1, 1))).max():.4f} deg")
+
+    # arena free list: freed neighbours merge back into one range that a larger mesh can reuse
+    ranges = RangeAllocator(100)
+    a, b, c = ranges.allocate(30), ranges.allocate(30), ranges.allocate(30)
+    ranges.free(a, 30)
+    ranges.free(c, 30)
+    assert ranges.allocate(41) is None and ranges.largestFree() == 40
+    ranges.free(b, 30)
+    assert ranges.freeList == [[0, 100]] and ranges.allocate(100) == 0
+    print("arena range allocator: ok")
@@ -33,6 +33,8 @@ except ImportError:
 import numpy as np
 import math
 
+from GLState import glState
+
 
 def perspectiveMatrix(angleOfView, near, far):
     result = np.identity(4)
@@ -60,10 +62,27 @@ class GLProgram:
     ready = False  # a control flag which reflect if this GLprogram is ready
     debug = 0
 
-    def __init__(self) -> None:
+    # upload meshes drawn with this program in the packed encodings of GLBuffer.VertexFormat
+    quantizeVertices = True
+
+    # read the model matrix and color from per-draw vertex attributes instead of uniforms, see GLBuffer.MeshArena
+    instanced = False
+
+    # read the model matrix and color from the row drawIndex of a texture buffer, see GLBuffer.TransformBuffer.
+    # Ignored for instanced programs
+    transformBuffer = False
+
+    uniformLocations = None  # GLSL name -> location, read when linking, then filled in as queried
+    attribLocations = None  # GLSL name -> location, read when linking, then filled in as queried
+
+    def __init__(self, instanced=False, transformBuffer=False) -> None:
         self.program = gl.glCreateProgram()
 
         self.ready = False
+        self.instanced = instanced
+        self.transformBuffer = transformBuffer and not instanced
+        self.uniformLocations = {}
+        self.attribLocations = {}
 
         # define attribs name and corresponding method to set it
         self.attribs = {
@@ -77,6 +96,14 @@ class GLProgram:
             "projectionMat": "projection",
             "viewMat": "view",
             "modelMat": "model",
+            "instanceModelMat": "aModel",
+            "instanceColor": "aInstanceColor",
+            "instanceDequantScale": "aDequantScale",
+            "instanceDequantOffset": "aDequantOffset",
+            "dequantScale": "dequantScale",
+            "dequantOffset": "dequantOffset",
+            "transformBuffer": "transforms",
+            "drawIndex": "drawIndex",
 
             "vertexJoints": "joint",
             "vertexJointWeights" : "jw",
@@ -106,10 +133,47 @@ class GLProgram:
         return shader
 
     def genVertexShaderSource(self):
+        if self.instanced:
+            model = self.attribs["instanceModelMat"]
+            perDraw = f'''
+        in mat4 {model};
+        in vec3 {self.attribs["instanceColor"]};
+        in vec3 {self.attribs["instanceDequantScale"]};
+        in vec3 {self.attribs["instanceDequantOffset"]};
+        flat out vec3 vInstanceColor;'''
+            perDrawAssign = f'vInstanceColor = {self.attribs["instanceColor"]};'
+            dequantScale = self.attribs["instanceDequantScale"]
+            dequantOffset = self.attribs["instanceDequantOffset"]
+            perDrawFetch = ''
+        elif self.transformBuffer:
+            # rows of GLBuffer.TransformBuffer: 4 texels of column-major model matrix, then the color
+            model = "drawModel"
+            transforms = self.attribs["transformBuffer"]
+            row = f'5 * {self.attribs["drawIndex"]}'
+            perDraw = f'''
+        uniform samplerBuffer {transforms};
+        uniform int {self.attribs["drawIndex"]};
+        flat out vec3 vInstanceColor;'''
+            perDrawAssign = f'vInstanceColor = texelFetch({transforms}, {row} + 4).rgb;'
+            perDrawFetch = f'''mat4 {model} = mat4(texelFetch({transforms}, {row}), texelFetch({transforms}, {row} + 1),
+                                 texelFetch({transforms}, {row} + 2), texelFetch({transforms}, {row} + 3));'''
+        else:
+            model = self.attribs["modelMat"]
+            perDraw = f'''
+        uniform mat4 {model};'''
+            perDrawAssign = ''
+            perDrawFetch = ''
+        if not self.instanced:
+            # set by the mesh being drawn, see DisplayableMesh.draw
+            dequantScale = self.attribs["dequantScale"]
+            dequantOffset = self.attribs["dequantOffset"]
+            perDraw += f'''
+        uniform vec3 {dequantScale};
+        uniform vec3 {dequantOffset};'''
         vss = f'''
         #version 330 core
         in vec3 {self.attribs["vertexPos"]};
-        in vec3 {self.attribs["vertexNormal"]};
+        in vec2 {self.attribs["vertexNormal"]}; // octahedral encoded
         in vec3 {self.attribs["vertexColor"]};
         in vec2 {self.attribs["vertexTexture"]};
         
@@ -119,21 +183,39 @@ class GLProgram:
         out vec2 vTexture;
         
         uniform mat4 {self.attribs["projectionMat"]};
-        uniform mat4 {self.attribs["viewMat"]};
-        uniform mat4 {self.attribs["modelMat"]};
+        uniform mat4 {self.attribs["viewMat"]};{perDraw}
+
+        vec3 octDecode(vec2 e)
+        {{
+            vec3 n = vec3(e, 1.0 - abs(e.x) - abs(e.y));
+            float t = max(-n.z, 0.0);
+            n.x += n.x >= 0.0 ? -t : t;
+            n.y += n.y >= 0.0 ? -t : t;
+            return normalize(n);
+        }}
         
         void main()
         {{
-            gl_Position = {self.attribs["projectionMat"]} * {self.attribs["viewMat"]} * {self.attribs["modelMat"]} * vec4({self.attribs["vertexPos"]}, 1.0);
-            vPos = vec3({self.attribs["modelMat"]} * vec4({self.attribs["vertexPos"]}, 1.0));
+            {perDrawFetch}
+            // restore quantized positions, see GLBuffer.VertexFormat.pack
+            vec3 position = {self.attribs["vertexPos"]} * {dequantScale} + {dequantOffset};
+            gl_Position = {self.attribs["projectionMat"]} * {self.attribs["viewMat"]} * {model} * vec4(position, 1.0);
+            vPos = vec3({model} * vec4(position, 1.0));
             vColor = {self.attribs["vertexColor"]};
-            vNormal = normalize(transpose(inverse({self.attribs["modelMat"]})) * vec4({self.attribs["vertexNormal"]}, 0.0) ).xyz;
+            vNormal = normalize(transpose(inverse({model})) * vec4(octDecode({self.attribs["vertexNormal"]}), 0.0) ).xyz;
             vTexture = {self.attribs["vertexTexture"]};
+            {perDrawAssign}
         }}
         '''
         return vss
 
     def genFragShaderSource(self):
+        if self.instanced or self.transformBuffer:
+            color = "vInstanceColor"
+            perDraw = "flat in vec3 vInstanceColor;"
+        else:
+            color = self.attribs["currentColor"]
+            perDraw = f'uniform vec3 {color};'
         fss = f"""
         #version 330 core
         
@@ -142,7 +224,7 @@ class GLProgram:
         smooth in vec3 vNormal;
         in vec2 vTexture;
 
-        uniform vec3 {self.attribs["currentColor"]};
+        {perDraw}
         uniform sampler2D {self.attribs["textureImage"]};
         
         out vec4 FragColor;
@@ -155,7 +237,7 @@ class GLProgram:
             FragColor = clamp(FragColor, 0, 1);
 
             // Shade according to vertex colors
-            FragColor = vec4({self.attribs["currentColor"]}, 1.0);
+            FragColor = vec4({color}, 1.0);
         }}
         """
         return fss
@@ -172,21 +254,69 @@ class GLProgram:
 
     def getAttribLocation(self, name):
         programName = self.getAttribName(name)
+        attribLoc = self.attribLocations.get(programName)
+        if attribLoc is not None:
+            glState.count("location", False)
+            return attribLoc
+        glState.count("location", True)
         attribLoc = gl.glGetAttribLocation(self.program, programName)
+        self.attribLocations[programName] = attribLoc
         if attribLoc == -1 and self.debug > 1:
             print(f"Warning: Attrib {name} cannot found. Might have been optimized off")
         return attribLoc
 
+    def getActiveAttribs(self):
+        """
+        Vertex attributes the linked program actually reads, others have been optimized off
+
+        :return: attrib index name (e.g. "vertexPos") -> GLSL type enum (e.g. GL_FLOAT_VEC3)
+        :rtype: dict
+        """
+        programNames = {v: k for k, v in self.attribs.items()}
+        active = {}
+        for i in range(gl.glGetProgramiv(self.program, gl.GL_ACTIVE_ATTRIBUTES)):
+            name, size, glslType = gl.glGetActiveAttrib(self.program, i)
+            name = name.decode() if isinstance(name, bytes) else name
+            if name in programNames:
+                active[programNames[name]] = int(glslType)
+        return active
+
     def getUniformLocation(self, name, lookThroughAttribs=True):
         if lookThroughAttribs:
             variableName = self.getAttribName(name)
         else:
             variableName = name
+        uniformLoc = self.uniformLocations.get(variableName)
+        if uniformLoc is not None:
+            glState.count("location", False)
+            return uniformLoc
+        glState.count("location", True)
         uniformLoc = gl.glGetUniformLocation(self.program, variableName)
+        self.uniformLocations[variableName] = uniformLoc
         if uniformLoc == -1 and self.debug > 1:
             print(f"Warning: Uniform {name} cannot found. Might have been optimized off")
         return uniformLoc
 
+    def cacheLocations(self):
+        """
+        Read the locations of all active uniforms and attributes of the linked program, so that getUniformLocation and
+        getAttribLocation do not have to query OpenGL while drawing
+        """
+        self.uniformLocations = {}
+        self.attribLocations = {}
+        for i in range(gl.glGetProgramiv(self.program, gl.GL_ACTIVE_UNIFORMS)):
+            name, size, glslType = gl.glGetActiveUniform(self.program, i)
+            name = name.decode() if isinstance(name, bytes) else name
+            location = gl.glGetUniformLocation(self.program, name)
+            self.uniformLocations[name] = location
+            if name.endswith("[0]"):
+                # arrays are also looked up by their bare name
+                self.uniformLocations[name[:-3]] = location
+        for i in range(gl.glGetProgramiv(self.program, gl.GL_ACTIVE_ATTRIBUTES)):
+            name, size, glslType = gl.glGetActiveAttrib(self.program, i)
+            name = name.decode() if isinstance(name, bytes) else name
+            self.attribLocations[name] = gl.glGetAttribLocation(self.program, name)
+
     def getAttribName(self, attribIndexName):
         return self.attribs[attribIndexName]
 
@@ -218,6 +348,9 @@ class GLProgram:
             info = gl.glGetShaderInfoLog(self.program)
             raise Exception(info)
 
+        # linking resets the uniforms and may move the locations
+        glState.forgetProgram(self.program)
+        self.cacheLocations()
         self.ready = True
 
     def use(self):
@@ -226,57 +359,69 @@ class GLProgram:
         """
         if not self.ready:
             raise Exception("GLProgram must compile before use it")
-        gl.glUseProgram(self.program)
+        glState.useProgram(self.program)
 
-    # some help methods to set uniform in program
+    # some help methods to set uniform in program, the upload is skipped when the uniform already holds the value
     def setMat4(self, name, mat, lookThroughAttribs=True):
         self.use()
         if mat.shape != (4, 4):
             raise Exception("Projection Matrix must have 4x4 shape")
-        gl.glUniformMatrix4fv(self.getUniformLocation(name, lookThroughAttribs), 1, gl.GL_FALSE, mat.flatten("C"))
+        glState.setUniform(self.getUniformLocation(name, lookThroughAttribs), mat.tobytes(),
+                           lambda loc: gl.glUniformMatrix4fv(loc, 1, gl.GL_FALSE, mat.flatten("C")))
 
     def setMat3(self, name, mat, lookThroughAttribs=True):
         self.use()
         if mat.shape != (3, 3):
             raise Exception("Projection Matrix must have 3x3 shape")
-        gl.glUniformMatrix3fv(self.getUniformLocation(name, lookThroughAttribs), 1, gl.GL_FALSE, mat.flatten("C"))
+        glState.setUniform(self.getUniformLocation(name, lookThroughAttribs), mat.tobytes(),
+                           lambda loc: gl.glUniformMatrix3fv(loc, 1, gl.GL_FALSE, mat.flatten("C")))
 
     def setMat2(self, name, mat, lookThroughAttribs=True):
         self.use()
         if mat.shape != (2, 2):
             raise Exception("Projection Matrix must have 2x2 shape")
-        gl.glUniformMatrix2fv(self.getUniformLocation(name, lookThroughAttribs), 1, gl.GL_FALSE, mat.flatten("C"))
+        glState.setUniform(self.getUniformLocation(name, lookThroughAttribs), mat.tobytes(),
+                           lambda loc: gl.glUniformMatrix2fv(loc, 1, gl.GL_FALSE, mat.flatten("C")))
 
     def setVec4(self, name, vec, lookThroughAttribs=True):
         self.use()
         if vec.size != 4:
             raise Exception("Vector must have size 4")
-        gl.glUniform4fv(self.getUniformLocation(name, lookThroughAttribs), 1, vec)
+        glState.setUniform(self.getUniformLocation(name, lookThroughAttribs), np.asarray(vec).tobytes(),
+                           lambda loc: gl.glUniform4fv(loc, 1, vec))
 
     def setVec3(self, name, vec, lookThroughAttribs=True):
         self.use()
         if vec.size != 3:
             raise Exception("Vector must have size 3")
-        gl.glUniform3fv(self.getUniformLocation(name, lookThroughAttribs), 1, vec)
+        glState.setUniform(self.getUniformLocation(name, lookThroughAttribs), np.asarray(vec).tobytes(),
+                           lambda loc: gl.glUniform3fv(loc, 1, vec))
 
     def setVec2(self, name, vec, lookThroughAttribs=True):
         self.use()
         if vec.size != 2:
             raise Exception("Vector must have size 2")
-        gl.glUniform2fv(self.getUniformLocation(name, lookThroughAttribs), 1, vec)
+        glState.setUniform(self.getUniformLocation(name, lookThroughAttribs), np.asarray(vec).tobytes(),
+                           lambda loc: gl.glUniform2fv(loc, 1, vec))
 
     def setBool(self, name, value, lookThroughAttribs=True):
         self.use()
         if value not in (0, 1):
             raise Exception("bool only accept True/False/0/1")
-        gl.glUniform1i(self.getUniformLocation(name, lookThroughAttribs), int(value))
+        value = int(value)
+        glState.setUniform(self.getUniformLocation(name, lookThroughAttribs), value,
+                           lambda loc: gl.glUniform1i(loc, value))
 
     def setInt(self, name, value, lookThroughAttribs=True):
         self.use()
         if value != int(value):
             raise Exception("set int only accept  integer")
-        gl.glUniform1i(self.getUniformLocation(name, lookThroughAttribs), int(value))
+        value = int(value)
+        glState.setUniform(self.getUniformLocation(name, lookThroughAttribs), value,
+                           lambda loc: gl.glUniform1i(loc, value))
 
     def setFloat(self, name, value, lookThroughAttribs=True):
         self.use()
-        gl.glUniform1f(self.getUniformLocation(name, lookThroughAttribs), float(value))
+        value = float(value)
+        glState.setUniform(self.getUniformLocation(name, lookThroughAttribs), value,
+                           lambda loc: gl.glUniform1f(loc, value))
@@ -0,0 +1,292 @@
+"""
+Shadow copy of the OpenGL state that GLProgram, GLBuffer.VAO and GLBuffer.Texture change.
+
+Every glUseProgram, glBindVertexArray, glActiveTexture, glBindTexture and glUniform* issued by those classes goes
+through the module-level glState, which skips the call when it would not change anything: the program is already in
+use, the texture already bound on that unit, the uniform already holds that value in the current program, etc.
+Real and elided calls are counted, see GLState.resetCounters.
+
+The shadow state is only correct while nothing else changes the same state. Call glState.reset after making a new
+context current or issuing these calls directly.
+"""
+
+import os
+
+if __name__ == "__main__":
+    # the benchmark below renders without a window through EGL, PyOpenGL picks its platform when first imported
+    os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+    os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+
+try:
+    import OpenGL
+
+    try:
+        import OpenGL.GL as gl
+        import OpenGL.GLU as glu
+    except ImportError:
+        from ctypes import util
+
+        orig_util_find_library = util.find_library
+
+
+        def new_util_find_library(name):
+            res = orig_util_find_library(name)
+            if res:
+                return res
+            return '/System/Library/Frameworks/' + name + '.framework/' + name
+
+
+        util.find_library = new_util_find_library
+        import OpenGL.GL as gl
+        import OpenGL.GLU as glu
+except ImportError:
+    raise ImportError("Required dependency PyOpenGL not present")
+
+
+class GLState:
+    """
+    See module docstring
+    """
+    CALLS = ("useProgram", "bindVertexArray", "activeTexture", "bindTexture", "uniform", "location")
+
+    enabled = True  # when False every call is issued, the shadow state is still kept
+    program = None  # program in use, None when unknown
+    vertexArray = None  # VAO bound, None when unknown
+    activeUnit = None  # active texture unit index, None when unknown
+    textures = None  # (texture unit index, target) -> texture bound
+    uniforms = None  # (program, location) -> value last uploaded
+
+    real = None  # call -> GL calls issued since resetCounters
+    elided = None  # call -> redundant calls skipped since resetCounters
+
+    def __init__(self):
+        self.real = dict.fromkeys(self.CALLS, 0)
+        self.elided = dict.fromkeys(self.CALLS, 0)
+        self.reset()
+
+    def reset(self):
+        """
+        Forget everything, e.g. when another context is made current
+        """
+        self.program = None
+        self.vertexArray = None
+        self.activeUnit = None
+        self.textures = {}
+        self.uniforms = {}
+
+    def forgetProgram(self, program):
+        """
+        Drop the uniform values cached for program, linking resets them
+        """
+        self.uniforms = {key: value for key, value in self.uniforms.items() if key[0] != program}
+        if self.program == program:
+            self.program = None
+
+    def count(self, call, issued):
+        if issued:
+            self.real[call] += 1
+        else:
+            self.elided[call] += 1
+
+    def resetCounters(self):
+        """
+        :return: call -> (real, elided) since the last reset, e.g. over one frame
+        :rtype: dict
+        """
+        counters = {call: (self.real[call], self.elided[call]) for call in self.CALLS}
+        self.real = dict.fromkeys(self.CALLS, 0)
+        self.elided = dict.fromkeys(self.CALLS, 0)
+        return counters
+
+    def useProgram(self, program):
+        issued = not self.enabled or program != self.program
+        if issued:
+            gl.glUseProgram(program)
+            self.program = program
+        self.count("useProgram", issued)
+
+    def bindVertexArray(self, vertexArray):
+        issued = not self.enabled or vertexArray != self.vertexArray
+        if issued:
+            gl.glBindVertexArray(vertexArray)
+            self.vertexArray = vertexArray
+        self.count("bindVertexArray", issued)
+
+    def setActiveUnit(self, unit):
+        issued = not self.enabled or unit != self.activeUnit
+        if issued:
+            gl.glActiveTexture(gl.GL_TEXTURE0 + unit)
+            self.activeUnit = unit
+        self.count("activeTexture", issued)
+
+    def bindTexture(self, unit, texture, target=gl.GL_TEXTURE_2D):
+        """
+        Make unit active and bind texture to its target
+        """
+        self.setActiveUnit(unit)
+        key = (unit, target)
+        issued = not self.enabled or self.textures.get(key) != texture
+        if issued:
+            gl.glBindTexture(target, texture)
+            self.textures[key] = texture
+        self.count("bindTexture", issued)
+
+    def setUniform(self, location, value, upload):
+        """
+        Call upload(location) unless the program in use already holds value at location
+
+        :param value: hashable, comparable form of the value, e.g. the bytes of an array
+        :param upload: issues the glUniform* call
+        :type upload: function
+        """
+        if self.program is None:
+            upload(location)
+            self.count("uniform", True)
+            return
+        key = (self.program, location)
+        issued = not self.enabled or self.uniforms.get(key) != value
+        if issued:
+            upload(location)
+            self.uniforms[key] = value
+        self.count("uniform", issued)
+
+
+glState = GLState()
+
+
+if __name__ == "__main__":
+    import math
+    import time
+
+    import numpy as np
+
+    import ColorType
+    from Component import Component
+    from GLProgram import GLProgram
+    # the instance the other modules use, not the one of this script
+    from GLState import glState
+    from GLUtility import GLUtility
+    from ModelAxes import ModelAxes
+    from ModelLinkage import ModelLinkage
+    from Offscreen import OffscreenContext
+    from Point import Point
+    from StaticBake import bakeStatic
+
+    # headless 3.3 core context rendering into a framebuffer object
+    width = height = 200
+    context = OffscreenContext(width, height)
+    gl.glEnable(gl.GL_DEPTH_TEST)
+    print(gl.glGetString(gl.GL_RENDERER).decode(), f"{width}x{height}")
+
+    # the scene of Sketch: the crab and the axes, drawn one component at a time
+    glutility = GLUtility()
+    program = GLProgram()
+    program.compile()
+    program.setMat4("projectionMat", glutility.perspective(45, width, height, 0.01, 100))
+    top = Component(Point((0, 0, 0)))
+    model = ModelLinkage(None, Point((0, 0, 0)), program)
+    axes = ModelAxes(None, Point((-1, -1, -1)), program)
+    top.addChild(model)
+    top.addChild(axes)
+    top.initialize()
+    top.update(np.identity(4))
+    bakeStatic(top)
+
+    def drawFrame(frame):
+        gl.glClearColor(*ColorType.BLUEGREEN, 1.0)
+        gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+        theta = 0.01 * frame
+        eye = [6 * math.cos(theta), 3, 6 * math.sin(theta)]
+        program.setMat4("viewMat", glutility.view(eye, [0, 0, 0], [0, 1, 0]))
+        model.componentList[0].setCurrentAngle(frame % 30, Component.AXIS_U)
+        top.update(np.identity(4))
+        top.draw(program)
+
+    def readPixels():
+        gl.glFinish()
+        return np.frombuffer(gl.glReadPixels(0, 0, width, height, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE), np.uint8)
+
+    frames = 200
+    print(f"{'tracking':>9}{'ms/frame':>10}  calls per frame issued/skipped")
+    images = []
+    for enabled in (False, True):
+        glState.enabled = enabled
+        drawFrame(0)
+        glState.resetCounters()
+        times = []
+        for frame in range(frames):
+            t1 = time.perf_counter()
+            drawFrame(frame)
+            gl.glFinish()
+            times.append(time.perf_counter() - t1)
+        counters = glState.resetCounters()
+        drawFrame(7)
+        images.append(readPixels())
+        calls = "  ".join(f"{call} {real // frames}/{elided // frames}" for call, (real, elided) in counters.items())
+        print(f"{str(enabled):>9}{min(times) * 1000:>10.3f}  {calls}")
+    # skipping redundant calls does not change the picture
+    assert (images[0] == images[1]).all()
+
+    # one draw per component: matrix and color uploaded as uniforms by Component.draw, or packed into a
+    # TransformBuffer that only sends the rows that changed
+    from GLBuffer import TransformBuffer
+    from Shapes import Cube
+
+    programs = [GLProgram(), GLProgram(transformBuffer=True)]
+    for p in programs:
+        p.compile()
+        p.setMat4("projectionMat", glutility.perspective(45, width, height, 0.01, 100))
+    buffer = TransformBuffer(programs[1])
+    rng = np.random.default_rng(0)
+    frames = 20
+    print(f"{'nodes':>7}{'changes':>9}{'uniforms ms':>13}{'buffer ms':>11}{'uniforms calls':>16}{'buffer calls':>14}"
+          f"{'rows sent':>11}{'uploads':>9}")
+    for count in (1000, 4000):
+        positions = rng.uniform(-1, 1, (count, 3))
+        colors = rng.uniform(0, 1, (count, 3))
+        trees = []
+        for p in programs:
+            root = Component(Point((0, 0, 0)))
+            cubes = [Cube(Point(tuple(position)), p, [0.02, 0.02, 0.02], ColorType.ColorType(*color))
+                     for position, color in zip(positions, colors)]
+            for cube in cubes:
+                root.addChild(cube)
+            root.initialize()
+            trees.append((root, cubes))
+
+        for changes in ("none", "10 nodes", "all"):
+            results = []
+            for p, (root, cubes) in zip(programs, trees):
+                def drawCubes(frame):
+                    gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+                    p.setMat4("viewMat", glutility.view([0, 0, 3], [0, 0, 0], [0, 1, 0]))
+                    if changes == "all":
+                        root.setCurrentAngle(frame % 30, Component.AXIS_U)
+                    elif changes == "10 nodes":
+                        for cube in cubes[frame % 10::count // 10]:
+                            cube.setCurrentAngle(frame % 30, Component.AXIS_U)
+                    root.update(np.identity(4))
+                    if p.transformBuffer:
+                        buffer.drawBatch(root.collectTransforms())
+                    else:
+                        root.draw(p)
+                    gl.glFinish()
+
+                drawCubes(0)
+                glState.resetCounters()
+                rows = uploads = 0
+                times = []
+                for frame in range(1, frames + 1):
+                    t1 = time.perf_counter()
+                    drawCubes(frame)
+                    times.append(time.perf_counter() - t1)
+                    rows += buffer.uploadedRows
+                    uploads += buffer.uploads
+                issued = sum(real for real, elided in glState.resetCounters().values())
+                results.append((min(times) * 1000, issued // frames, rows // frames, uploads // frames))
+                images.append(readPixels())
+            (uniformTime, uniformCalls, _, _), (bufferTime, bufferCalls, rows, uploads) = results
+            print(f"{count:>7}{changes:>9}{uniformTime:>13.2f}{bufferTime:>11.2f}{uniformCalls:>16}{bufferCalls:>14}"
+                  f"{rows:>11}{uploads:>9}")
+            # both paths draw the same picture
+            assert (images[-1] == images[-2]).all()
@@ -23,9 +23,129 @@ try:
 except ImportError:
     raise ImportError("Required dependency PyOpenGL not present")
 
+import functools
 import math
 import numpy as np
 
+# rotate, translate and scale are served from bounded LRU caches keyed by their quantized arguments.
+# Cached matrices are shared and read-only, callers get a copy unless they pass cached=True or an out array
+matrixCacheEnabled = True
+MATRIX_CACHE_SIZE = 4096
+ANGLE_QUANTUM = 1e-9  # in degrees
+LENGTH_QUANTUM = 1e-12  # axis components, translations and scale factors
+
+
+def rotationMatrix(angle, rotationAxis):
+    """
+    4x4 row-major rotation of angle degrees around rotationAxis, uncached
+    """
+    a = angle / 180 * math.pi
+
+    sinHalfAngle = math.sin(0.5 * a)
+    cosHalfAngle = math.cos(0.5 * a)
+
+    s = cosHalfAngle
+    a = sinHalfAngle * rotationAxis[0]
+    b = sinHalfAngle * rotationAxis[1]
+    c = sinHalfAngle * rotationAxis[2]
+
+    # normalize
+    norm = math.sqrt(s*s + a*a + b*b + c*c)
+    if norm < 1e-6:
+        return np.identity(4)
+    s /= norm
+    a /= norm
+    b /= norm
+    c /= norm
+
+    result = np.zeros((4, 4))
+    result[0, 0] = 1 - 2 * b * b - 2 * c * c
+    result[1, 0] = 2 * a * b + 2 * s * c
+    result[2, 0] = 2 * a * c - 2 * s * b
+    result[0, 1] = 2 * a * b - 2 * s * c
+    result[1, 1] = 1 - 2 * a * a - 2 * c * c
+    result[2, 1] = 2 * b * c + 2 * s * a
+    result[0, 2] = 2 * a * c + 2 * s * b
+    result[1, 2] = 2 * b * c - 2 * s * a
+    result[2, 2] = 1 - 2 * a * a - 2 * b * b
+    result[3, 3] = 1
+    return result
+
+
+def translationMatrix(x, y, z):
+    """
+    4x4 row-major homogeneous translation matrix, uncached
+    """
+    result = np.identity(4)
+    result[0, 3] = x
+    result[1, 3] = y
+    result[2, 3] = z
+    return result
+
+
+def scalingMatrix(xS, yS, zS):
+    """
+    4x4 row-major scaling matrix, uncached
+    """
+    result = np.identity(4)
+    result[0, 0] = xS
+    result[1, 1] = yS
+    result[2, 2] = zS
+    return result
+
+
+def readOnly(matrix):
+    matrix.flags.writeable = False
+    return matrix
+
+
+@functools.lru_cache(maxsize=MATRIX_CACHE_SIZE)
+def cachedRotation(angleKey, xKey, yKey, zKey):
+    # built from the quantized values, so a key always maps to the same matrix
+    return readOnly(rotationMatrix(angleKey * ANGLE_QUANTUM,
+                                   (xKey * LENGTH_QUANTUM, yKey * LENGTH_QUANTUM, zKey * LENGTH_QUANTUM)))
+
+
+@functools.lru_cache(maxsize=MATRIX_CACHE_SIZE)
+def cachedTranslation(xKey, yKey, zKey):
+    return readOnly(translationMatrix(xKey * LENGTH_QUANTUM, yKey * LENGTH_QUANTUM, zKey * LENGTH_QUANTUM))
+
+
+@functools.lru_cache(maxsize=MATRIX_CACHE_SIZE)
+def cachedScaling(xKey, yKey, zKey):
+    return readOnly(scalingMatrix(xKey * LENGTH_QUANTUM, yKey * LENGTH_QUANTUM, zKey * LENGTH_QUANTUM))
+
+
+def lengthKey(x):
+    return round(float(x) / LENGTH_QUANTUM)
+
+
+def matrixCacheInfo():
+    """
+    :return: cache name -> functools cache info (hits, misses, maxsize, currsize)
+    :rtype: dict
+    """
+    return {"rotate": cachedRotation.cache_info(), "translate": cachedTranslation.cache_info(),
+            "scale": cachedScaling.cache_info()}
+
+
+def clearMatrixCache():
+    cachedRotation.cache_clear()
+    cachedTranslation.cache_clear()
+    cachedScaling.cache_clear()
+
+
+def output(result, columnMajor, out, cached):
+    # shared tail of rotate, translate and scale
+    if columnMajor:
+        result = result.transpose()
+    if out is not None:
+        out[...] = result
+        return out
+    if cached or result.flags.writeable:
+        return result
+    return result.copy()
+
 
 # used to handle the case when viewing dir is the same as upVector
 # if that case is detected, to provide smooth view matrix, then use lastUpAxis as upVector
@@ -71,12 +191,35 @@ class GLUtility:
         return viewMatrix.transpose() if columnMajor else viewMatrix
 
     @staticmethod
-    def scale(xS, yS, zS, columnMajor=True):
-        result = np.identity(4)
-        result[0, 0] = xS
-        result[1, 1] = yS
-        result[2, 2] = zS
-        return result.transpose() if columnMajor else result
+    def orbit(center, distance, theta, phi):
+        """
+        Position on a sphere around center, as the camera of Sketch moves
+
+        :param theta: angle around the vertical axis, in rad, pi / 2 on the +z side
+        :type theta: float
+        :param phi: elevation above the horizontal plane, in rad
+        :type phi: float
+        :rtype: list
+        """
+        ct = math.cos(theta)
+        st = math.sin(theta)
+        cp = math.cos(phi)
+        sp = math.sin(phi)
+        return [center[0] + distance * ct * cp,
+                center[1] + distance * sp,
+                center[2] + distance * st * cp]
+
+    @staticmethod
+    def scale(xS, yS, zS, columnMajor=True, out=None, cached=False):
+        """
+        4x4 scaling matrix. Pass out to have it written into an existing 4x4 array instead, or cached=True to get
+        the shared read-only matrix of the cache without a copy
+        """
+        if matrixCacheEnabled:
+            result = cachedScaling(lengthKey(xS), lengthKey(yS), lengthKey(zS))
+        else:
+            result = scalingMatrix(xS, yS, zS)
+        return output(result, columnMajor, out, cached)
 
     @staticmethod
     def perspective(fov, width, height, znear, zfar, columnMajor=True):
@@ -108,47 +251,74 @@ class GLUtility:
         return result.transpose() if columnMajor else result
 
     @staticmethod
-    def translate(x, y, z, columnMajor=True):
+    def translate(x, y, z, columnMajor=True, out=None, cached=False):
         """
-        4x4 homogeneous translation matrix
+        4x4 homogeneous translation matrix. Pass out to have it written into an existing 4x4 array instead, or
+        cached=True to get the shared read-only matrix of the cache without a copy
         """
-        result = np.identity(4)
-        result[0, 3] = x
-        result[1, 3] = y
-        result[2, 3] = z
-        return result.transpose() if columnMajor else result
+        if matrixCacheEnabled:
+            result = cachedTranslation(lengthKey(x), lengthKey(y), lengthKey(z))
+        else:
+            result = translationMatrix(x, y, z)
+        return output(result, columnMajor, out, cached)
 
     @staticmethod
-    def rotate(angle, rotationAxis, columnMajor=True):
-        a = angle / 180 * math.pi
-
-        sinHalfAngle = math.sin(0.5 * a)
-        cosHalfAngle = math.cos(0.5 * a)
-
-        s = cosHalfAngle
-        a = sinHalfAngle * rotationAxis[0]
-        b = sinHalfAngle * rotationAxis[1]
-        c = sinHalfAngle * rotationAxis[2]
-
-        # normalize
-        norm = math.sqrt(s*s + a*a + b*b + c*c)
-        if norm < 1e-6:
-            return np.identity(4)
-        s /= norm
-        a /= norm
-        b /= norm
-        c /= norm
+    def rotate(angle, rotationAxis, columnMajor=True, out=None, cached=False):
+        """
+        4x4 rotation of angle degrees around rotationAxis. Pass out to have it written into an existing 4x4 array
+        instead, or cached=True to get the shared read-only matrix of the cache without a copy
+        """
+        if matrixCacheEnabled:
+            result = cachedRotation(round(float(angle) / ANGLE_QUANTUM), lengthKey(rotationAxis[0]),
+                                    lengthKey(rotationAxis[1]), lengthKey(rotationAxis[2]))
+        else:
+            result = rotationMatrix(angle, rotationAxis)
+        return output(result, columnMajor, out, cached)
 
-        result = np.zeros((4, 4))
-        result[0, 0] = 1 - 2 * b * b - 2 * c * c
-        result[1, 0] = 2 * a * b + 2 * s * c
-        result[2, 0] = 2 * a * c - 2 * s * b
-        result[0, 1] = 2 * a * b - 2 * s * c
-        result[1, 1] = 1 - 2 * a * a - 2 * c * c
-        result[2, 1] = 2 * b * c + 2 * s * a
-        result[0, 2] = 2 * a * c + 2 * s * b
-        result[1, 2] = 2 * b * c - 2 * s * a
-        result[2, 2] = 1 - 2 * a * a - 2 * b * b
-        result[3, 3] = 1
 
-        return result.transpose() if columnMajor else result
+if __name__ == "__main__":
+    import time
+
+    # Component uses the imported module, not this __main__ one
+    import GLUtility as utility
+    from Component import Component
+    from ModelLinkage import ModelLinkage
+    from Point import Point
+
+    root = Component(Point((0, 0, 0)))
+    root.addChild(ModelLinkage(None, Point((0, 0, 0)), None))
+    nodes = []
+    stack = [root]
+    while stack:
+        c = stack.pop()
+        nodes.append(c)
+        stack.extend(c.children)
+
+    def frame():
+        # Component.update skips unchanged nodes, flag them all to rebuild every matrix with unchanged inputs
+        for c in nodes:
+            c.markLocalDirty()
+        t1 = time.perf_counter()
+        root.update(np.identity(4))
+        return time.perf_counter() - t1
+
+    rounds = 2000
+    results = {}
+    for enabled in (False, True):
+        utility.matrixCacheEnabled = enabled
+        utility.clearMatrixCache()
+        frame()
+        results[enabled] = (min(frame() for _ in range(rounds)) * 1000, nodes[-1].transformationMat.copy())
+        print(f"cache {'on ' if enabled else 'off'}: {results[enabled][0]:.3f} ms per crab frame ({len(nodes)} nodes)")
+    print(f"speedup {results[False][0] / results[True][0]:.2f}x, "
+          f"max difference {np.abs(results[False][1] - results[True][1]).max():.1e}")
+    for name, info in utility.matrixCacheInfo().items():
+        print(f"  {name:<10} hits {info.hits:>7} misses {info.misses:>4} size {info.currsize}/{info.maxsize}")
+
+    # zero-allocation variant
+    buffer = np.empty((4, 4))
+    assert utility.GLUtility.rotate(30, [0, 1, 0], False, out=buffer) is buffer
+    assert np.allclose(buffer, utility.rotationMatrix(30, [0, 1, 0]))
+    # callers own what they get unless they ask for the shared matrix
+    assert utility.GLUtility.rotate(30, [0, 1, 0]).flags.writeable
+    assert not utility.GLUtility.rotate(30, [0, 1, 0], cached=True).flags.writeable
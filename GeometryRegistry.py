@@ -0,0 +1,202 @@
+"""
+Registry of unit-size meshes shared by every component that draws the same asset.
+
+One SharedGeometry is kept per (asset, LOD). It owns the CPU vertex/index arrays and, once uploaded, a single
+VBO/EBO pair plus one VAO per shader program. Per-instance size and color are not baked into the vertices:
+SharedMesh applies size through the model matrix and color through the currentColor uniform.
+"""
+
+import threading
+import weakref
+
+from Bounds import pointBounds
+from GLBuffer import VAO, VBO, EBO, VertexFormat, indexFormat
+
+
+class SharedGeometry:
+    """
+    Unit-size geometry of one asset at one level of detail, uploaded to the GPU at most once per context.
+    Vertices are packed in the VertexFormat of the program drawing them; programs reading the same attributes
+    share one VBO.
+    """
+    name = None
+    vertices = None
+    indices = None
+    aabb = None  # bounds of the unit-size vertices, see Bounds
+    sphere = None
+
+    ebo = None
+    vbos = None  # VertexFormat.key -> (VBO, dequantization scale and offset)
+    vaos = None  # GL program name -> (VAO, dequantization scale and offset)
+    arenaAllocations = None  # MeshArena -> ArenaAllocation
+
+    def __init__(self, name, vertices, indices):
+        """
+        :param name: label used in reports
+        :type name: string
+        :param vertices: vertex array, 11 floats per vertex, flat or (N, 11)
+        :type vertices: numpy.ndarray
+        :param indices: triangle indices
+        :type indices: numpy.ndarray
+        """
+        self.name = name
+        self.vertices = vertices.reshape(-1, 11)
+        self.indices = indices
+        self.aabb, self.sphere = pointBounds(self.vertices[:, 0:3])
+        self.vbos = {}
+        self.vaos = {}
+        self.arenaAllocations = weakref.WeakKeyDictionary()
+
+    def isUploaded(self):
+        return self.ebo is not None
+
+    def initialize(self, shaderProg):
+        """
+        Upload the buffers if this hasn't happened in the current context, and set up a VAO for shaderProg
+        """
+        if shaderProg.program in self.vaos:
+            return
+        vertexFormat = VertexFormat.forProgram(shaderProg)
+        vao = VAO()
+        vao.bind()
+        if self.ebo is None:
+            self.ebo = EBO()
+            self.ebo.setBuffer(self.indices)
+        if vertexFormat.key not in self.vbos:
+            vbo = VBO()
+            packed, dequant = vertexFormat.pack(self.vertices)
+            vbo.setPackedBuffer(packed, vertexFormat)
+            self.vbos[vertexFormat.key] = (vbo, dequant)
+        vbo, dequant = self.vbos[vertexFormat.key]
+        vbo.setFormat(vertexFormat, shaderProg)
+        self.ebo.bind()
+        vao.unbind()
+        self.vaos[shaderProg.program] = (vao, dequant)
+
+    def dequant(self, shaderProg):
+        """
+        :return: (2, 3) scale and offset restoring the positions uploaded for shaderProg, see VertexFormat.pack
+        :rtype: numpy.ndarray
+        """
+        return self.vaos[shaderProg.program][1]
+
+    def allocate(self, arena):
+        """
+        Copy this geometry into arena the first time it is drawn from there
+
+        :type arena: GLBuffer.MeshArena
+        :rtype: GLBuffer.ArenaAllocation
+        """
+        allocation = self.arenaAllocations.get(arena)
+        if allocation is None:
+            allocation = arena.allocate(self.vertices, self.indices)
+            self.arenaAllocations[arena] = allocation
+        return allocation
+
+    def draw(self, shaderProg):
+        # the VAO stays bound, consecutive draws of this geometry only bind it once
+        self.vaos[shaderProg.program][0].bind()
+        self.ebo.draw()
+
+    def invalidateGPU(self):
+        """
+        Forget GL objects, e.g. after the context they lived in was destroyed. They will be re-uploaded on demand
+        """
+        self.ebo = None
+        self.vbos = {}
+        self.vaos = {}
+        self.arenaAllocations = weakref.WeakKeyDictionary()
+
+    def cpuBytes(self):
+        return self.vertices.nbytes + self.indices.nbytes
+
+    def gpuBytes(self, vertexFormat=None):
+        """
+        Bytes held in GL buffers. Before upload, or for a given vertexFormat, the size the upload would take
+        """
+        if vertexFormat is None and self.vbos:
+            return self.ebo.byteLength + sum(vbo.byteLength for vbo, _ in self.vbos.values())
+        if vertexFormat is None:
+            vertexFormat = VertexFormat.float32()
+        return vertexFormat.stride * len(self.vertices) + indexFormat(self.indices)[0].itemsize * self.indices.size
+
+
+class GeometryRegistry:
+    """
+    Maps (asset, LOD) to the SharedGeometry drawn by every instance of that asset
+    """
+    entries = None
+
+    def __init__(self):
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, asset, lod=0):
+        """
+        :param asset: lazily loaded geometry source, anything with a pathname and a get() returning (vertices, indices)
+        :type asset: Shapes.MeshAsset
+        :param lod: level of detail of this asset, 0 is the full mesh
+        :type lod: int
+        :rtype: SharedGeometry
+        """
+        key = (asset.pathname, lod)
+        geometry = self.entries.get(key)
+        if geometry is None:
+            with self._lock:
+                geometry = self.entries.get(key)
+                if geometry is None:
+                    vertices, indices = asset.get()
+                    geometry = SharedGeometry(asset.pathname, vertices, indices)
+                    self.entries[key] = geometry
+        return geometry
+
+    def invalidateGPU(self):
+        for geometry in self.entries.values():
+            geometry.invalidateGPU()
+
+    def cpuBytes(self):
+        return sum(geometry.cpuBytes() for geometry in self.entries.values())
+
+    def gpuBytes(self):
+        return sum(geometry.gpuBytes() for geometry in self.entries.values())
+
+
+# registry used by Shapes
+registry = GeometryRegistry()
+
+
+if __name__ == "__main__":
+    import time
+
+    from Point import Point
+    from ModelLinkage import ModelLinkage
+
+    def geometryFootprint(root):
+        """
+        :return: (meshes, shared cpu bytes, shared gpu bytes, cpu bytes if baked per instance, gpu bytes if baked)
+        """
+        meshes = []
+        stack = [root]
+        while stack:
+            c = stack.pop()
+            if c.displayObj is not None:
+                meshes.append(c.displayObj)
+            stack.extend(c.children)
+        unique = {id(m.geometry): m.geometry for m in meshes}.values()
+        sharedCpu = sum(g.cpuBytes() for g in unique)
+        sharedGpu = sum(g.gpuBytes() for g in unique)
+        # the previous layout copied the asset arrays into every mesh and uploaded each copy
+        bakedCpu = sum(m.geometry.cpuBytes() for m in meshes)
+        bakedGpu = sum(m.geometry.gpuBytes() for m in meshes)
+        return len(meshes), sharedCpu, sharedGpu, bakedCpu, bakedGpu
+
+    for crabs in (1, 1000):
+        t1 = time.perf_counter()
+        scene = ModelLinkage(None, Point((0, 0, 0)), None)
+        for _ in range(crabs - 1):
+            scene.addChild(ModelLinkage(None, Point((0, 0, 0)), None))
+        t2 = time.perf_counter()
+        meshCount, sharedCpu, sharedGpu, bakedCpu, bakedGpu = geometryFootprint(scene)
+        print(f"{crabs} crab(s), {meshCount} meshes, built in {(t2 - t1) * 1000:.0f} ms")
+        print(f"  geometry CPU: shared {sharedCpu / 1024:10.1f} KiB   baked per instance {bakedCpu / 1024:10.1f} KiB")
+        print(f"  geometry GPU: shared {sharedGpu / 1024:10.1f} KiB   baked per instance {bakedGpu / 1024:10.1f} KiB")
@@ -0,0 +1,170 @@
+"""
+Persistent binary cache for meshes imported from .dae files.
+
+Decoded vertex and index arrays are written next to the asset as a pair of .npy sidecars in a .meshcache folder.
+Sidecar names carry a hash of the .dae contents together with the loader and cache versions, so editing an asset
+or changing the loader layout invalidates the old entry. Sidecars are loaded back memory-mapped and read-only.
+
+Writes go to a temporary file in the cache folder followed by an atomic rename, so concurrent processes never
+see a half-written sidecar.
+"""
+
+import glob
+import hashlib
+import os
+import secrets
+import tempfile
+import time
+
+import numpy as np
+
+import ColladaLoader
+
+CACHE_VERSION = 1
+CACHE_DIRNAME = ".meshcache"
+
+def contentKey(filename):
+    """
+    Cache key of a .dae file: a hash of its bytes plus the loader and cache versions
+
+    :param filename: .dae file
+    :type filename: string
+    :rtype: string
+    """
+    with open(filename, "rb") as f:
+        digest = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+    return f"{digest}-l{ColladaLoader.LOADER_VERSION}c{CACHE_VERSION}"
+
+
+def sidecarPaths(filename, key, cacheDir=None):
+    """
+    :return: (vertices path, indices path) of the sidecars for filename under key
+    :rtype: tuple
+    """
+    if cacheDir is None:
+        cacheDir = os.path.join(os.path.dirname(filename), CACHE_DIRNAME)
+    stem = os.path.join(cacheDir, os.path.basename(filename) + "-" + key)
+    return stem + ".vertices.npy", stem + ".indices.npy"
+
+
+def _createTemp(directory):
+    """
+    Create a new file in directory the way tempfile.mkstemp does, but with the mode of any new file (0o666 less the
+    umask) rather than owner-only, so that other users of a shared checkout can load the sidecars too
+
+    :return: (open file descriptor, path)
+    :rtype: tuple
+    """
+    while True:
+        tmpPath = os.path.join(directory, secrets.token_hex(8) + ".tmp")
+        try:
+            return os.open(tmpPath, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666), tmpPath
+        except FileExistsError:
+            continue
+
+
+def _atomicSave(path, array):
+    fd, tmpPath = _createTemp(os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array)
+        os.replace(tmpPath, path)
+    except BaseException:
+        try:
+            os.remove(tmpPath)
+        except OSError:
+            pass
+        raise
+
+
+def store(filename, key, vertices, indices, cacheDir=None):
+    """
+    Write the sidecars for filename and drop sidecars left behind by older versions of the same asset.
+    Failing to write (e.g. read-only install) is not an error, the mesh will just be parsed again next time
+    """
+    vertexPath, indexPath = sidecarPaths(filename, key, cacheDir)
+    try:
+        os.makedirs(os.path.dirname(vertexPath), exist_ok=True)
+        # indices first: a reader only trusts an entry once the vertex sidecar exists
+        _atomicSave(indexPath, indices)
+        _atomicSave(vertexPath, vertices)
+    except OSError:
+        return
+
+    prefix = os.path.join(os.path.dirname(vertexPath), os.path.basename(filename) + "-")
+    for stale in glob.glob(glob.escape(prefix) + "*.npy"):
+        if stale not in (vertexPath, indexPath):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+
+def load(filename, cacheDir=None):
+    """
+    Import a .dae mesh through the cache
+
+    :param filename: .dae file to import
+    :type filename: string
+    :param cacheDir: where to keep sidecars, defaults to a .meshcache folder next to the asset
+    :type cacheDir: string
+    :return: (vertices, indices), read-only arrays when served from the cache
+    :rtype: tuple
+    """
+    key = contentKey(filename)
+    vertexPath, indexPath = sidecarPaths(filename, key, cacheDir)
+    try:
+        vertices = np.load(vertexPath, mmap_mode="r")
+        indices = np.load(indexPath, mmap_mode="r")
+        return vertices, indices
+    except (OSError, ValueError):
+        pass
+
+    vertices, indices = ColladaLoader.load(filename)
+    store(filename, key, vertices, indices, cacheDir)
+    return vertices, indices
+
+
+def clear(cacheDir):
+    """
+    Remove every sidecar in cacheDir
+    """
+    for path in glob.glob(os.path.join(cacheDir, "*.npy")):
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    rounds = 20
+    paths = sorted(glob.glob("assets/*.dae"))
+    with tempfile.TemporaryDirectory() as cacheDir:
+        # what every process start paid before: parse all assets
+        t1 = time.perf_counter()
+        for _ in range(rounds):
+            for path in paths:
+                ColladaLoader.load(path)
+        t2 = time.perf_counter()
+        parseTime = (t2 - t1) / rounds * 1000
+
+        # first start with an empty cache: parse + write sidecars
+        t1 = time.perf_counter()
+        for path in paths:
+            load(path, cacheDir)
+        t2 = time.perf_counter()
+        fillTime = (t2 - t1) * 1000
+
+        t1 = time.perf_counter()
+        for _ in range(rounds):
+            for path in paths:
+                load(path, cacheDir)
+        t2 = time.perf_counter()
+        cachedTime = (t2 - t1) / rounds * 1000
+
+        for path in paths:
+            cachedVertices, cachedIndices = load(path, cacheDir)
+            vertices, indices = ColladaLoader.load(path)
+            assert np.array_equal(cachedVertices, vertices) and np.array_equal(cachedIndices, indices), path
+
+    print(f"startup cost for {len(paths)} assets")
+    print(f"  parse every start:   {parseTime:8.3f} ms")
+    print(f"  first start (fill):  {fillTime:8.3f} ms")
+    print(f"  cached start:        {cachedTime:8.3f} ms  ({parseTime / cachedTime:.1f}x faster)")
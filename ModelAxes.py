@@ -36,3 +36,8 @@ class ModelAxes(Component):
 
         self.components = [xAxis, yAxis, zAxis]
 
+        # the axes never move: pinning every extent to the current angle lets StaticBake merge them
+        for c in [self] + self.components:
+            for axis in (c.AXIS_U, c.AXIS_V, c.AXIS_W):
+                c.setRotateExtent(axis, c.angles[axis], c.angles[axis])
+
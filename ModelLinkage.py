@@ -19,6 +19,7 @@ created component list and dictionary of all limbs
 """
 
 from Component import Component
+from ModelAxes import ModelAxes
 from Point import Point
 import ColorType as Ct
 from Shapes import Cube
@@ -60,6 +61,23 @@ class ModelLinkage(Component):
     components = None
     contextParent = None
 
+    # List of angles to set every limb to for each pose, rows in componentList order, see applyPose
+    # Poses:
+    # Waving left hand
+    # Grabbing in front
+    # Jumping
+    # Both down
+    # up down down
+    poses = [
+        # BODY        ARM1         BACKARM1     FOREARM1    TOPPIN1    BOTPIN1     ARM2       BACKARM2      FOREARM2    TOPPIN2     BOTPIN2      Stalk1         Eye1          Stalk2        Eye2      Fleg1       SLeg1      Tleg1       ffoot1       sfoot1      tfoot1      Fleg2        Sleg2        Tleg2        ffoot2      sfoot2         tfoot2
+        [[0, 0, 0], [-30, 0, 0], [-15, 0, 0], [-15, 0, 0], [0, 0, 0], [0, 0, 0], [-30, 0, 0], [-15, 0, 0], [-15, 0, 0], [0, 0, 0],  [0, 0, 0], [30, 30, 30],   [0, 0, 0], [-30, -30, -30],[0, 0, 0], [30, 0, 0], [30, 0, 0], [30, 0, 0], [30, 0, 0],  [30, 0, 0], [30, 0, 0], [-30, 0, 0], [-30, 0, 0], [-30, 0, 0], [-30, 0 ,0], [-30, 0, 0], [-30, 0, 0]],
+        [[0, 0, 0], [0, 45, 0], [0, 15, 0], [0, 15, 0], [15, 0, 0], [-15, 0, 0], [0, -45, 0], [0, -15, 0], [0, -15, 0], [-15, 0, 0],[15, 0, 0], [0, 0, 0],     [0, 0, 0], [0, 0, 0],      [0, 0, 0], [30, 0 ,0], [30, 0, 0], [30, 0, 0], [30, 0, 0],  [30, 0, 0], [30, 0, 0], [-30, 0, 0], [-30, 0, 0], [-30, 0, 0], [-30, 0, 0], [-30, 0, 0], [-30, 0, 0]],
+        [[0, 0, 0], [-30, 0, 0], [-15, 0, 0], [-15, 0, 0], [0, 0, 0], [0, 0, 0], [30, 0, 0],  [15, 0, 0],  [15, 0, 0],  [0, 0, 0],  [0, 0, 0], [-30, -30, -30], [0, 0, 0], [30, 30, 30],  [0, 0, 0], [0, 0, 0],  [0, 0, 0],  [0, 0, 0],  [30, 0, 0],  [30, 0, 0], [30, 0, 0], [0, 0, 0],   [0, 0, 0],   [0, 0, 0],   [-30, 0, 0], [-30, 0, 0], [-30, 0, 0]],
+        [[0, 0, 0], [30, 0, 0], [15, 0, 0], [15, 0, 0], [7, 0, 0], [-7, 0, 0], [-30, 0, 0], [-15, 0, 0], [-15, 0, 0],   [-7, 0, 0], [7, 0, 0], [30, 0, 30],     [0, 0, 0], [-30, 0, -30], [0, 0, 0], [30, 0, 0], [30, 0, 0], [30, 0, 0], [30, 0, 0],  [30, 0, 0], [30, 0, 0], [-30, 0, 0], [-30, 0, 0], [-30, 0, 0], [-30, 0, 0], [-30, 0, 0], [-30, 0, 0]],
+        [[0, 0, 0], [-30, 0, 0], [15, 0, 0], [15, 0, 0], [15, 0, 0], [-15, 0, 0], [30, 0, 0], [-15, 0, 0], [-15, 0, 0], [-15, 0, 0],[15, 0, 0], [0, -30, 0],    [0, 0, 0], [0, 30, 0],    [0, 0, 0], [30, 0, 0], [30, 0, 0], [30, 0, 0], [-30, 0, 0], [-30, 0, 0],[-30, 0, 0], [-30, 0 ,0],[-30, 0 ,0], [-30, 0 ,0], [30, 0, 0], [30, 0, 0],   [30, 0, 0]],
+    ]
+    poseInterval = 1.0  # seconds from one pose to the next when the poses are played as an animation
+
     def __init__(self, parent, position, shaderProg, display_obj=None):
         super().__init__(position, display_obj)
         self.contextParent = parent
@@ -267,4 +285,111 @@ class ModelLinkage(Component):
                 "tfoot2": tfoot2,
         }
 
-
+    def poseRanges(self):
+        """
+        :return: (N, 3, 2) [min, max] angle of each axis of each component in componentList, in axis ID order
+        :rtype: numpy.ndarray
+        """
+        return np.array([c.angleRanges for c in self.componentList])
+
+    def applyPose(self, angles):
+        """
+        Set the angles of every component in componentList at once, clamped to their rotate extents.
+        Components are only flagged, the next update of the tree recomputes them in a single pass
+
+        :param angles: (N, 3) angles in degrees, row i for componentList[i], columns in axis ID order
+        :type angles: numpy.ndarray or list
+        :return: None
+        """
+        angles = np.asarray(angles, dtype=np.float64)
+        if angles.shape != (len(self.componentList), 3):
+            raise TypeError(f"pose should have shape ({len(self.componentList)}, 3), not {angles.shape}")
+        ranges = self.poseRanges()
+        angles = np.clip(angles, ranges[:, :, 0], ranges[:, :, 1])
+
+        scene = self.componentList[0].scene
+        if scene is not None and all(c.scene is scene for c in self.componentList):
+            # the angles are rows of the FlatScene arrays, write them in one go
+            indices = [c.sceneIndex for c in self.componentList]
+            scene.angles[indices] = angles
+            scene.markDirty(indices)
+        else:
+            for c, row in zip(self.componentList, angles):
+                c.angles[:] = row
+                c.markLocalDirty()
+
+    @staticmethod
+    def buildScene(parent, topLevelComponent, shaderProg):
+        """
+        Replace the children of topLevelComponent with the scene Sketch shows, the creature and the axes.
+        Neither is initialized
+
+        :param parent: GL canvas of the components, None without a window
+        :type topLevelComponent: Component
+        :return: the creature
+        :rtype: ModelLinkage
+        """
+        model = ModelLinkage(parent, Point((0, 0, 0)), shaderProg)
+        axes = ModelAxes(parent, Point((-1, -1, -1)), shaderProg)
+
+        topLevelComponent.clear()
+        topLevelComponent.addChild(model)
+        topLevelComponent.addChild(axes)
+        return model
+
+
+if __name__ == "__main__":
+    import time
+
+    from FlatScene import FlatScene
+
+    def best(f, rounds=300):
+        times = []
+        for _ in range(rounds):
+            t1 = time.perf_counter()
+            f()
+            times.append(time.perf_counter() - t1)
+        return min(times) * 1e6
+
+    root = Component(Point((0, 0, 0)))
+    model = ModelLinkage(None, Point((0, 0, 0)), None)
+    root.addChild(model)
+    root.update(np.identity(4))
+    poses = np.random.default_rng(0).uniform(-45, 45, (8, len(model.componentList), 3))
+    switches = [0]
+
+    def nextPose():
+        switches[0] += 1
+        return poses[switches[0] % len(poses)]
+
+    def perComponent(pose):
+        # what Sketch did on "t": three setCurrentAngle per component, axes resolved by Point comparison
+        for i, c in enumerate(model.componentList):
+            c.setCurrentAngle(pose[i][0], c.axisBucket[0])
+            c.setCurrentAngle(pose[i][1], c.axisBucket[1])
+            c.setCurrentAngle(pose[i][2], c.axisBucket[2])
+        root.update(np.identity(4))
+
+    def bulk(pose):
+        model.applyPose(pose)
+        root.update(np.identity(4))
+
+    def worldMatrices():
+        return np.array([c.transformationMat for c in model.componentList])
+
+    oldTime = best(lambda: perComponent(nextPose()))
+    perComponent(poses[0])
+    reference = worldMatrices()
+    newTime = best(lambda: bulk(nextPose()))
+    bulk(poses[0])
+    error = np.abs(worldMatrices() - reference).max()
+    FlatScene(root)
+    flatTime = best(lambda: bulk(nextPose()))
+    bulk(poses[0])
+    error = max(error, np.abs(worldMatrices() - reference).max())
+
+    print(f"pose switch, {len(model.componentList)} components (best of 300):")
+    print(f"  setCurrentAngle x3 per component + update: {oldTime:8.1f} us")
+    print(f"  applyPose + update:                        {newTime:8.1f} us ({oldTime / newTime:.1f}x)")
+    print(f"  applyPose + update, FlatScene attached:    {flatTime:8.1f} us ({oldTime / flatTime:.1f}x)")
+    print(f"  max difference between paths: {error:.1e}")
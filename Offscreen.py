@@ -0,0 +1,292 @@
+"""
+Render without a window, e.g. on a server or in CI.
+
+CanvasBase draws through wx.glcanvas, which needs a display. An OffscreenContext instead creates a GL 3.3 core context
+through EGL, surfaceless so without any display, or through OSMesa, Mesa's software renderer in process. It draws into
+a framebuffer object of its own, whose pixels are read back as numpy arrays. OffscreenRenderer draws a scene into it,
+updated and drawn the way Sketch.OnDraw does with its default settings. The command line below renders the scene of
+Sketch, built by ModelLinkage.buildScene as Sketch.InitGL does.
+
+PyOpenGL picks its platform when first imported, so this module has to be imported before any other using GL. It
+selects EGL unless PYOPENGL_PLATFORM was set, PYOPENGL_PLATFORM=osmesa selects OSMesa.
+
+From the command line, render a pose seen from a camera on the orbit of Sketch's camera into a PNG:
+
+    python Offscreen.py crab.png --pose 2 --theta 60 --phi 20 --distance 6
+"""
+
+import os
+
+os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+
+import ctypes
+import math
+
+import numpy as np
+from OpenGL import platform
+import OpenGL.GL as gl
+
+import ColorType
+from GeometryRegistry import registry
+from GLBuffer import TransformBuffer
+from GLState import glState
+from GLUtility import GLUtility
+from Bounds import Frustum
+from RenderQueue import RenderQueue
+
+
+class OffscreenContext:
+    """
+    GL 3.3 core context drawing into a framebuffer object of width x height pixels, see module docstring
+    """
+    BACKENDS = ("egl", "osmesa")
+
+    backend = None  # one of BACKENDS
+    width = 0
+    height = 0
+    context = None
+    display = None  # EGL only
+    surface = None  # OSMesa only, the buffer it needs to make the context current, not drawn into
+    framebuffer = None
+    renderbuffers = None
+
+    def __init__(self, width, height):
+        """
+        Create the context and make it current
+
+        :type width: int
+        :type height: int
+        """
+        self.backend = os.environ["PYOPENGL_PLATFORM"]
+        if self.backend not in self.BACKENDS:
+            raise Exception(f"no offscreen context on platform {self.backend}, set PYOPENGL_PLATFORM to one of "
+                            f"{', '.join(self.BACKENDS)}")
+        if not type(platform.PLATFORM).__name__.lower().startswith(self.backend):
+            raise Exception(f"PyOpenGL was imported for {type(platform.PLATFORM).__name__}, import Offscreen first")
+        self.width = width
+        self.height = height
+        if self.backend == "egl":
+            self.createEGL()
+        else:
+            self.createOSMesa()
+        self.createFramebuffer()
+        # nothing is known about the state of a new context, and shared meshes have to be uploaded into it
+        glState.reset()
+        registry.invalidateGPU()
+
+    def createEGL(self):
+        from OpenGL import EGL
+
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        if not EGL.eglInitialize(self.display, None, None):
+            raise Exception("no EGL display")
+        config = EGL.EGLConfig()
+        configCount = EGL.EGLint()
+        # no window surface is ever made, the default EGL_SURFACE_TYPE would ask for one
+        EGL.eglChooseConfig(self.display, (EGL.EGLint * 5)(EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+                                                           EGL.EGL_SURFACE_TYPE, EGL.EGL_DONT_CARE, EGL.EGL_NONE),
+                            ctypes.pointer(config), 1, ctypes.pointer(configCount))
+        if configCount.value == 0:
+            raise Exception("no EGL configuration renders with OpenGL")
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT, (EGL.EGLint * 7)(
+            EGL.EGL_CONTEXT_MAJOR_VERSION, 3, EGL.EGL_CONTEXT_MINOR_VERSION, 3,
+            EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK, EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT, EGL.EGL_NONE))
+        if self.context == EGL.EGL_NO_CONTEXT:
+            raise Exception("EGL could not create an OpenGL 3.3 core context")
+        self.makeCurrent()
+
+    def createOSMesa(self):
+        # OpenGL.osmesa only loads on the osmesa platform
+        from OpenGL import osmesa
+
+        self.context = osmesa.OSMesaCreateContextAttribs((ctypes.c_int * 11)(
+            osmesa.OSMESA_FORMAT, osmesa.OSMESA_RGBA, osmesa.OSMESA_DEPTH_BITS, 24,
+            osmesa.OSMESA_PROFILE, osmesa.OSMESA_CORE_PROFILE,
+            osmesa.OSMESA_CONTEXT_MAJOR_VERSION, 3, osmesa.OSMESA_CONTEXT_MINOR_VERSION, 3, 0), None)
+        if not self.context:
+            raise Exception("OSMesa could not create an OpenGL 3.3 core context")
+        self.surface = np.zeros((self.height, self.width, 4), dtype=np.uint8)
+        self.makeCurrent()
+
+    def createFramebuffer(self):
+        self.framebuffer = gl.glGenFramebuffers(1)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.framebuffer)
+        self.renderbuffers = []
+        for attachment, storage in ((gl.GL_COLOR_ATTACHMENT0, gl.GL_RGBA8),
+                                    (gl.GL_DEPTH_ATTACHMENT, gl.GL_DEPTH_COMPONENT24)):
+            renderbuffer = gl.glGenRenderbuffers(1)
+            gl.glBindRenderbuffer(gl.GL_RENDERBUFFER, renderbuffer)
+            gl.glRenderbufferStorage(gl.GL_RENDERBUFFER, storage, self.width, self.height)
+            gl.glFramebufferRenderbuffer(gl.GL_FRAMEBUFFER, attachment, gl.GL_RENDERBUFFER, renderbuffer)
+            self.renderbuffers.append(renderbuffer)
+        if gl.glCheckFramebufferStatus(gl.GL_FRAMEBUFFER) != gl.GL_FRAMEBUFFER_COMPLETE:
+            raise Exception("incomplete offscreen framebuffer")
+        gl.glViewport(0, 0, self.width, self.height)
+        # rows of RGB pixels are not padded to 4 bytes
+        gl.glPixelStorei(gl.GL_PACK_ALIGNMENT, 1)
+
+    def makeCurrent(self):
+        """
+        Make the context current on the calling thread, drawing into the framebuffer object
+        """
+        if self.backend == "egl":
+            from OpenGL import EGL
+
+            EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, self.context)
+        else:
+            from OpenGL import osmesa
+
+            osmesa.OSMesaMakeCurrent(self.context, self.surface, gl.GL_UNSIGNED_BYTE, self.width, self.height)
+        if self.framebuffer is not None:
+            gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.framebuffer)
+
+    def readPixels(self):
+        """
+        :return: (height, width, 3) uint8 RGB image of what was drawn, top row first
+        :rtype: numpy.ndarray
+        """
+        pixels = gl.glReadPixels(0, 0, self.width, self.height, gl.GL_RGB, gl.GL_UNSIGNED_BYTE)
+        # GL counts rows from the bottom
+        return np.frombuffer(pixels, dtype=np.uint8).reshape(self.height, self.width, 3)[::-1].copy()
+
+    def destroy(self):
+        gl.glDeleteFramebuffers(1, [self.framebuffer])
+        gl.glDeleteRenderbuffers(len(self.renderbuffers), self.renderbuffers)
+        self.framebuffer = None
+        if self.backend == "egl":
+            from OpenGL import EGL
+
+            EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+            EGL.eglDestroyContext(self.display, self.context)
+        else:
+            from OpenGL import osmesa
+
+            osmesa.OSMesaDestroyContext(self.context)
+        self.context = None
+
+
+class OffscreenRenderer:
+    """
+    A scene drawn into an OffscreenContext, see module docstring
+    """
+    context = None  # OffscreenContext
+    glutility = None
+    shaderProg = None
+    perspMat = None
+    transformBuffer = None
+    renderQueue = None
+    topLevelComponent = None
+    backgroundColor = None
+
+    def __init__(self, context, shaderProg, topLevelComponent, fov=45, near=0.01, far=100,
+                 backgroundColor=ColorType.BLUEGREEN):
+        """
+        :param context: context the scene was created in
+        :type context: OffscreenContext
+        :param shaderProg: program the components of the scene draw with, compiled with transformBuffer=True
+        :type shaderProg: GLProgram
+        :param topLevelComponent: root of the scene, initialized
+        :type topLevelComponent: Component
+        :param fov: vertical field of view in degrees
+        :param near: distance of the near clipping plane, also where the RenderQueue starts sorting
+        :param far: distance of the far clipping plane
+        :type backgroundColor: ColorType
+        """
+        self.context = context
+        self.glutility = GLUtility()
+        self.shaderProg = shaderProg
+        self.topLevelComponent = topLevelComponent
+        self.backgroundColor = backgroundColor
+        self.transformBuffer = TransformBuffer(shaderProg)
+        self.renderQueue = RenderQueue(near, far)
+
+        self.context.makeCurrent()
+        gl.glEnable(gl.GL_DEPTH_TEST)
+        self.perspMat = self.glutility.perspective(fov, context.width, context.height, near, far)
+        self.shaderProg.setMat4("projectionMat", self.perspMat)
+
+    def render(self, cameraPos, lookAtPt=(0, 0, 0), upVector=(0, 1, 0)):
+        """
+        Draw the scene as it is now
+
+        :return: (height, width, 3) uint8 RGB image, top row first
+        :rtype: numpy.ndarray
+        """
+        self.context.makeCurrent()
+        gl.glClearColor(*self.backgroundColor, 1.0)
+        gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+        viewMat = self.glutility.view(cameraPos, lookAtPt, upVector)
+        self.shaderProg.setMat4("viewMat", viewMat)
+        self.topLevelComponent.update(np.identity(4))
+        records = self.topLevelComponent.collectTransforms(frustum=Frustum(self.perspMat, viewMat))
+        self.transformBuffer.drawBatch(records, self.renderQueue.sort(records, viewMat))
+        return self.context.readPixels()
+
+    def close(self):
+        self.context.destroy()
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from PIL import Image
+
+    from Animation import Animation, Clip
+    from Component import Component
+    from GLProgram import GLProgram
+    from ModelLinkage import ModelLinkage
+    from Point import Point
+    from StaticBake import bakeStatic
+
+    parser = argparse.ArgumentParser(description="Render the crab of Sketch without a window into a PNG. "
+                                                 "PYOPENGL_PLATFORM=osmesa renders with OSMesa instead of EGL")
+    parser.add_argument("output", help="PNG path, with a %%d for the frame number when rendering several frames")
+    parser.add_argument("--size", type=int, nargs=2, default=(500, 500), metavar=("WIDTH", "HEIGHT"))
+    posing = parser.add_mutually_exclusive_group()
+    posing.add_argument("--pose", type=int, choices=range(len(ModelLinkage.poses)),
+                        help="row of ModelLinkage.poses, the rest pose by default")
+    posing.add_argument("--time", type=float, help="seconds into the animation of the poses")
+    parser.add_argument("--frames", type=int, default=1, help="frames of the animation to render from --time on")
+    parser.add_argument("--fps", type=float, default=30, help="animation frames per second with --frames")
+    # the default camera of Sketch.resetView
+    parser.add_argument("--distance", type=float, default=6)
+    parser.add_argument("--theta", type=float, default=90, help="degrees around the vertical axis")
+    parser.add_argument("--phi", type=float, default=30, help="degrees of elevation")
+    parser.add_argument("--look-at", type=float, nargs=3, default=(0, 0, 0), metavar=("X", "Y", "Z"))
+    args = parser.parse_args()
+    if args.frames < 1:
+        parser.error("--frames should be at least 1")
+    if args.frames > 1 and "%" not in args.output:
+        parser.error("rendering several frames needs a %d in output")
+    if args.frames > 1 and args.pose is not None:
+        parser.error("--frames renders the animation of the poses, not a single --pose")
+
+    context = OffscreenContext(*args.size)
+    shaderProg = GLProgram(transformBuffer=True)
+    shaderProg.compile()
+    topLevelComponent = Component(Point((0, 0, 0)))
+    model = ModelLinkage.buildScene(None, topLevelComponent, shaderProg)
+    topLevelComponent.initialize()
+    topLevelComponent.update(np.identity(4))
+    bakeStatic(topLevelComponent)
+    animation = Animation(Clip.fromPoses(ModelLinkage.poses, ModelLinkage.poseInterval), model.componentList)
+    renderer = OffscreenRenderer(context, shaderProg, topLevelComponent)
+    print(context.backend, gl.glGetString(gl.GL_RENDERER).decode(), f"{args.size[0]}x{args.size[1]}")
+    if args.pose is not None:
+        model.applyPose(ModelLinkage.poses[args.pose])
+    cameraPos = renderer.glutility.orbit(args.look_at, args.distance, math.radians(args.theta),
+                                         math.radians(args.phi))
+    elapsed = 0.0
+    for i in range(args.frames):
+        if args.time is not None or args.frames > 1:
+            animation.seek((args.time or 0.0) + i / args.fps)
+        t1 = time.perf_counter()
+        image = renderer.render(cameraPos, args.look_at)
+        elapsed += time.perf_counter() - t1
+        path = args.output % i if args.frames > 1 else args.output
+        Image.fromarray(image).save(path)
+    renderer.close()
+    print(f"{args.frames} frame(s) written, {elapsed / args.frames * 1000:.1f} ms per frame")
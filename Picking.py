@@ -0,0 +1,321 @@
+"""
+Pick the component under the cursor.
+
+A ray through the cursor (see Sketch.pickComponent) is tested against a bounding volume hierarchy over the world boxes
+of the components' meshes, then against the triangles of the few meshes whose boxes it crosses, nearest box first,
+with a vectorized Moller-Trumbore test.
+
+The hierarchy is built with numpy alone, without a Python loop over its nodes, so that rebuilding it at the first
+pick after the scene moved stays cheap (Sketch keeps it until then): the meshes are sorted along a Morton curve
+through their box centers and split evenly between the leaves of a complete tree of BRANCHING children per node, laid
+out one array per level (node j has the children j * BRANCHING to j * BRANCHING + BRANCHING - 1 of the next level),
+its boxes merged one level at a time. The ray descends it one level at a time as well, so a few numpy calls per level
+test every node of the level it reaches.
+"""
+
+import weakref
+
+import numpy as np
+
+from Displayable import Displayable
+
+
+def rayBoxes(origin, inverseDirection, lows, highs):
+    """
+    Slab test of one ray against many boxes
+
+    :param origin: start of the ray
+    :param inverseDirection: 1 / direction of the ray, infinite along the axes the ray is parallel to
+    :param lows: (N, 3) min corners
+    :param highs: (N, 3) max corners
+    :return: distance along the ray where it enters each box, in multiples of direction, 0 when it starts inside and
+             infinite when it misses, as it misses boxes with nan corners
+    :rtype: numpy.ndarray
+    """
+    with np.errstate(invalid="ignore"):
+        t1 = (lows - origin) * inverseDirection
+        t2 = (highs - origin) * inverseDirection
+    # fmin and fmax skip the nan of a ray parallel to a box face it lies in
+    near = np.maximum(np.fmin(t1, t2).max(axis=1), 0)
+    far = np.fmax(t1, t2).min(axis=1)
+    with np.errstate(invalid="ignore"):
+        return np.where(near <= far, near, np.inf)
+
+
+def crossMatrix(vector):
+    """
+    :return: M such that points @ M is the cross product of vector with each row of points
+    :rtype: numpy.ndarray
+    """
+    x, y, z = vector
+    return np.array(((0, z, -y), (-z, 0, x), (y, -x, 0)), dtype=np.float64)
+
+
+def rayTriangles(origin, direction, corners, edges1, edges2, cornerCrosses):
+    """
+    Moller-Trumbore test of one ray against many triangles, both faces count
+
+    :param corners: (N, 3) first vertex of each triangle
+    :param edges1: (N, 3) second vertex minus the first
+    :param edges2: (N, 3) third vertex minus the first
+    :param cornerCrosses: (N, 3) cross product of corners and edges1
+    :return: distance along the ray to each triangle, in multiples of direction, infinite when it misses
+    :rtype: numpy.ndarray
+    """
+    # the cross products as matrix products, np.cross being slow on small arrays
+    p = edges2 @ crossMatrix(direction)
+    # (origin - corner) x edge1
+    q = edges1 @ crossMatrix(origin) - cornerCrosses
+    determinants = np.einsum("ij,ij->i", edges1, p)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inverse = 1.0 / determinants
+        u = (p @ origin - np.einsum("ij,ij->i", corners, p)) * inverse
+        v = (q @ direction) * inverse
+        t = np.einsum("ij,ij->i", q, edges2) * inverse
+        hit = (np.abs(determinants) > 1e-12) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0)
+    return np.where(hit, t, np.inf)
+
+
+def mortonCodes(points):
+    """
+    :param points: (N, 3) positions
+    :return: 30-bit Morton code of each point on a 1024^3 grid over their bounds
+    :rtype: numpy.ndarray
+    """
+    low = points.min(axis=0)
+    size = np.maximum(points.max(axis=0) - low, 1e-12)
+    cells = np.minimum((points - low) / size * 1024, 1023).astype(np.uint32)
+    codes = np.zeros(len(points), dtype=np.uint32)
+    for axis in range(3):
+        bits = cells[:, axis]
+        # spread the 10 bits apart, two zeros between consecutive bits
+        bits = (bits | (bits << 16)) & 0x030000FF
+        bits = (bits | (bits << 8)) & 0x0300F00F
+        bits = (bits | (bits << 4)) & 0x030C30C3
+        bits = (bits | (bits << 2)) & 0x09249249
+        codes |= bits << (2 - axis)
+    return codes
+
+
+class PickTree:
+    """
+    See module docstring. Build one after Component.update, the boxes are those of the current transformations
+    """
+    BRANCHING = 8
+    LEAF_SIZE = 4  # most meshes per leaf
+
+    # triangles of each mesh in the space its sizeMat applies to, shared by the meshes of one SharedGeometry,
+    # see triangles
+    triangleCache = weakref.WeakKeyDictionary()
+
+    components = None  # list<Component> with a mesh, StaticBake subtrees excepted
+    boxes = None  # (N, 2, 3) world box of each component's mesh
+    leafMeshes = None  # (leaves, meshes per leaf) indices into components, -1 for none
+    levels = None  # list of (min corners, max corners) of the nodes of each level, (BRANCHING ** level, 3), root first
+
+    # nodes and triangles tested by the last pick
+    testedNodes = 0
+    testedTriangles = 0
+
+    def __init__(self, root):
+        """
+        :param root: top of the components to pick among, updated
+        :type root: Component
+        """
+        self.components = []
+        stack = [root]
+        while stack:
+            c = stack.pop()
+            if c.bake is not None:
+                # merged into one mesh, their transformations are not kept up to date
+                continue
+            if isinstance(c.displayObj, Displayable) and c.displayObj.aabb is not None:
+                self.components.append(c)
+            stack.extend(c.children)
+
+        count = len(self.components)
+        leafCount = 1
+        while leafCount * self.LEAF_SIZE < count:
+            leafCount *= self.BRANCHING
+        leafSize = max(-(-count // leafCount), 1)
+        self.leafMeshes = np.full(leafCount * leafSize, -1, dtype=np.int64)
+        if count == 0:
+            self.boxes = np.zeros((0, 2, 3))
+            self.leafMeshes = self.leafMeshes.reshape(leafCount, leafSize)
+            self.levels = [(np.full((1, 3), np.nan), np.full((1, 3), np.nan))]
+            return
+
+        matrices = np.array([c.transformationMat for c in self.components])
+        localBoxes = np.array([c.displayObj.aabb for c in self.components])
+        linear = matrices[:, 0:3, 0:3]
+        centers = np.einsum("nij,nj->ni", linear, localBoxes.mean(axis=1)) + matrices[:, 0:3, 3]
+        extents = np.einsum("nij,nj->ni", np.abs(linear), (localBoxes[:, 1] - localBoxes[:, 0]) * 0.5)
+        self.boxes = np.stack((centers - extents, centers + extents), axis=1)
+
+        # meshes close in space share a leaf, the empty slots are spread over the last leaves
+        order = np.argsort(mortonCodes(centers), kind="stable")
+        full = count - (leafSize - 1) * leafCount  # leaves holding leafSize meshes, the others one less
+        self.leafMeshes = self.leafMeshes.reshape(leafCount, leafSize)
+        self.leafMeshes[0:full] = order[0:full * leafSize].reshape(full, leafSize)
+        self.leafMeshes[full:, 0:leafSize - 1] = order[full * leafSize:].reshape(leafCount - full, leafSize - 1)
+        # empty nodes get nan corners, which every ray misses and fmin and fmax skip when merging
+        present = (self.leafMeshes >= 0)[:, :, None]
+        leafBoxes = self.boxes[np.maximum(self.leafMeshes, 0)]
+        lows = np.fmin.reduce(np.where(present, leafBoxes[:, :, 0], np.nan), axis=1)
+        highs = np.fmax.reduce(np.where(present, leafBoxes[:, :, 1], np.nan), axis=1)
+        self.levels = [(lows, highs)]
+        while len(lows) > 1:
+            lows = np.fmin.reduce(lows.reshape(-1, self.BRANCHING, 3), axis=1)
+            highs = np.fmax.reduce(highs.reshape(-1, self.BRANCHING, 3), axis=1)
+            self.levels.append((lows, highs))
+        self.levels.reverse()
+
+    @classmethod
+    def triangles(cls, displayObj):
+        """
+        :return: arguments of rayTriangles after the ray, for the mesh's triangles before sizeMat
+        :rtype: tuple
+        """
+        key = getattr(displayObj, "geometry", displayObj)
+        triangles = cls.triangleCache.get(key)
+        if triangles is None:
+            positions = np.asarray(displayObj.vertices[:, 0:3], dtype=np.float64)
+            corners = positions[np.asarray(displayObj.indices).reshape(-1, 3)]
+            edges1 = corners[:, 1] - corners[:, 0]
+            triangles = (corners[:, 0], edges1, corners[:, 2] - corners[:, 0], np.cross(corners[:, 0], edges1))
+            cls.triangleCache[key] = triangles
+        return triangles
+
+    def candidates(self, origin, direction):
+        """
+        :return: (indices into components, distances where the ray enters their boxes), nearest first
+        :rtype: tuple
+        """
+        with np.errstate(divide="ignore"):
+            inverse = 1.0 / direction
+        nodes = np.zeros(1, dtype=np.int64)
+        self.testedNodes = 0
+        for depth, (lows, highs) in enumerate(self.levels):
+            if depth:
+                nodes = (nodes[:, None] * self.BRANCHING + np.arange(self.BRANCHING)).reshape(-1)
+            self.testedNodes += len(nodes)
+            nodes = nodes[np.isfinite(rayBoxes(origin, inverse, lows[nodes], highs[nodes]))]
+            if len(nodes) == 0:
+                break
+        meshes = self.leafMeshes[nodes].reshape(-1)
+        meshes = meshes[meshes >= 0]
+        distances = rayBoxes(origin, inverse, self.boxes[meshes, 0], self.boxes[meshes, 1])
+        hit = np.isfinite(distances)
+        meshes, distances = meshes[hit], distances[hit]
+        order = np.argsort(distances)
+        return meshes[order], distances[order]
+
+    def intersect(self, component, origin, direction):
+        """
+        :return: distance along the ray to the nearest triangle of the component's mesh, infinite when it misses
+        :rtype: float
+        """
+        displayObj = component.displayObj
+        modelMat = component.transformationMat
+        if displayObj.sizeMat is not None:
+            modelMat = modelMat @ displayObj.sizeMat
+        # the same distances in the mesh's space, the transformation being affine
+        inverse = np.linalg.inv(modelMat)
+        localOrigin = inverse[0:3, 0:3] @ origin + inverse[0:3, 3]
+        localDirection = inverse[0:3, 0:3] @ direction
+        triangles = self.triangles(displayObj)
+        self.testedTriangles += len(triangles[0])
+        distances = rayTriangles(localOrigin, localDirection, *triangles)
+        return float(distances.min()) if len(distances) else np.inf
+
+    def pick(self, origin, direction):
+        """
+        :param origin: start of the ray in world space, e.g. the cursor on the near plane
+        :param direction: direction of the ray, e.g. from the cursor on the near plane to the far plane
+        :return: (nearest Component the ray hits or None, distance in multiples of direction)
+        :rtype: tuple
+        """
+        origin = np.asarray(origin, dtype=np.float64)
+        direction = np.asarray(direction, dtype=np.float64)
+        self.testedTriangles = 0
+        nearest, nearestDistance = None, np.inf
+        for i, boxDistance in zip(*self.candidates(origin, direction)):
+            if boxDistance > nearestDistance:
+                # every triangle left is farther than the box it is in
+                break
+            distance = self.intersect(self.components[i], origin, direction)
+            if distance < nearestDistance:
+                nearest, nearestDistance = self.components[i], distance
+        return nearest, nearestDistance
+
+
+if __name__ == "__main__":
+    import time
+
+    from Component import Component
+    from GLUtility import GLUtility
+    from ModelLinkage import ModelLinkage
+    from Point import Point
+
+    def best(f, rounds=5):
+        times = []
+        for _ in range(rounds):
+            t1 = time.perf_counter()
+            f()
+            times.append(time.perf_counter() - t1)
+        return min(times) * 1000
+
+    # a crowd of posed crabs, about 10000 components
+    side = 19
+    rng = np.random.default_rng(0)
+    top = Component(Point((0, 0, 0)))
+    for i in range(side * side):
+        crab = ModelLinkage(None, Point((2.0 * (i % side) - side, 0, 2.0 * (i // side) - side)), None)
+        for c in crab.componentList:
+            c.setCurrentAngle(rng.uniform(-30, 30), c.AXIS_U)
+        top.addChild(crab)
+    top.update(np.identity(4))
+
+    # rays through a 500x500 window, as Sketch.pickComponent casts them
+    glutility = GLUtility()
+    projectionMat = glutility.perspective(45, 500, 500, 0.01, 100)
+    viewMat = glutility.view([0, 12, side + 6], [0, 0, 0], [0, 1, 0])
+    unproject = np.linalg.inv(viewMat @ projectionMat).T
+    rays = []
+    for x, y in rng.uniform(0, 500, (200, 2)):
+        ends = []
+        for z in (-1.0, 1.0):
+            end = unproject @ np.array((x / 250 - 1, y / 250 - 1, z, 1.0))
+            ends.append(end[0:3] / end[3])
+        rays.append((ends[0], ends[1] - ends[0]))
+
+    tree = PickTree(top)
+    print(f"{len(tree.components)} meshes, {tree.leafMeshes.shape} leaves, {len(tree.levels)} levels, "
+          f"build {best(lambda: PickTree(top)):.2f} ms")
+
+    # the same component as testing every triangle of every mesh
+    for origin, direction in rays[0:5]:
+        component, distance = tree.pick(origin, direction)
+        distances = [tree.intersect(c, origin, direction) for c in tree.components]
+        expected = int(np.argmin(distances))
+        assert distance == distances[expected]
+        assert component is (tree.components[expected] if np.isfinite(distance) else None)
+
+    times = []
+    nodes = triangles = hits = 0
+    for origin, direction in rays:
+        t1 = time.perf_counter()
+        component, _ = tree.pick(origin, direction)
+        times.append(time.perf_counter() - t1)
+        nodes += tree.testedNodes
+        triangles += tree.testedTriangles
+        hits += component is not None
+    times = np.array(times) * 1000
+    print(f"{len(rays)} picks, {hits} hits: mean {times.mean():.3f} ms, median {np.median(times):.3f} ms, "
+          f"99th percentile {np.percentile(times, 99):.3f} ms")
+    print(f"per pick: {nodes / len(rays):.0f} nodes, {triangles / len(rays):.0f} triangles tested "
+          f"of {sum(len(tree.triangles(c.displayObj)[0]) for c in tree.components)}")
+    # Sketch keeps the tree while nothing moves, the first click after a change builds it again
+    buildTime = best(lambda: PickTree(top))
+    print(f"per click: {np.median(times):.3f} ms with the tree kept, {buildTime + np.median(times):.2f} ms "
+          f"(build + pick) after the scene moved")
@@ -219,7 +219,8 @@ class Point:
             self.texture = None
 
     def copy(self):
-        newPoint = Point(copy.deepcopy(self.coords), copy.deepcopy(self.color), copy.deepcopy(self.texture))
+        # the constructor copies coords, color and texture already
+        newPoint = Point(self.coords, self.color, self.texture)
         return newPoint
 
     ################# End of basic functions
@@ -116,6 +116,185 @@ class Quaternion:
         return q_matrix
 
 
+class QuaternionArray:
+    """
+    N quaternions stored as an (N, 4) float array of [s, v0, v1, v2] rows, with the operations of Quaternion
+    applied to all of them at once. Indexing and slicing return views, so writing through them changes this array;
+    a one-row view can be given to Component.setQuaternion
+    """
+    data = None  # (N, 4) numpy.ndarray
+
+    def __init__(self, data):
+        """
+        :param data: (N, 4) or (4,) quaternions as [s, v0, v1, v2], used without copying when already float64
+        :type data: numpy.ndarray or list
+        """
+        data = np.asarray(data, dtype=np.float64)
+        if data.shape == (4,):
+            data = data.reshape(1, 4)
+        if data.ndim != 2 or data.shape[1] != 4:
+            raise TypeError(f"QuaternionArray needs (N, 4) data, not {data.shape}")
+        self.data = data
+
+    @classmethod
+    def identity(cls, n):
+        data = np.zeros((n, 4))
+        data[:, 0] = 1
+        return cls(data)
+
+    @classmethod
+    def fromQuaternions(cls, quaternions):
+        return cls([[q.s, q.v[0], q.v[1], q.v[2]] for q in quaternions])
+
+    @classmethod
+    def fromAxisAngle(cls, axes, angles):
+        """
+        :param axes: (N, 3) rotation axes, normalized here
+        :type axes: numpy.ndarray
+        :param angles: (N,) rotation angles in degrees
+        :type angles: numpy.ndarray
+        """
+        axes = np.asarray(axes, dtype=np.float64).reshape(-1, 3)
+        half = np.radians(np.asarray(angles, dtype=np.float64)) * 0.5
+        norm = np.linalg.norm(axes, axis=1)
+        data = np.zeros((max(len(axes), np.size(half)), 4))
+        data[:, 0] = np.cos(half)
+        data[:, 1:4] = axes * (np.sin(half) / np.where(norm > 1e-12, norm, 1.0))[:, None]
+        return cls(data)
+
+    def toAxisAngle(self):
+        """
+        :return: ((N, 3) unit axes, (N,) angles in degrees in [0, 360]). Identity rotations get the axis (1, 0, 0)
+        :rtype: tuple
+        """
+        q = self.normalized().data
+        sinHalf = np.linalg.norm(q[:, 1:4], axis=1)
+        angles = np.degrees(2 * np.arctan2(sinHalf, q[:, 0]))
+        axes = np.zeros((len(q), 3))
+        axes[:, 0] = 1
+        rotating = sinHalf > 1e-12
+        axes[rotating] = q[rotating, 1:4] / sinHalf[rotating, None]
+        return axes, angles
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            index = range(len(self.data))[index]
+            index = slice(index, index + 1)
+        return QuaternionArray(self.data[index])
+
+    def __repr__(self):
+        return f"QuaternionArray({self.data!r})"
+
+    def copy(self):
+        return QuaternionArray(self.data.copy())
+
+    def quaternion(self, i):
+        """
+        :return: row i as a scalar Quaternion
+        :rtype: Quaternion
+        """
+        return Quaternion(*(float(x) for x in self.data[i]))
+
+    def multiply(self, q):
+        """
+        Row-wise Hamilton product self * q, with the same convention as Quaternion.multiply.
+        q may hold N quaternions or a single one applied to every row
+
+        :rtype: QuaternionArray
+        """
+        if not isinstance(q, QuaternionArray):
+            raise TypeError("QuaternionArray can only multiply QuaternionArray")
+        s1, a1, b1, c1 = self.data.T
+        s2, a2, b2, c2 = q.data.T
+        result = np.empty(np.broadcast_shapes(self.data.shape, q.data.shape))
+        # s = s1*s2 - v1.v2
+        result[:, 0] = s1 * s2 - a1 * a2 - b1 * b2 - c1 * c2
+        # v = s1 v2 + s2 v1 + v1 x v2
+        result[:, 1] = s1 * a2 + s2 * a1 + b1 * c2 - c1 * b2
+        result[:, 2] = s1 * b2 + s2 * b1 + c1 * a2 - a1 * c2
+        result[:, 3] = s1 * c2 + s2 * c1 + a1 * b2 - b1 * a2
+        return QuaternionArray(result)
+
+    def norm(self):
+        return np.sqrt((self.data * self.data).sum(axis=1))
+
+    def normalize(self):
+        """
+        Normalize, in place, every quaternion whose norm is greater than 0
+        :return: this array
+        :rtype: QuaternionArray
+        """
+        mag = self.norm()
+        # Set a threshold for mag, to avoid divided by 0
+        self.data /= np.where(mag > 1e-6, mag, 1.0)[:, None]
+        return self
+
+    def normalized(self):
+        return self.copy().normalize()
+
+    def conjugate(self):
+        result = self.data.copy()
+        result[:, 1:4] *= -1
+        return QuaternionArray(result)
+
+    def nlerp(self, q, t):
+        """
+        Normalized linear interpolation from self (t = 0) to q (t = 1) along the shorter arc
+
+        :param t: scalar or (N,) interpolation parameters
+        :rtype: QuaternionArray
+        """
+        t = np.asarray(t, dtype=np.float64).reshape(-1, 1)
+        sign = np.where((self.data * q.data).sum(axis=1, keepdims=True) < 0, -1.0, 1.0)
+        return QuaternionArray((1 - t) * self.data + t * sign * q.data).normalize()
+
+    def slerp(self, q, t):
+        """
+        Spherical linear interpolation from self (t = 0) to q (t = 1) along the shorter arc.
+        Rows that are almost parallel fall back to nlerp
+
+        :param t: scalar or (N,) interpolation parameters
+        :rtype: QuaternionArray
+        """
+        t = np.asarray(t, dtype=np.float64).reshape(-1, 1)
+        p0 = self.normalized().data
+        p1 = q.normalized().data
+        dot = (p0 * p1).sum(axis=1, keepdims=True)
+        p1 = np.where(dot < 0, -p1, p1)
+        dot = np.abs(dot)
+
+        theta = np.arccos(np.minimum(dot, 1.0))
+        sinTheta = np.sin(theta)
+        parallel = dot > 0.9995
+        safeSin = np.where(parallel, 1.0, sinTheta)
+        w0 = np.where(parallel, 1 - t, np.sin((1 - t) * theta) / safeSin)
+        w1 = np.where(parallel, t, np.sin(t * theta) / safeSin)
+        return QuaternionArray(w0 * p0 + w1 * p1).normalize()
+
+    def toMatrix(self):
+        """
+        turn every quaternion to Matrix form, the same matrices Quaternion.toMatrix gives
+        :return: (N, 4, 4) matrices
+        :rtype: numpy.ndarray
+        """
+        s, a, b, c = self.data.T
+        q_matrix = np.zeros((len(self.data), 4, 4), dtype=np.float64)
+        q_matrix[:, 0, 0] = 1 - 2 * b * b - 2 * c * c
+        q_matrix[:, 1, 0] = 2 * a * b + 2 * s * c
+        q_matrix[:, 2, 0] = 2 * a * c - 2 * s * b
+        q_matrix[:, 0, 1] = 2 * a * b - 2 * s * c
+        q_matrix[:, 1, 1] = 1 - 2 * a * a - 2 * c * c
+        q_matrix[:, 2, 1] = 2 * b * c + 2 * s * a
+        q_matrix[:, 0, 2] = 2 * a * c + 2 * s * b
+        q_matrix[:, 1, 2] = 2 * b * c - 2 * s * a
+        q_matrix[:, 2, 2] = 1 - 2 * a * a - 2 * b * b
+        q_matrix[:, 3, 3] = 1
+        return q_matrix
+
+
 if __name__ == "__main__":
     t1 = time.time()
     for _ in range(1000000):
@@ -131,3 +310,45 @@ if __name__ == "__main__":
     c = a.multiply(b).normalize()
     print(c.toMatrix())
     print("Cost time: ", t2 - t1)
+
+    # the same operations on 1M quaternions at once
+    n = 1000000
+    rng = np.random.default_rng(0)
+    qa = QuaternionArray(rng.normal(size=(n, 4))).normalize()
+    qb = QuaternionArray(rng.normal(size=(n, 4))).normalize()
+    scalarA = [qa.quaternion(i) for i in range(n)]
+    scalarB = [qb.quaternion(i) for i in range(n)]
+
+    def timed(f):
+        t1 = time.perf_counter()
+        result = f()
+        return time.perf_counter() - t1, result
+
+    print(f"{'1M operations':<16}{'Quaternion s':>14}{'QuaternionArray s':>20}{'speedup':>9}")
+    rows = [
+        ("construct", lambda: [Quaternion() for _ in range(n)], lambda: QuaternionArray.identity(n)),
+        ("multiply", lambda: [x.multiply(y) for x, y in zip(scalarA, scalarB)], lambda: qa.multiply(qb)),
+        ("normalize", lambda: [x.normalize() for x in scalarA], lambda: qa.normalize()),
+        ("toMatrix", lambda: [x.toMatrix() for x in scalarA], lambda: qa.toMatrix()),
+        ("slerp", None, lambda: qa.slerp(qb, 0.25)),
+    ]
+    for name, scalar, batched in rows:
+        batchedTime, _ = timed(batched)
+        if scalar is None:
+            # Quaternion has no slerp
+            print(f"{name:<16}{'-':>14}{batchedTime:>20.4f}{'-':>9}")
+            continue
+        scalarTime = timed(scalar)[0]
+        print(f"{name:<16}{scalarTime:>14.3f}{batchedTime:>20.4f}{scalarTime / batchedTime:>8.0f}x")
+
+    # batched results agree with the scalar class
+    i = 12345
+    product = scalarA[i].multiply(scalarB[i])
+    assert np.allclose(qa.multiply(qb).data[i], [product.s, *product.v])
+    assert np.allclose(qa.multiply(qb[0]).data[i], qa[i].multiply(qb[0]).data[0])
+    assert np.allclose(qa.toMatrix()[i], scalarA[i].toMatrix())
+    axes, angles = qa[0:10].toAxisAngle()
+    back = QuaternionArray.fromAxisAngle(axes, angles)
+    assert np.allclose(np.abs((back.data * qa.data[0:10]).sum(axis=1)), 1)
+    halfway = qa[0:10].slerp(qb[0:10], 0.5)
+    assert np.allclose(halfway.norm(), 1)
@@ -0,0 +1,235 @@
+"""
+Sort the draws of a frame to reduce state changes and overdraw.
+
+The traversal (Component.collectTransforms) emits one record per draw. RenderQueue.sort gives each record a 64-bit
+key and returns the order to submit them in:
+
+    bits 63-56  program
+    bits 55-44  texture
+    bits 43-24  mesh (the VAO drawn, shared by all SharedMesh of one geometry)
+    bits 23-0   view depth of the model origin, quantized between near and far
+
+so draws sharing a program, then a texture, then a mesh are consecutive, and GLState skips the repeated binds. Within
+one state the draws go front to back, letting early depth testing reject hidden fragments before shading. Each field
+holds the rank of the value among the values of the frame, not the GL name, so it always fits.
+
+The keys are sorted with an LSD radix sort over 16-bit digits, digits equal in every key are skipped.
+"""
+
+import os
+
+if __name__ == "__main__":
+    # the benchmark below renders without a window through EGL, PyOpenGL picks its platform when first imported
+    os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+    os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+
+import numpy as np
+
+from GLBuffer import Texture
+
+
+def radixArgsort(keys):
+    """
+    Stable argsort of unsigned 64-bit keys, one counting-sort pass per 16-bit digit that varies
+
+    :type keys: numpy.ndarray
+    :rtype: numpy.ndarray
+    """
+    order = np.arange(len(keys))
+    for shift in range(0, 64, 16):
+        digit = ((keys >> np.uint64(shift)) & np.uint64(0xFFFF)).astype(np.uint16)
+        if len(digit) == 0 or digit.min() == digit.max():
+            continue
+        # numpy sorts 16-bit integers stably with a radix sort
+        order = order[np.argsort(digit[order], kind="stable")]
+    return order
+
+
+class RenderQueue:
+    """
+    See module docstring
+    """
+    PROGRAM_BITS = 8
+    TEXTURE_BITS = 12
+    MESH_BITS = 20
+    DEPTH_BITS = 24
+
+    near = 0.01
+    far = 100
+
+    # draws and state changes of the last sort, see stateChanges
+    draws = 0
+    changes = 0
+
+    def __init__(self, near=0.01, far=100):
+        """
+        :param near: nearest depth told apart, closer draws share the first depth step
+        :param far: farthest depth told apart
+        """
+        self.near = near
+        self.far = far
+
+    @staticmethod
+    def rank(values, bits):
+        """
+        :return: rank of each value among the distinct values, clamped to bits
+        :rtype: numpy.ndarray
+        """
+        ranks = np.unique(values, return_inverse=True)[1].reshape(-1).astype(np.uint64)
+        return np.minimum(ranks, np.uint64((1 << bits) - 1))
+
+    def keys(self, records, viewMat):
+        """
+        :param records: (Displayable, 4x4 row-major model matrix, rgb color, Texture or None) per draw
+        :type records: list
+        :param viewMat: viewing matrix as given to the shader, i.e. column-major, see GLUtility.view
+        :type viewMat: numpy.ndarray
+        :return: 64-bit sort key of each record, see module docstring
+        :rtype: numpy.ndarray
+        """
+        count = len(records)
+        programs = np.fromiter((r[0].shaderProg.program for r in records), dtype=np.int64, count=count)
+        textures = np.fromiter((0 if r[3] is None else r[3].textureName for r in records), dtype=np.int64,
+                               count=count)
+        meshes = np.fromiter((id(getattr(r[0], "geometry", r[0])) for r in records), dtype=np.int64, count=count)
+        origins = np.array([r[1][:, 3] for r in records]).reshape(count, 4)
+        # the camera looks down -z
+        depths = -(origins @ np.asarray(viewMat)[:, 2])
+        steps = (1 << self.DEPTH_BITS) - 1
+        depths = np.clip((depths - self.near) / (self.far - self.near), 0, 1) * steps
+
+        keys = self.rank(programs, self.PROGRAM_BITS)
+        keys = (keys << np.uint64(self.TEXTURE_BITS)) | self.rank(textures, self.TEXTURE_BITS)
+        keys = (keys << np.uint64(self.MESH_BITS)) | self.rank(meshes, self.MESH_BITS)
+        return (keys << np.uint64(self.DEPTH_BITS)) | depths.astype(np.uint64)
+
+    def sort(self, records, viewMat):
+        """
+        :return: indices of records in drawing order
+        :rtype: numpy.ndarray
+        """
+        if not records:
+            self.draws = self.changes = 0
+            return np.zeros(0, dtype=np.int64)
+        keys = self.keys(records, viewMat)
+        order = radixArgsort(keys)
+        self.draws = len(records)
+        self.changes = self.stateChanges(keys[order])
+        return order
+
+    @classmethod
+    def stateChanges(cls, keys):
+        """
+        :param keys: keys in drawing order
+        :return: how many draws have another program, texture or mesh than the draw before, the first one included
+        :rtype: int
+        """
+        states = keys >> np.uint64(cls.DEPTH_BITS)
+        return int(np.count_nonzero(states[1:] != states[:-1])) + (len(keys) > 0)
+
+    @staticmethod
+    def drawUniforms(shaderProg, records, order=None):
+        """
+        Draw records the way Component.draw does, setting the model matrix and color as uniforms
+
+        :param order: indices of records to draw, all of them in order by default
+        """
+        textureLoc = shaderProg.getUniformLocation("textureImage")
+        for i in range(len(records)) if order is None else order:
+            displayObj, modelMat, color, texture = records[i]
+            shaderProg.setMat4("modelMat", modelMat.transpose())
+            shaderProg.setVec3("currentColor", color)
+            shaderProg.use()
+            if texture is not None:
+                texture.bind(textureLoc)
+            else:
+                Texture.unbind(textureLoc)
+            displayObj.draw()
+
+
+if __name__ == "__main__":
+    import time
+
+    import OpenGL.GL as gl
+
+    import ColorType
+    from Component import Component
+    from GLBuffer import TransformBuffer
+    from GLProgram import GLProgram
+    from GLState import glState
+    from GLUtility import GLUtility
+    from Offscreen import OffscreenContext
+    from Point import Point
+    from Shapes import Cone, Cube, Cylinder, Sphere
+
+    def best(f, rounds=5):
+        times = []
+        for _ in range(rounds):
+            t1 = time.perf_counter()
+            f()
+            times.append(time.perf_counter() - t1)
+        return min(times) * 1000
+
+    # sorting alone
+    rng = np.random.default_rng(0)
+    print(f"{'keys':>9}{'radix ms':>10}{'np.argsort ms':>15}")
+    for count in (1000, 10000, 100000):
+        keys = rng.integers(0, 4, count).astype(np.uint64) << np.uint64(56)
+        keys |= rng.integers(0, 1 << 20, count).astype(np.uint64) << np.uint64(24)
+        keys |= rng.integers(0, 1 << 24, count).astype(np.uint64)
+        assert (keys[radixArgsort(keys)] == np.sort(keys)).all()
+        print(f"{count:>9}{best(lambda: radixArgsort(keys)):>10.3f}{best(lambda: np.argsort(keys, kind='stable')):>15.3f}")
+
+    # headless 3.3 core context rendering into a framebuffer object
+    width = height = 400
+    context = OffscreenContext(width, height)
+    gl.glEnable(gl.GL_DEPTH_TEST)
+    print(gl.glGetString(gl.GL_RENDERER).decode(), f"{width}x{height}")
+
+    # a crowded scene of four meshes in random order, overlapping on screen
+    glutility = GLUtility()
+    program = GLProgram(transformBuffer=True)
+    program.compile()
+    program.setMat4("projectionMat", glutility.perspective(45, width, height, 0.01, 100))
+    buffer = TransformBuffer(program)
+    queue = RenderQueue(0.01, 100)
+    # low-poly meshes, so that shading the overlapping fragments is a large part of the frame
+    shapes = (lambda *args: Cone(*args, lowPoly=True), Cube, lambda *args: Cylinder(*args, lowPoly=True),
+              lambda *args: Sphere(*args, lowPoly=True))
+    query = int(gl.glGenQueries(1)[0])
+    print(f"{'draws':>7}{'order':>11}{'ms/frame':>10}{'sort ms':>9}{'VAO binds':>11}{'fragments':>11}")
+    for count in (1000, 4000):
+        root = Component(Point((0, 0, 0)))
+        for shape, position in zip(rng.integers(0, 4, count), rng.uniform(-1, 1, (count, 3))):
+            root.addChild(shapes[shape](Point(tuple(position)), program, [0.2, 0.2, 0.2],
+                                        ColorType.ColorType(*rng.uniform(0, 1, 3))))
+        root.initialize()
+        root.update(np.identity(4))
+        records = root.collectTransforms()
+        viewMat = glutility.view([0, 0, 3], [0, 0, 0], [0, 1, 0])
+        program.setMat4("viewMat", viewMat)
+        keys = queue.keys(records, viewMat)
+        orders = {"traversal": np.arange(count), "sorted": queue.sort(records, viewMat),
+                  "far first": radixArgsort(~keys & np.uint64((1 << RenderQueue.DEPTH_BITS) - 1))}
+        images = []
+        for name, order in orders.items():
+            def drawFrame():
+                gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+                buffer.drawBatch(records, order)
+                gl.glFinish()
+
+            drawFrame()
+            frameTime = best(drawFrame)
+            glState.resetCounters()
+            # fragments that passed the depth test, i.e. were shaded
+            gl.glBeginQuery(gl.GL_SAMPLES_PASSED, query)
+            drawFrame()
+            gl.glEndQuery(gl.GL_SAMPLES_PASSED)
+            fragments = gl.glGetQueryObjectuiv(query, gl.GL_QUERY_RESULT)
+            binds = glState.resetCounters()["bindVertexArray"][0]
+            sortTime = best(lambda: queue.sort(records, viewMat)) if name == "sorted" else 0
+            images.append(np.frombuffer(gl.glReadPixels(0, 0, width, height, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE),
+                                        np.uint8))
+            print(f"{count:>7}{name:>11}{frameTime:>10.2f}{sortTime:>9.2f}{binds:>11}{fragments:>11}")
+        # the order changes nothing but coplanar ties
+        assert np.count_nonzero(images[0] != images[1]) < 0.001 * images[0].size
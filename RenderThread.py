@@ -0,0 +1,216 @@
+"""
+Draw a canvas on its own thread, away from the wx event loop.
+
+In this mode the render thread owns the GL context and the scene: it makes the context current, runs the input
+handlers and draws. The wx thread only turns events into commands, see CanvasBase.dispatch, and pushes them into a
+deque. Appending to and popping from opposite ends of a deque are atomic, so neither side ever waits for a lock. The
+render thread drains the commands queued before each frame, then draws it; a slow frame therefore delays what is
+shown, but no longer the handling of the events behind it.
+
+Frames are paced by a FrameScheduler as in the default mode, its timer being the render thread sleeping until the
+frame is due. The scheduler is not thread-safe, so only the render thread touches it: request queues the frame
+requests in a deque of their own as well, and the render thread hands them to the scheduler when it wakes up.
+"""
+
+import collections
+import threading
+import traceback
+
+from FrameScheduler import FrameScheduler
+
+
+class RenderThread(threading.Thread):
+    """
+    See module docstring
+    """
+    commands = None  # deque of functions to run before the next frame
+    requests = None  # deque of (inputTime, redraw) of the requests not handed to the scheduler yet
+    scheduler = None  # only used on the render thread
+    redraw = False  # draw the next frame even if needsFrame says nothing changed, only used on the render thread
+    deadline = None  # scheduler.clock() when the scheduled frame is due, None without one
+    running = True
+
+    def __init__(self, fps, drawFrame, needsFrame):
+        """
+        :param fps: most frames per second
+        :type fps: float
+        :param drawFrame: draws one frame, e.g. CanvasBase.OnPaint
+        :type drawFrame: function
+        :param needsFrame: whether the picture changed, asked after running the commands of a frame nobody requested
+                           a redraw for, e.g. CanvasBase.needsFrame
+        :type needsFrame: function
+        """
+        super(RenderThread, self).__init__(name="RenderThread", daemon=True)
+        self.commands = collections.deque()
+        self.requests = collections.deque()
+        self.drawFrame = drawFrame
+        self.needsFrame = needsFrame
+        self.wakeup = threading.Event()
+        self.scheduler = FrameScheduler(fps, self.startTimer, self.runFrame)
+
+    def push(self, command):
+        """
+        Run command on the render thread before the next frame, call request to have one drawn
+        """
+        self.commands.append(command)
+
+    def request(self, inputTime=None, redraw=True):
+        """
+        Ask for a frame, from any thread
+
+        :param redraw: draw the frame even if the commands change nothing needsFrame sees
+        :see: FrameScheduler.request
+        """
+        self.requests.append((inputTime, redraw))
+        self.wakeup.set()
+
+    def startTimer(self, delay):
+        # called by the scheduler, hence on the render thread
+        self.deadline = self.scheduler.clock() + delay
+
+    def takeRequests(self):
+        # only the requests queued so far, the wakeup is set again for those appended meanwhile
+        for _ in range(len(self.requests)):
+            inputTime, redraw = self.requests.popleft()
+            if redraw:
+                self.redraw = True
+            self.scheduler.request(inputTime)
+
+    def stop(self):
+        """
+        Finish the frame being drawn and end the thread
+        """
+        self.running = False
+        self.wakeup.set()
+        if threading.current_thread() is not self:
+            self.join()
+
+    def run(self):
+        while True:
+            # sleep until the scheduled frame is due or a request arrives
+            timeout = None if self.deadline is None else max(0.0, self.deadline - self.scheduler.clock())
+            self.wakeup.wait(timeout)
+            self.wakeup.clear()
+            if not self.running:
+                return
+            self.takeRequests()
+            if self.deadline is not None and self.scheduler.clock() >= self.deadline:
+                self.deadline = None
+                self.scheduler.fire()
+
+    def runFrame(self):
+        # only the commands queued so far, those pushed meanwhile belong to the next frame
+        for _ in range(len(self.commands)):
+            command = self.commands.popleft()
+            try:
+                command()
+            except Exception:
+                # as wx does for a failing handler, report it and go on
+                traceback.print_exc()
+        if not self.redraw and not self.needsFrame():
+            return False
+        self.redraw = False
+        try:
+            self.drawFrame()
+        except Exception:
+            # a frame failing must not end the thread, later frames may draw again as in the wx mode
+            traceback.print_exc()
+
+
+if __name__ == "__main__":
+    import heapq
+    import time
+
+    class EventLoop:
+        """
+        The wx event loop in miniature: events and timers run one at a time on the calling thread, at their time
+        """
+
+        def __init__(self):
+            self.events = []
+            self.sequence = 0
+            self.lock = threading.Lock()
+
+        def at(self, t, callback):
+            with self.lock:
+                heapq.heappush(self.events, (t, self.sequence, callback))
+                self.sequence += 1
+
+        def run(self, until):
+            while True:
+                with self.lock:
+                    t = self.events[0][0] if self.events else until
+                now = time.perf_counter()
+                if now >= until:
+                    return
+                if t > now:
+                    time.sleep(min(t, until) - now)
+                    continue
+                with self.lock:
+                    t, _, callback = heapq.heappop(self.events)
+                callback(t)
+
+    def spin(seconds):
+        # CPU work holding the interpreter, e.g. Component.update and the draw calls
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            pass
+
+    def frame(cpu, wait):
+        spin(cpu)
+        # waiting for the GPU and SwapBuffers, the interpreter is free meanwhile
+        time.sleep(wait)
+
+    camera = [0.0]
+
+    def measure(threaded, seconds, inputRate, cpu, wait):
+        loop = EventLoop()
+        handling = []  # delay from each event to its handler running
+        start = time.perf_counter() + 0.05
+
+        if threaded:
+            renderer = RenderThread(60, lambda: frame(cpu, wait), lambda: False)
+            scheduler = renderer.scheduler
+            renderer.start()
+        else:
+            renderer = None
+            scheduler = FrameScheduler(60, lambda delay: loop.at(time.perf_counter() + delay,
+                                                                 lambda t: scheduler.fire()),
+                                       lambda: frame(cpu, wait))
+
+        def onInput(t):
+            # as CanvasBase.dispatch: turn the event into a command, run it at once or on the render thread
+            handling.append(time.perf_counter() - t)
+
+            def command():
+                camera[0] += 0.01
+
+            if renderer is not None:
+                renderer.push(command)
+                renderer.request(t)
+            else:
+                command()
+                scheduler.request(t)
+
+        for i in range(int(seconds * inputRate)):
+            loop.at(start + i / inputRate, onInput)
+        loop.run(start + seconds)
+        if renderer is not None:
+            renderer.stop()
+        handling.sort()
+        mean, p95, worst = scheduler.latency()
+        return (sum(handling) / len(handling), handling[int(0.95 * (len(handling) - 1))], mean, p95, worst,
+                scheduler.frames / seconds)
+
+    seconds = 3
+    inputRate = 200
+    print(f"inputs at {inputRate} Hz for {seconds} s, times in ms")
+    print(f"{'frame cpu+wait':>15}{'mode':>8}{'handler mean':>14}{'p95':>7}{'photon mean':>13}{'p95':>7}{'max':>7}"
+          f"{'fps':>6}")
+    for cpu, wait in ((0.002, 0.004), (0.008, 0.022), (0.010, 0.050)):
+        for threaded in (False, True):
+            result = measure(threaded, seconds, inputRate, cpu, wait)
+            handlerMean, handlerP95, photonMean, photonP95, photonMax, fps = result
+            print(f"{f'{cpu * 1000:.0f}+{wait * 1000:.0f}':>15}{'thread' if threaded else 'wx':>8}"
+                  f"{handlerMean * 1000:>14.2f}{handlerP95 * 1000:>7.2f}{photonMean * 1000:>13.1f}"
+                  f"{photonP95 * 1000:>7.1f}{photonMax * 1000:>7.1f}{fps:>6.0f}")
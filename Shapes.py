@@ -4,75 +4,86 @@ Implements four geometric primitives (Sphere, Cube, Cone, Cylinder) using the Di
 Modified by Daniel Scrivener 09/2023
 """
 
-from collada import *
-from DisplayableMesh import DisplayableMesh
+import threading
+
+from DisplayableMesh import SharedMesh
 from Component import Component
+from GeometryRegistry import registry
+import MeshCache
 import GLUtility
 import ColorType
 import numpy as np
 
 def getVertexData(filename):
+    """
+    Import a .dae mesh. Decoded arrays are served from the MeshCache sidecars when they are up to date,
+    otherwise the file is parsed by ColladaLoader (streaming reader, pycollada as fallback) and cached.
+
+    :param filename: .dae file to import
+    :type filename: string
+    :return: (vertices, indices), vertices is a flat float32 array with 11 floats per vertex, indices is int32
+    :rtype: tuple
+    """
+    return MeshCache.load(filename)
+
+class MeshAsset:
+    """
+    Geometry of one .dae file, loaded on first use and shared afterwards.
+    Nothing is read from disk until get() is called; concurrent first calls load the file only once.
+    """
+    pathname = None
+
+    def __init__(self, pathname):
+        """
+        :param pathname: .dae file to import
+        :type pathname: string
+        """
+        self.pathname = pathname
+        self._data = None
+        self._lock = threading.Lock()
 
-    colladaData = Collada(filename)
-
-    # generate vertices from model data
-    # also generate indices
-
-    geo = colladaData.geometries[0]
-    tridata = geo.primitives[0]
-    trilist = list(tridata)
-
-    # construct vertex list
-    vertices = np.array([])
-    
-    for vert in tridata.vertex:
-        vert = np.concatenate((vert, [0.,0.,0.]), axis=0) # empty normals
-        vert = np.concatenate((vert, [0.,0.,0.]), axis=0) # color
-        vert = np.concatenate((vert, [0.,0.]), axis=0) # empty UV
-        vertices = np.append(vertices, vert)
-
-    # construct indices
-    indices = np.array([])
-
-    for tri in trilist:
-        indices = np.append(indices, tri.indices)
+    def isLoaded(self):
+        return self._data is not None
 
-    return (vertices, indices)
+    def get(self):
+        """
+        :return: (vertices, indices) of this asset
+        :rtype: tuple
+        """
+        data = self._data
+        if data is None:
+            with self._lock:
+                if self._data is None:
+                    self._data = getVertexData(self.pathname)
+                data = self._data
+        return data
 
 class Shape(Component):
-    vertexData = None
-    indexData = None
-    mesh = None
+    __slots__ = ("mesh",)  # SharedMesh drawn by this shape
+    asset = None  # MeshAsset of the full mesh
+    assetLP = None  # MeshAsset of the low-poly mesh, registered as lod 1; None if the shape has none
 
-    def __init__(self, position, shaderProg, size, vertexData, indexData, color=ColorType.YELLOW):
+    def __init__(self, position, shaderProg, size, geometry, color=ColorType.YELLOW):
         """
         :param position: location of the object
         :type position: Point
         :param shaderProg: compiled shader program
         :type shaderProg: GLProgram
-        :param size: set of three size factors to be applied to each vertex
+        :param size: set of three size factors, applied through the model matrix
         :type size: list or tuple
-        :param pathname: .dae file to import
-        :type pathname: string
+        :param geometry: unit-size geometry shared by all instances of this asset
+        :type geometry: SharedGeometry
         :param color: vertex color to be applied uniformly
         :type color: ColorType
-        :param limb: sets the rotation behavior of the object. if true, rotations happen "at the joint" \
-            rather than the object's center
-        :type limb: boolean
         """
-        self.mesh = DisplayableMesh(shaderProg, size, vertexData, indexData, color)
+        self.mesh = SharedMesh(shaderProg, size, geometry, color)
         super(Shape, self).__init__(position, self.mesh)
 
 class Cone(Shape):
+    __slots__ = ()
 
-    pathname = "assets/cone0.dae"
-    pathnameLP = "assets/coneLP.dae"
-    data = getVertexData(pathname)
-    dataLP = getVertexData(pathnameLP)
-    vertices = data[0]
-    verticesLP = dataLP[0]
-    indices = data[1]
-    indicesLP = dataLP[1]
+    asset = MeshAsset("assets/cone0.dae")
+    assetLP = MeshAsset("assets/coneLP.dae")
 
     def __init__(self, position, shaderProg, size, color=ColorType.YELLOW, limb=True, lowPoly=False):
         """
@@ -85,10 +96,8 @@ class Cone(Shape):
         :param color: vertex color to be applied uniformly
         :type color: ColorType
         """
-        if lowPoly:
-            super(Cone, self).__init__(position, shaderProg, size, self.verticesLP.copy(), self.indicesLP.copy(), color)
-        else:
-            super(Cone, self).__init__(position, shaderProg, size, self.vertices.copy(), self.indices.copy(), color)
+        geometry = registry.get(self.assetLP, lod=1) if lowPoly else registry.get(self.asset)
+        super(Cone, self).__init__(position, shaderProg, size, geometry, color)
 
         # translate object by -z extent of the new component so that rotations occur @ the joint
         # rather than around the object's true center
@@ -103,11 +112,9 @@ class Cone(Shape):
         self.setPostRotation(tOut)
 
 class Cube(Shape):
+    __slots__ = ()
 
-    pathname = "assets/cube0.dae"
-    data = getVertexData(pathname)
-    vertices = data[0]
-    indices = data[1]
+    asset = MeshAsset("assets/cube0.dae")
 
     def __init__(self, position, shaderProg, size, color=ColorType.RED, limb=True):
         """
@@ -120,7 +127,7 @@ class Cube(Shape):
         :param color: vertex color to be applied uniformly
         :type color: ColorType
         """
-        super(Cube, self).__init__(position, shaderProg, size, self.vertices.copy(), self.indices.copy(), color)
+        super(Cube, self).__init__(position, shaderProg, size, registry.get(self.asset), color)
         # translate object by -z extent of the new component so that rotations occur @ the joint
         # rather than around the object's true center
         glutility = GLUtility.GLUtility()
@@ -134,15 +141,10 @@ class Cube(Shape):
         self.setPostRotation(tOut)
 
 class Cylinder(Shape):
+    __slots__ = ()
 
-    pathname = "assets/cylinder0.dae"
-    pathnameLP = "assets/cylinderLP.dae"
-    data = getVertexData(pathname)
-    dataLP = getVertexData(pathnameLP)
-    vertices = data[0]
-    verticesLP = dataLP[0]
-    indices = data[1]
-    indicesLP = dataLP[1]
+    asset = MeshAsset("assets/cylinder0.dae")
+    assetLP = MeshAsset("assets/cylinderLP.dae")
 
     def __init__(self, position, shaderProg, size, color=ColorType.GREEN, limb=True, lowPoly=False):
         """
@@ -155,10 +157,8 @@ class Cylinder(Shape):
         :param color: vertex color to be applied uniformly
         :type color: ColorType
         """
-        if lowPoly:
-            super(Cylinder, self).__init__(position, shaderProg, size, self.verticesLP.copy(), self.indicesLP.copy(), color)
-        else:
-            super(Cylinder, self).__init__(position, shaderProg, size, self.vertices.copy(), self.indices.copy(), color)
+        geometry = registry.get(self.assetLP, lod=1) if lowPoly else registry.get(self.asset)
+        super(Cylinder, self).__init__(position, shaderProg, size, geometry, color)
         # translate object by -z extent of the new component so that rotations occur @ the joint
         # rather than around the object's true center
         glutility = GLUtility.GLUtility()
@@ -172,15 +172,10 @@ class Cylinder(Shape):
         self.setPostRotation(tOut)
 
 class Sphere(Shape):
+    __slots__ = ()
 
-    pathname = "assets/sphere0.dae"
-    pathnameLP = "assets/sphereLP.dae"
-    data = getVertexData(pathname)
-    dataLP = getVertexData(pathnameLP)
-    vertices = data[0]
-    verticesLP = dataLP[0]
-    indices = data[1]
-    indicesLP = dataLP[1]
+    asset = MeshAsset("assets/sphere0.dae")
+    assetLP = MeshAsset("assets/sphereLP.dae")
 
     def __init__(self, position, shaderProg, size, color=ColorType.BLUE, limb=True, lowPoly=False):
         """
@@ -197,10 +192,8 @@ class Sphere(Shape):
             Set this to False for eyes or other ball joints.
         :type limb: boolean
         """
-        if lowPoly:
-            super(Sphere, self).__init__(position, shaderProg, size, self.verticesLP.copy(), self.indicesLP.copy(), color)
-        else:
-            super(Sphere, self).__init__(position, shaderProg, size, self.vertices.copy(), self.indices.copy(), color)
+        geometry = registry.get(self.assetLP, lod=1) if lowPoly else registry.get(self.asset)
+        super(Sphere, self).__init__(position, shaderProg, size, geometry, color)
         # translate object by -z extent of the new component so that rotations occur @ the joint
         # rather than around the object's true center   
         glutility = GLUtility.GLUtility()
@@ -212,3 +205,29 @@ class Sphere(Shape):
             tOut = np.identity(4)
         self.setPreRotation(tIn)
         self.setPostRotation(tOut)
+
+
+if __name__ == "__main__":
+    # import-time budget: importing Shapes (and the models built on it) must not touch any asset
+    import importlib
+    import sys
+    import time
+
+    opened = []
+
+    def auditOpen(event, args):
+        if event == "open" and isinstance(args[0], str):
+            opened.append(args[0])
+
+    sys.addaudithook(auditOpen)
+    t1 = time.perf_counter()
+    for name in ("Shapes", "ModelAxes", "ModelLinkage"):
+        importlib.import_module(name)
+    t2 = time.perf_counter()
+
+    assetIO = [path for path in opened if path.endswith((".dae", ".npy"))]
+    assert not assetIO, f"import did file I/O on assets: {assetIO}"
+    shapes = sys.modules["Shapes"]
+    for shapeClass in (shapes.Cone, shapes.Cube, shapes.Cylinder, shapes.Sphere):
+        assert not shapeClass.asset.isLoaded(), shapeClass.__name__
+    print(f"import Shapes, ModelAxes, ModelLinkage: {(t2 - t1) * 1000:.1f} ms, no asset I/O")
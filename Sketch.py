@@ -26,13 +26,22 @@ Added cycling through poses and added 5 poses
 import math
 
 import numpy as np
-from ModelAxes import ModelAxes
 from ModelLinkage import ModelLinkage
 
 import ColorType
 from Point import Point
 from CanvasBase import CanvasBase
 from GLProgram import GLProgram
+from GLState import glState
+from GeometryRegistry import registry
+from GLBuffer import MeshArena, TransformBuffer
+from FlatScene import FlatScene
+from StaticBake import bakeStatic, dropBakes
+from RenderQueue import RenderQueue
+from Bounds import Frustum
+from Picking import PickTree
+from FramePipeline import FramePipeline
+from Animation import Clip, Animation, Timeline
 from Quaternion import Quaternion
 import GLUtility
 
@@ -104,6 +113,7 @@ class Sketch(CanvasBase):
     last_mouse_leftPosition = None
     last_mouse_middlePosition = None
     components = None
+    model = None  # ModelLinkage
 
     texture = None
     shaderProg = None
@@ -120,6 +130,56 @@ class Sketch(CanvasBase):
     viewMat = None
     perspMat = None
 
+    # draw the whole scene from one GLBuffer.MeshArena instead of one VAO and draw call per component
+    useMeshArena = False
+    meshArena = None
+
+    # read the model matrix and color of each draw from one GLBuffer.TransformBuffer uploaded per frame, instead of
+    # setting them as uniforms per component. Ignored with useMeshArena
+    useTransformBuffer = True
+    transformBuffer = None
+
+    # draw in the order of RenderQueue: grouped by program, texture and mesh, then front to back.
+    # Ignored with useMeshArena
+    useRenderQueue = True
+    renderQueue = None
+
+    # (local, world) matrices rebuilt for the last frame, see Component.update
+    updateCounters = (0, 0)
+
+    # PickTree of the current transforms, built at the first click after they change, see pickComponent
+    pickTree = None
+    limbNames = None  # id of each component of cDict -> its name
+
+    # skip the subtrees whose bounds are outside the view frustum, see Component.cull
+    useFrustumCulling = True
+    # (drawn, culled) meshes of the last frame
+    cullCounters = (0, 0)
+
+    # GL call -> (issued, skipped as redundant) for the last frame, see GLState
+    glCounters = None
+    # (requested, achieved) frames per second over the last second, see FrameScheduler.rates
+    frameRates = (0, 0)
+    # (mean, 95th percentile, max) seconds from an input to the frame showing it, see FrameScheduler.latency.
+    # Compare with useRenderThread set
+    inputLatency = None
+
+    # keep the transforms of the whole model in FlatScene arrays instead of one Component at a time
+    useFlatScene = False
+
+    # draw subtrees that can never move (e.g. the axes) as one merged mesh per color, see StaticBake
+    useStaticBake = True
+
+    # evaluate the animation and transforms of the next frame on a worker while this one is drawn, see FramePipeline.
+    # Needs useTransformBuffer, ignored with useMeshArena
+    usePipeline = False
+    framePipeline = None
+
+    # plays the poses one after another, "p" to play or pause, "[" and "]" to scrub
+    timeline = None
+    poseInterval = ModelLinkage.poseInterval  # seconds from one pose to the next
+    scrubStep = 0.1  # seconds
+
     # Changed this to default to 0 so that we can keep conccurent axis across multi select
     select_axis_index = 0  # index of selected axis
     select_color = [ColorType.ColorType(1, 0, 0), ColorType.ColorType(0, 1, 0), ColorType.ColorType(0, 0, 1)]
@@ -131,21 +191,8 @@ class Sketch(CanvasBase):
 
     # The number of the current pose
     pose_num = -1 
-    # List of angles to set every limb to for each pose
-    # Poses:
-    # Waving left hand
-    # Grabbing in front
-    # Jumping
-    # Both down
-    # up down down
-    poses = [
-        # BODY        ARM1         BACKARM1     FOREARM1    TOPPIN1    BOTPIN1     ARM2       BACKARM2      FOREARM2    TOPPIN2     BOTPIN2      Stalk1         Eye1          Stalk2        Eye2      Fleg1       SLeg1      Tleg1       ffoot1       sfoot1      tfoot1      Fleg2        Sleg2        Tleg2        ffoot2      sfoot2         tfoot2
-        [[0, 0, 0], [-30, 0, 0], [-15, 0, 0], [-15, 0, 0], [0, 0, 0], [0, 0, 0], [-30, 0, 0], [-15, 0, 0], [-15, 0, 0], [0, 0, 0],  [0, 0, 0], [30, 30, 30],   [0, 0, 0], [-30, -30, -30],[0, 0, 0], [30, 0, 0], [30, 0, 0], [30, 0, 0], [30, 0, 0],  [30, 0, 0], [30, 0, 0], [-30, 0, 0], [-30, 0, 0], [-30, 0, 0], [-30, 0 ,0], [-30, 0, 0], [-30, 0, 0]],
-        [[0, 0, 0], [0, 45, 0], [0, 15, 0], [0, 15, 0], [15, 0, 0], [-15, 0, 0], [0, -45, 0], [0, -15, 0], [0, -15, 0], [-15, 0, 0],[15, 0, 0], [0, 0, 0],     [0, 0, 0], [0, 0, 0],      [0, 0, 0], [30, 0 ,0], [30, 0, 0], [30, 0, 0], [30, 0, 0],  [30, 0, 0], [30, 0, 0], [-30, 0, 0], [-30, 0, 0], [-30, 0, 0], [-30, 0, 0], [-30, 0, 0], [-30, 0, 0]],
-        [[0, 0, 0], [-30, 0, 0], [-15, 0, 0], [-15, 0, 0], [0, 0, 0], [0, 0, 0], [30, 0, 0],  [15, 0, 0],  [15, 0, 0],  [0, 0, 0],  [0, 0, 0], [-30, -30, -30], [0, 0, 0], [30, 30, 30],  [0, 0, 0], [0, 0, 0],  [0, 0, 0],  [0, 0, 0],  [30, 0, 0],  [30, 0, 0], [30, 0, 0], [0, 0, 0],   [0, 0, 0],   [0, 0, 0],   [-30, 0, 0], [-30, 0, 0], [-30, 0, 0]],
-        [[0, 0, 0], [30, 0, 0], [15, 0, 0], [15, 0, 0], [7, 0, 0], [-7, 0, 0], [-30, 0, 0], [-15, 0, 0], [-15, 0, 0],   [-7, 0, 0], [7, 0, 0], [30, 0, 30],     [0, 0, 0], [-30, 0, -30], [0, 0, 0], [30, 0, 0], [30, 0, 0], [30, 0, 0], [30, 0, 0],  [30, 0, 0], [30, 0, 0], [-30, 0, 0], [-30, 0, 0], [-30, 0, 0], [-30, 0, 0], [-30, 0, 0], [-30, 0, 0]],
-        [[0, 0, 0], [-30, 0, 0], [15, 0, 0], [15, 0, 0], [15, 0, 0], [-15, 0, 0], [30, 0, 0], [-15, 0, 0], [-15, 0, 0], [-15, 0, 0],[15, 0, 0], [0, -30, 0],    [0, 0, 0], [0, 30, 0],    [0, 0, 0], [30, 0, 0], [30, 0, 0], [30, 0, 0], [-30, 0, 0], [-30, 0, 0],[-30, 0, 0], [-30, 0 ,0],[-30, 0 ,0], [-30, 0 ,0], [30, 0, 0], [30, 0, 0],   [30, 0, 0]],
-    ]
+    # List of angles to set every limb to for each pose, see ModelLinkage.poses
+    poses = ModelLinkage.poses
 
     # If you are having trouble rotating the camera, try increasing this parameter
     # (Windows users with trackpads may need this)
@@ -167,6 +214,8 @@ class Sketch(CanvasBase):
         self.resetView()
 
         self.glutility = GLUtility.GLUtility()
+        # ticked in OnPaint, frames keep coming while it plays, see needsFrame
+        self.timeline = Timeline()
 
     def resetView(self):
         self.lookAtPt = [0, 0, 0]
@@ -182,8 +231,13 @@ class Sketch(CanvasBase):
         You must set your model here (and not in __init__)
         due to the fact that the shader is only compiled once we reach this function.
         """
-        self.shaderProg = GLProgram()
+        # nothing is known about the state of a new context
+        glState.reset()
+        self.shaderProg = GLProgram(instanced=self.useMeshArena, transformBuffer=self.useTransformBuffer)
         self.shaderProg.compile()
+        # shared meshes uploaded into a previous context have to be uploaded again, baked ones are merged anew
+        registry.invalidateGPU()
+        dropBakes(self.topLevelComponent)
 
         ##### TODO 3: Initialize your model
         # You should initialize your model here.
@@ -191,18 +245,35 @@ class Sketch(CanvasBase):
         # and self.components should refer to your model's components.
         # Optionally, you can create a dictionary (self.cDict) to index your model's components by name.
 
-        model = ModelLinkage(self, Point((0, 0, 0)), self.shaderProg)
-
-        
-        axes = ModelAxes(self, Point((-1, -1, -1)), self.shaderProg)
-
-        self.topLevelComponent.clear()
-        self.topLevelComponent.addChild(model)
-        self.topLevelComponent.addChild(axes)
-        self.topLevelComponent.initialize()
-
+        model = ModelLinkage.buildScene(self, self.topLevelComponent, self.shaderProg)
+        if self.useFlatScene:
+            FlatScene(self.topLevelComponent)
+        if self.useMeshArena:
+            # meshes are copied into the arena when first drawn, no per-component buffers are needed
+            self.meshArena = MeshArena(self.shaderProg)
+            self.topLevelComponent.update()
+        else:
+            self.meshArena = None
+            self.topLevelComponent.initialize()
+        self.transformBuffer = TransformBuffer(self.shaderProg) if self.shaderProg.transformBuffer else None
+        self.renderQueue = RenderQueue(0.01, 100) if self.useRenderQueue else None
+        if self.useStaticBake:
+            bakeStatic(self.topLevelComponent)
+
+        self.model = model
         self.components = model.componentList
         self.cDict = model.componentDict
+        self.limbNames = {id(c): name for name, c in self.cDict.items()}
+        self.pickTree = None
+        self.timeline.clear()
+        self.timeline.add(Animation(Clip.fromPoses(self.poses, self.poseInterval), model.componentList))
+        if self.usePipeline and self.transformBuffer is not None and self.meshArena is None:
+            if self.framePipeline is None:
+                self.framePipeline = FramePipeline(self.prepareFrame)
+            self.framePipeline.reset()
+        elif self.framePipeline is not None:
+            self.framePipeline.stop()
+            self.framePipeline = None
 
         gl.glClearColor(*self.backgroundColor, 1.0)
         gl.glClearDepth(1.0)
@@ -218,26 +289,14 @@ class Sketch(CanvasBase):
         self.shaderProg.setMat4("modelMat", np.identity(4))
 
     def getCameraPos(self):
-        ct = math.cos(self.cameraTheta)
-        st = math.sin(self.cameraTheta)
-        cp = math.cos(self.cameraPhi)
-        sp = math.sin(self.cameraPhi)
-        result = [self.lookAtPt[0] + self.cameraDis * ct * cp,
-                  self.lookAtPt[1] + self.cameraDis * sp,
-                  self.lookAtPt[2] + self.cameraDis * st * cp]
-        return result
+        return self.glutility.orbit(self.lookAtPt, self.cameraDis, self.cameraTheta, self.cameraPhi)
 
     def OnResize(self, event):
         contextAttrib = glcanvas.GLContextAttrs()
         contextAttrib.PlatformDefaults().CoreProfile().MajorVersion(3).MinorVersion(3).EndList()
-        self.context = glcanvas.GLContext(self, ctxAttrs=contextAttrib)
-        self.size = self.GetClientSize()
-        self.size[1] = max(1, self.size[1])  # avoid divided by 0
-        self.SetCurrent(self.context)
-
-        self.init = False
-        self.Refresh(eraseBackground=True)
-        self.Update()
+        context = glcanvas.GLContext(self, ctxAttrs=contextAttrib)
+        size = self.GetClientSize()
+        self.dispatch(lambda: self.resize(context, size))
 
     def OnPaint(self, event=None):
         """
@@ -248,21 +307,80 @@ class Sketch(CanvasBase):
             # Init the OpenGL environment if not initialized
             self.InitGL()
             self.init = True
+        if self.framePipeline is None:
+            # the pipeline ticks it with the rest of the next frame
+            self.timeline.tick()
         # the draw method
         self.OnDraw()
+        if self.needsFrame():
+            self.requestFrame()
+
+    def needsFrame(self):
+        # a playing animation asks for the next frame as soon as one is drawn
+        if self.framePipeline is not None and self.framePipeline.needsFrame():
+            # the frame prepared during the last one is still to be shown
+            return True
+        return self.timeline.playing or super(Sketch, self).needsFrame()
+
+    def prepareFrame(self, state):
+        """
+        Evaluate the next frame into a FramePipeline state: animation, transforms, culling and drawing order.
+        Runs on the pipeline's worker, so no GL calls here
+        """
+        self.timeline.tick()
+        state.viewMat = self.glutility.view(self.getCameraPos(), self.lookAtPt, self.upVector)
+        self.topLevelComponent.update(np.identity(4))
+        state.counters["update"] = self.topLevelComponent.resetUpdateCounters()
+        frustum = Frustum(self.perspMat, state.viewMat) if self.useFrustumCulling else None
+        state.records = self.topLevelComponent.collectTransforms(frustum=frustum)
+        state.order = self.renderQueue.sort(state.records, state.viewMat) if self.renderQueue is not None else None
+        state.counters["cull"] = self.topLevelComponent.resetCullCounters()
 
     def OnDraw(self):
         gl.glClearColor(*self.backgroundColor, 1.0)
         gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
 
-        # These are per-frame updates to the shader. Update the viewing matrix
-        self.viewMat = self.glutility.view(self.getCameraPos(), self.lookAtPt, self.upVector)
-        self.shaderProg.setMat4("viewMat", self.viewMat)
-
-        self.topLevelComponent.update(np.identity(4))
-        self.topLevelComponent.draw(self.shaderProg)
+        if self.framePipeline is not None:
+            state = self.framePipeline.begin()
+            # the camera this frame was culled and sorted with
+            self.viewMat = state.viewMat
+            self.shaderProg.setMat4("viewMat", self.viewMat)
+            self.transformBuffer.drawBatch(state.records, state.order, state.rows)
+            self.updateCounters = state.counters["update"]
+            self.cullCounters = state.counters["cull"]
+        else:
+            # These are per-frame updates to the shader. Update the viewing matrix
+            self.viewMat = self.glutility.view(self.getCameraPos(), self.lookAtPt, self.upVector)
+            self.shaderProg.setMat4("viewMat", self.viewMat)
+
+            self.topLevelComponent.update(np.identity(4))
+            self.updateCounters = self.topLevelComponent.resetUpdateCounters()
+            if self.updateCounters[1] > 0:
+                self.pickTree = None
+            frustum = Frustum(self.perspMat, self.viewMat) if self.useFrustumCulling else None
+            if self.meshArena is not None:
+                self.meshArena.drawBatch(self.topLevelComponent.collectDraws(self.meshArena, frustum=frustum))
+            elif self.transformBuffer is None and self.renderQueue is None:
+                self.topLevelComponent.draw(self.shaderProg, frustum)
+            else:
+                records = self.topLevelComponent.collectTransforms(frustum=frustum)
+                order = self.renderQueue.sort(records, self.viewMat) if self.renderQueue is not None else None
+                if self.transformBuffer is not None:
+                    self.transformBuffer.drawBatch(records, order)
+                else:
+                    RenderQueue.drawUniforms(self.shaderProg, records, order)
+            self.cullCounters = self.topLevelComponent.resetCullCounters()
+        self.glCounters = glState.resetCounters()
+        self.frameRates = self.frameScheduler.rates()
+        self.inputLatency = self.frameScheduler.latency()
 
         self.SwapBuffers()
+        if self.framePipeline is not None:
+            # waiting for the swap overlapped with the next frame too
+            self.framePipeline.end()
+            # the components now hold the transforms of the frame just prepared
+            if self.framePipeline.front.counters["update"][1] > 0:
+                self.pickTree = None
 
     def OnDestroy(self, event):
         """
@@ -271,6 +389,11 @@ class Sketch(CanvasBase):
         :param event: Window destroy event
         :return: None
         """
+        # the render thread may be drawing with the pipeline and the program, end it before releasing them
+        if self.renderThread is not None:
+            self.renderThread.stop()
+        if self.framePipeline is not None:
+            self.framePipeline.stop()
         if self.shaderProg is not None:
             del self.shaderProg
         super(Sketch, self).OnDestroy(event)
@@ -331,6 +454,48 @@ class Sketch(CanvasBase):
         self.last_mouse_leftPosition[0] = x
         self.last_mouse_leftPosition[1] = y
 
+        if self.dragging_event:
+            # the release that ends orbiting the camera is not a click
+            return
+        # clicking a limb selects or deselects it, as its key does
+        picked = self.pickComponent(x, y)
+        while picked is not None and id(picked) not in self.limbNames:
+            picked = picked.parent
+        if picked is not None:
+            self.toggleLimb(self.limbNames[id(picked)])
+
+    def pickComponent(self, x, y):
+        """
+        Find the component drawn under a canvas point, see Picking
+
+        :return: the nearest component whose mesh the ray through x, y hits, None if there is none
+        :rtype: Component
+        """
+        near = self._unproject(x, y, 0.0)
+        far = self._unproject(x, y, 1.0)
+        if self.pickTree is None:
+            self.pickTree = PickTree(self.topLevelComponent)
+        component, _ = self.pickTree.pick(near, far - near)
+        return component
+
+    def toggleLimb(self, limb_name):
+        """
+        Select the limb if it is not selected, deselect it otherwise
+
+        :param limb_name: key of the limb in self.cDict
+        :type limb_name: str
+        """
+        # Get the index in components from our limb name
+        c_index = self.components.index(self.cDict[limb_name])
+        # If it's selected and its not active, put it in active and color it, otherwise remove it and reset it
+        if limb_name not in self.active:
+            self.active.append(limb_name)
+            self.components[c_index].setCurrentColor(self.select_color[self.select_axis_index])
+        else:
+            self.active.remove(limb_name)
+            self.components[c_index].reset("color")
+        self.update()
+
     def Interrupt_MouseMiddleDragging(self, x, y):
         """
         When mouse drag motion with middle key detected, interrupt with new mouse position
@@ -422,16 +587,7 @@ class Sketch(CanvasBase):
             # Get the limb name from what keycode was pressed
             key_index = limbs.index(chr(keycode))
             limb_name = dict_keys[key_index]
-            # Get the index in components from our limb name
-            c_index = self.components.index(self.cDict[limb_name])
-            # If it's selected and its not active, put it in active and color it, otherwise remove it and reset it
-            if limb_name not in self.active:
-                self.active.append(limb_name)
-                self.components[c_index].setCurrentColor(self.select_color[self.select_axis_index])
-            else:
-                self.active.remove(limb_name)
-                self.components[c_index].reset("color")
-            self.update()
+            self.toggleLimb(limb_name)
 
         if keycode in [wx.WXK_LEFT]:
             # Last rotation axis
@@ -460,9 +616,7 @@ class Sketch(CanvasBase):
                 c_index = self.components.index(self.cDict[limb])
                 # Got rid of wheel rotation and just added it to be mirror
                 # Just got rid of intterupt scroll and put it here, needlessly compelx to change it to fit multi select
-                self.components[c_index].rotate(mirror * self.MOUSE_SCROLL_SPEED,
-                                                        self.components[c_index].
-                                                        axisBucket[self.select_axis_index])
+                self.components[c_index].rotate(mirror * self.MOUSE_SCROLL_SPEED, self.select_axis_index % 3)
             self.update()
         if keycode in [wx.WXK_DOWN]:
             for limb in self.active:
@@ -473,9 +627,7 @@ class Sketch(CanvasBase):
                 c_index = self.components.index(self.cDict[limb])
                 # Got rid of wheel rotation and just added it to be mirror
                 # Just got rid of intterupt scroll and put it here, needlessly compelx to change it to fit multi select
-                self.components[c_index].rotate(mirror * self.MOUSE_SCROLL_SPEED,
-                                                        self.components[c_index].
-                                                        axisBucket[self.select_axis_index])
+                self.components[c_index].rotate(mirror * self.MOUSE_SCROLL_SPEED, self.select_axis_index % 3)
             self.update()
         if keycode in [wx.WXK_ESCAPE]:
             # exit component editing mode
@@ -496,16 +648,21 @@ class Sketch(CanvasBase):
             self.select_obj_index = -1
             self.select_axis_index = -1
             self.pose_num = -1
+            self.timeline.stop()
             self.update()
         # cycle through poses
         if chr(keycode) in "t":
+            self.timeline.pause()
             self.pose_num = (self.pose_num + 1) % 5
-            for c_index in range(0, len(self.components)):
-                c = self.components[c_index]
-                c.setCurrentAngle(self.poses[self.pose_num][c_index][0], c.axisBucket[0])
-                c.setCurrentAngle(self.poses[self.pose_num][c_index][1], c.axisBucket[1])
-                c.setCurrentAngle(self.poses[self.pose_num][c_index][2], c.axisBucket[2])
+            self.model.applyPose(self.poses[self.pose_num])
             self.update()
+        # play the poses as an animation
+        if chr(keycode) in "p":
+            self.timeline.toggle()
+        if chr(keycode) in "[":
+            self.timeline.seek(self.timeline.time - self.scrubStep)
+        if chr(keycode) in "]":
+            self.timeline.seek(self.timeline.time + self.scrubStep)
             
 
 
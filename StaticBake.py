@@ -0,0 +1,349 @@
+"""
+Merge subtrees of components that can never move into one mesh each.
+
+A component is static when every rotation extent is pinned to its current angle and no quaternion overrides them
+(see Component.isStatic). bakeStatic finds the largest subtrees made only of static components with CPU-side
+geometry and replaces each of them with a StaticBake: the meshes of the subtree are transformed once into the space
+of the subtree's parent and concatenated, one DisplayableMesh per color since the shaders take the color per draw.
+The subtree is then skipped by Component.update and drawn with the parent's transformation.
+
+Any later change inside the subtree (angles, extents, position, scaling, axes, color, children) goes through
+Component.invalidateBake, which drops the bake; the components are updated and drawn one by one again until
+bakeStatic is called once more.
+"""
+
+import numpy as np
+
+from Bounds import Frustum, transformBox, unionBoxes
+from ColorType import ColorType
+from Component import Component
+from DisplayableMesh import DisplayableMesh
+from ColladaLoader import VERTEX_STRIDE
+from GLBuffer import Texture
+
+
+def isMergeable(component):
+    """
+    Whether component can be part of a StaticBake: static, untextured, and drawing nothing or a mesh whose vertices
+    are on the CPU
+    """
+    if not component.isStatic() or component.textureOn:
+        return False
+    displayObj = component.displayObj
+    return displayObj is None or getattr(displayObj, "vertices", None) is not None
+
+
+def transformVertices(vertices, transformation):
+    """
+    :param vertices: (N, 11) vertices, see ColladaLoader
+    :type vertices: numpy.ndarray
+    :param transformation: 4x4 row-major affine transformation
+    :type transformation: numpy.ndarray
+    :return: (N, 11) float32 copy with transformed positions and normals
+    :rtype: numpy.ndarray
+    """
+    result = np.array(vertices, dtype=np.float32).reshape(-1, VERTEX_STRIDE)
+    linear = transformation[0:3, 0:3]
+    result[:, 0:3] = result[:, 0:3] @ linear.T + transformation[0:3, 3]
+    normals = result[:, 3:6] @ np.linalg.inv(linear)
+    length = np.linalg.norm(normals, axis=1, keepdims=True)
+    result[:, 3:6] = np.divide(normals, length, out=np.zeros_like(normals), where=length > 0)
+    return result
+
+
+class StaticBake:
+    """
+    Merged geometry of one static subtree, see module docstring
+    """
+    root = None  # Component drawn through this bake, together with its subtree
+    components = None  # list<Component> of the subtree, root first
+    meshes = None  # list of (DisplayableMesh, rgb color), vertices in the space of root.parent
+    aabb = None  # box around the meshes in the space of root.parent, see Bounds
+    reach = 0.0  # radius around the origin of root.parent holding the meshes, see Component.subtreeReach
+    valid = True
+
+    # bakes dropped since the last resetCounters
+    invalidations = 0
+
+    def __init__(self, root):
+        """
+        Merge root and its subtree, whose local matrices must be up to date (call update first).
+        Bakes already inside the subtree are dropped
+
+        :type root: Component
+        """
+        if not isinstance(root, Component):
+            raise TypeError("root should have type Component")
+        if root.parent is None:
+            raise Exception("the root of a tree has no parent space to be baked into")
+        self.root = root
+        self.components = []
+
+        groups = {}  # color -> (shaderProg, vertex arrays, index arrays, vertices so far)
+        stack = [(root, root.localMat)]
+        while stack:
+            c, transformation = stack.pop()
+            if c.bake is not None:
+                c.bake.invalidate()
+            self.components.append(c)
+            displayObj = c.displayObj
+            if displayObj is not None:
+                sizeMat = displayObj.sizeMat if displayObj.sizeMat is not None else np.identity(4)
+                color = tuple(float(x) for x in c.current_color)
+                shaderProg, vertexList, indexList, vertexCount = groups.get(color, (displayObj.shaderProg, [], [], 0))
+                vertices = transformVertices(displayObj.vertices, transformation @ sizeMat)
+                vertexList.append(vertices)
+                indexList.append(np.asarray(displayObj.indices).reshape(-1) + vertexCount)
+                groups[color] = (shaderProg, vertexList, indexList, vertexCount + len(vertices))
+            for child in reversed(c.children):
+                stack.append((child, transformation @ child.localMat))
+
+        self.meshes = []
+        for color, (shaderProg, vertexList, indexList, _) in groups.items():
+            mesh = DisplayableMesh(shaderProg, [1, 1, 1], np.concatenate(vertexList),
+                                   np.concatenate(indexList).astype(np.uint32), ColorType(*color))
+            self.meshes.append((mesh, np.array(color)))
+        self.aabb = unionBoxes([mesh.aabb for mesh, _ in self.meshes]) if self.meshes else None
+        self.reach = max((float(np.linalg.norm(mesh.vertexFields["position"], axis=1).max())
+                          for mesh, _ in self.meshes), default=0.0)
+        for c in self.components:
+            c.bakedIn = self
+        root.bake = self
+
+    @staticmethod
+    def resetCounters():
+        invalidations = StaticBake.invalidations
+        StaticBake.invalidations = 0
+        return invalidations
+
+    def invalidate(self):
+        """
+        Give the subtree back to the regular update and draw
+        """
+        if not self.valid:
+            return
+        self.valid = False
+        StaticBake.invalidations += 1
+        for c in self.components:
+            c.bakedIn = None
+        for mesh, _ in self.meshes:
+            mesh.freeAllocations()
+        root = self.root
+        root.bake = None
+        # the subtree's world matrices were not kept up to date while it was baked
+        root.worldDirty = True
+        if root.parent is not None:
+            root.parent.markChildDirty()
+            # the reach of the parent only held the subtree in its baked pose
+            root.parent.markReachDirty()
+
+    def draw(self, shaderProg, parentMat):
+        """
+        Draw the merged meshes, the way Component.draw draws one component
+
+        :param parentMat: transformation of root.parent
+        :type parentMat: numpy.ndarray
+        """
+        Component.drawnMeshes += len(self.meshes)
+        for mesh, color in self.meshes:
+            if mesh.vao is None:
+                mesh.initialize()
+            shaderProg.setMat4("modelMat", parentMat.transpose())
+            shaderProg.setVec3("currentColor", color)
+            shaderProg.use()
+            Texture.unbind(shaderProg.getUniformLocation("textureImage"))
+            mesh.draw()
+
+    def collectDraws(self, arena, parentMat, records):
+        """
+        Append the merged meshes to records, as Component.collectDraws does
+        """
+        Component.drawnMeshes += len(self.meshes)
+        for mesh, color in self.meshes:
+            allocation, meshMat = mesh.allocate(arena)
+            records.append((allocation, parentMat @ meshMat, color))
+
+    def collectTransforms(self, parentMat, records):
+        """
+        Append the merged meshes to records, as Component.collectTransforms does
+        """
+        Component.drawnMeshes += len(self.meshes)
+        for mesh, color in self.meshes:
+            if mesh.vao is None:
+                mesh.initialize()
+            records.append((mesh, parentMat, color, None))
+
+    def worldBounds(self, parentMat):
+        """
+        :return: world box or None without meshes, as Component.meshBounds
+        :rtype: numpy.ndarray
+        """
+        if self.aabb is None:
+            return None
+        return transformBox(self.aabb, parentMat)
+
+    def isVisible(self, frustum, parentMat):
+        """
+        Whether the merged meshes may be inside frustum, counted in Component.culledMeshes when not
+        """
+        box = self.worldBounds(parentMat)
+        if box is None or frustum.classify(box) != Frustum.OUTSIDE:
+            return True
+        Component.culledMeshes += len(self.meshes)
+        return False
+
+    def drawCount(self):
+        return len(self.meshes)
+
+
+def bakeStatic(root):
+    """
+    Bake every largest static subtree strictly below root. Call root.update first
+
+    :type root: Component
+    :return: the bakes made
+    :rtype: list<StaticBake>
+    """
+    # post-order: a subtree is mergeable when its root and all its descendants are
+    order = []
+    stack = [root]
+    while stack:
+        c = stack.pop()
+        order.append(c)
+        stack.extend(c.children)
+    mergeable = {}
+    for c in reversed(order):
+        mergeable[c] = isMergeable(c) and all(mergeable[child] for child in c.children)
+
+    bakes = []
+    stack = list(root.children)
+    while stack:
+        c = stack.pop()
+        if mergeable[c]:
+            if c.bake is None:
+                bakes.append(StaticBake(c))
+        else:
+            stack.extend(c.children)
+    return bakes
+
+
+def dropBakes(root):
+    """
+    Drop every bake in the tree of root, e.g. when the context their meshes were uploaded to is gone: the merged
+    meshes hold GL objects of that context and draw with its program, so they cannot be reused
+
+    :type root: Component
+    :return: the number of bakes dropped
+    :rtype: int
+    """
+    dropped = 0
+    stack = [root]
+    while stack:
+        c = stack.pop()
+        if c.bake is not None:
+            c.bake.invalidate()
+            dropped += 1
+        stack.extend(c.children)
+    return dropped
+
+
+if __name__ == "__main__":
+    import time
+
+    from ModelAxes import ModelAxes
+    from ModelLinkage import ModelLinkage
+    from Point import Point
+    from Shapes import Cube
+
+    def best(f, rounds=20):
+        times = []
+        for _ in range(rounds):
+            t1 = time.perf_counter()
+            f()
+            times.append(time.perf_counter() - t1)
+        return min(times) * 1000
+
+    def worldVertices(c):
+        vertices = transformVertices(c.displayObj.vertices, c.transformationMat @ c.displayObj.sizeMat)
+        return vertices[:, 0:3]
+
+    def scaffold(depth, branching=3):
+        # a static frame: pinned cubes in a few colors
+        root = Cube(Point((0, 0.2, 0)), None, [0.05, 0.05, 0.2], ColorType(depth % 3 == 0, depth % 3 == 1, 0.5))
+        root.setDefaultAngle(15.0 * depth, root.AXIS_V)
+        if depth > 0:
+            for i in range(branching):
+                child = scaffold(depth - 1, branching)
+                child.setDefaultPosition(Point((0.1 * (i - 1), 0.2, 0)))
+                root.addChild(child)
+        return root
+
+    def pin(root):
+        stack = [root]
+        while stack:
+            c = stack.pop()
+            for axis in (c.AXIS_U, c.AXIS_V, c.AXIS_W):
+                c.setRotateExtent(axis, c.angles[axis], c.angles[axis])
+            stack.extend(c.children)
+
+    # the baked vertices are where the components would have put them
+    top = Component(Point((0, 0, 0)))
+    model = ModelLinkage(None, Point((0, 0, 0)), None)
+    axes = ModelAxes(None, Point((-1, -1, -1)), None)
+    top.addChild(model)
+    top.addChild(axes)
+    top.update(np.identity(4))
+    expected = {tuple(c.current_color): worldVertices(c) for c in axes.components}
+    bakes = bakeStatic(top)
+    assert [b.root for b in bakes] == [axes] and axes.bake.drawCount() == 3
+    for mesh, color in axes.bake.meshes:
+        assert np.allclose(mesh.vertices[:, 0:3], expected[tuple(color)], atol=1e-5)
+
+    # any change inside the subtree drops the bake, and the regular update picks the subtree up again
+    parentMat = np.identity(4)
+    parentMat[0:3, 3] = (0.5, 0, 0)
+    top.update(parentMat)
+    axes.components[1].setDefaultPosition(Point((0, 0.5, 0)))
+    assert axes.bake is None and axes.components[0].bakedIn is None and StaticBake.resetCounters() == 1
+    top.update(parentMat)
+    reference = top.transformationMat @ axes.localMat @ axes.components[1].localMat
+    assert np.allclose(axes.components[1].transformationMat, reference)
+    bakeStatic(top)
+    axes.components[2].setRotateExtent(Component.AXIS_U, -30, 30)
+    assert axes.bake is None
+    bakeStatic(top)
+    axes.components[0].setCurrentColor(ColorType(1, 1, 0))
+    assert axes.bake is None
+
+    print(f"{'static nodes':>13}{'bakes':>7}{'draws before':>14}{'draws after':>13}{'update ms before':>18}"
+          f"{'update ms after':>17}{'bake ms':>9}")
+    for depth in (3, 5, 6):
+        top = Component(Point((0, 0, 0)))
+        frames = [scaffold(depth) for _ in range(4)]
+        for frame in frames:
+            pin(frame)
+            top.addChild(frame)
+        top.update(np.identity(4))
+        stack = list(top.children)
+        count = 0
+        while stack:
+            c = stack.pop()
+            count += 1
+            stack.extend(c.children)
+
+        moves = [np.identity(4) for _ in range(2)]
+        moves[1][0:3, 3] = (0.1, 0, 0)
+        frame = [0]
+
+        def moveRoot():
+            # the parent moves every frame, so every world matrix below it is stale
+            frame[0] += 1
+            top.update(moves[frame[0] % 2])
+
+        before = best(moveRoot)
+        t1 = time.perf_counter()
+        bakes = bakeStatic(top)
+        bakeTime = (time.perf_counter() - t1) * 1000
+        after = best(moveRoot)
+        draws = sum(b.drawCount() for b in bakes)
+        print(f"{count:>13}{len(bakes):>7}{count:>14}{draws:>13}{before:>18.3f}{after:>17.3f}{bakeTime:>9.1f}")